@@ -0,0 +1,91 @@
+"""
+Cold start benchmark: parsing Instruct files from source vs. loading a precompiled bundle.
+
+Usage:
+    python benchmarks/bench_bundle.py [number_of_files]
+"""
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from instruct.bundle import compile_bundle
+
+TEMPLATE = """---
+models:
+  - mistral-large
+  - gpt-4o
+---
+YOUR CONTEXT
+{{some_knowledge}}
+
+USER NAME
+{{username}}
+
+{% if user_company_knowledge %}USER'S COMPANY KNOWLEDGE
+{{user_company_knowledge}}{% endif %}
+
+TASK TO ACCOMPLISH #{{ index }}
+{{task_name}}: {{task_definition}}
+
+USER INPUTS
+{{ user_task_inputs | tojson(indent=4) }}
+
+{% for message in messages %}<message role="{{ message.role }}">{{ message.content }}</message>
+{% endfor %}
+{% if model in ["mistral:instruct"] %}
+EXAMPLES OF GOOD EXECUTIONS OF THE TASK SUMMARIZATION:
+<title>Structuration d'une Note de Musique</title>
+<summary>Assistance fournie pour transformer des idées en un document structuré.</summary>
+{% endif %}
+Format:
+<title>TITLE</title>
+<summary>SUMMARY</summary>
+"""
+
+# Runs in a fresh interpreter so that nothing is warm: only the loading is timed.
+COLD_START = """
+import json, sys, time
+from pathlib import Path
+start = time.perf_counter()
+from instruct.template_cache import template_cache
+if sys.argv[2]:
+    from instruct.bundle import load_bundle
+    load_bundle(sys.argv[2])
+for filepath in sorted(Path(sys.argv[1]).glob("*.instruct")):
+    template_cache.get(str(filepath))
+print(json.dumps({"seconds": time.perf_counter() - start, **template_cache.stats}))
+"""
+
+
+def cold_start(directory, bundle_path=""):
+    output = subprocess.run(
+        [sys.executable, "-c", COLD_START, str(directory), str(bundle_path)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main(number_of_files=300, repeat=5):
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        for index in range(number_of_files):
+            (directory / f"task_{index}.instruct").write_text(
+                TEMPLATE.replace("{{ index }}", str(index))
+            )
+        bundle_path, _, _ = compile_bundle(directory)
+
+        source = min((cold_start(directory) for _ in range(repeat)), key=lambda r: r["seconds"])
+        bundle = min((cold_start(directory, bundle_path) for _ in range(repeat)), key=lambda r: r["seconds"])
+
+    print(f"{number_of_files} Instruct files, best of {repeat} cold starts")
+    print(f"  from source: {source['seconds'] * 1000:8.1f} ms  ({source['misses']} parsed)")
+    print(f"  from bundle: {bundle['seconds'] * 1000:8.1f} ms  ({bundle['misses']} parsed)")
+    print(f"  speedup:     {source['seconds'] / bundle['seconds']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
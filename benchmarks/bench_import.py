@@ -0,0 +1,58 @@
+"""
+Cold start benchmark of `instruct models`: fails (exit code 1) when it gets slower than
+a threshold, or when it imports one of the heavy dependencies only needed to call a model
+or to show the GUI.
+
+Usage:
+    python benchmarks/bench_import.py [threshold_seconds]
+"""
+import json
+import subprocess
+import sys
+
+DEFAULT_THRESHOLD = 1.0  # seconds
+
+# Must stay out of the commands that do not call a model.
+HEAVY_MODULES = ["litellm", "openai", "httpx", "textual", "rich.markdown", "pyperclip", "tiktoken", "tokenizers"]
+
+# Runs in a fresh interpreter so that nothing is warm.
+COLD_START = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+from instruct.main import app
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        app(["models"])
+    except SystemExit:
+        pass
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "heavy": [m for m in json.loads(sys.argv[1]) if m in sys.modules]}))
+"""
+
+
+def cold_start():
+    output = subprocess.run(
+        [sys.executable, "-c", COLD_START, json.dumps(HEAVY_MODULES)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(threshold=DEFAULT_THRESHOLD, repeat=5):
+    best = min((cold_start() for _ in range(repeat)), key=lambda r: r["seconds"])
+
+    print(f"`instruct models`, best of {repeat} cold starts: {best['seconds'] * 1000:.1f} ms (threshold {threshold * 1000:.0f} ms)")
+    failed = False
+    if best["seconds"] > threshold:
+        print("  FAILED: cold start regressed over the threshold")
+        failed = True
+    if best["heavy"]:
+        print(f"  FAILED: heavy modules imported: {', '.join(best['heavy'])}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_THRESHOLD))
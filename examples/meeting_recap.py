@@ -23,17 +23,12 @@ def run_meeting_recap(notes: str, verbose: bool = True):
     meeting_recap_run = instruct.run(temperature=0.0, max_tokens=1000)
     
     # meeting_recap.instruct run output can be either <meeting_recap> tag or <question_to_ask> tag
-    # As the models tend to talk more, we parse the output to extract only the tags
+    # As the models tend to talk more, we only keep the tags, parsed in `instruct.sections`
     try:
-        meeting_recap, question_to_ask, scratchpad = None, None, None
-
         # Now, we can implement logic to the program
-        if "<meeting_recap>" in meeting_recap_run:
-            meeting_recap = meeting_recap_run.split("<meeting_recap>")[1].split("</meeting_recap>")[0]
-        if "<question_to_ask>" in meeting_recap_run:
-            question_to_ask = meeting_recap_run.split("<question_to_ask>")[1].split("</question_to_ask>")[0]
-        if "<scratchpad>" in meeting_recap_run:
-            scratchpad = meeting_recap_run.split("<scratchpad>")[1].split("</scratchpad>")[0]
+        meeting_recap = instruct.sections.get("meeting_recap")
+        question_to_ask = instruct.sections.get("question_to_ask")
+        scratchpad = instruct.sections.get("scratchpad")
 
 
         if verbose:
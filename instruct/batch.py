@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import os
+
+from instruct.event_loop import run_sync
+from instruct.llm_engine.concurrency import ModelLimits
+
+DEFAULT_WORKERS = 8
+
+
+def read_records(filepath: str) -> list:
+    """
+    Reads the input records of a batch: one JSON object of template values per line.
+
+    Args:
+        filepath (str): The inputs JSONL filepath.
+
+    Returns:
+        list: The records.
+    """
+    with open(filepath, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def read_checkpoint(output: str, records: list = None) -> dict:
+    """
+    Reads the results already written to a batch output, to resume an interrupted batch.
+    Records without result (failed calls) are run again.
+
+    Args:
+        output (str): The output JSONL filepath.
+        records (list): The records of the batch. When given, results whose input is not
+            the record at their index (the inputs file was edited or reordered) are dropped.
+
+    Returns:
+        dict: The results by record index.
+    """
+    done = {}
+    if output is None or not os.path.exists(output):
+        return done
+    with open(output, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # last line of a crashed run may be truncated
+                continue
+            if entry.get("result") is None:
+                continue
+            index = entry["index"]
+            # the input as it was written, e.g. tuples become lists
+            if records is not None and (index >= len(records) or entry.get("input") != json.loads(json.dumps(records[index]))):
+                continue
+            done[index] = entry["result"]
+    return done
+
+
+def _write_ordered(output: str, records: list, results: list):
+    # rewrite the output in input order once the batch is complete
+    tmp_output = f"{output}.tmp"
+    with open(tmp_output, "w") as f:
+        for index, (record, result) in enumerate(zip(records, results)):
+            f.write(json.dumps({"index": index, "input": record, "result": result}) + "\n")
+    os.replace(tmp_output, output)
+
+
+async def arun_batch(
+    instruct,
+    records: list,
+    output: str = None,
+    workers: int = DEFAULT_WORKERS,
+    **run_kwargs,
+) -> list:
+    """
+    Runs an Instruct over many records of template values, concurrently.
+
+    `workers` worker tasks take the records one at a time, so at most `workers` calls are
+    in flight, and at most `max_concurrency` per model when set in models.yaml. A record
+    whose model is saturated is parked, so that the workers keep running the other models. Each result is appended to `output` as soon as it completes;
+    re-running the same batch with the same output resumes where it stopped.
+    Once the batch is complete, the output is rewritten in input order.
+
+    Args:
+        instruct (Instruct): The Instruct to run, its kwargs are the defaults of every record.
+        records (list): The template values of each run.
+        output (str): The output JSONL filepath, also used as checkpoint.
+        workers (int): The maximum number of concurrent calls.
+        **run_kwargs: Arguments of `Instruct.arun` (temperature, max_tokens...).
+
+    Returns:
+        list: The results, in input order (None for failed calls).
+    """
+    results = [None] * len(records)
+    done = read_checkpoint(output, records)
+    for index, result in done.items():
+        results[index] = result
+
+    pending = [index for index in range(len(records)) if index not in done]
+    if done:
+        logging.info(f"{instruct} > resuming batch: {len(done)} done, {len(pending)} to run")
+
+    queue = asyncio.Queue()
+    for index in pending:
+        queue.put_nowait(index)
+    limits = ModelLimits(workers)
+    parked = {}  # model slot -> records (index, bound, slot) waiting for it
+    writer = open(output, "a") if output else None
+
+    def prepare(index):
+        # the slot of the expected model, to schedule the record: the call itself takes the
+        # slot of the model it goes to, which routing or hedging may change
+        bound = instruct.bind(**records[index])
+        return index, bound, limits.slot(bound._run_model())
+
+    def take_parked(free_slot=True):
+        for slot, jobs in parked.items():
+            if jobs and not (free_slot and slot.locked()):
+                return jobs.pop(0)
+        return None
+
+    async def run_record(index, bound):
+        result = await bound.arun(**run_kwargs)
+        results[index] = result
+        if writer is not None:
+            writer.write(json.dumps({"index": index, "input": records[index], "result": result}) + "\n")
+            writer.flush()
+
+    async def worker():
+        # one record at a time: only the records in flight (or parked) are bound
+        while True:
+            job = take_parked()
+            if job is None and queue.empty():
+                job = take_parked(free_slot=False)
+                if job is None:
+                    return
+            elif job is None:
+                index = queue.get_nowait()
+                try:
+                    job = prepare(index)
+                except Exception as e:
+                    logging.error(f"Error running batch record {index} > {e}")
+                    continue
+                if job[2].locked() and sum(len(jobs) for jobs in parked.values()) < workers:
+                    # its model is saturated: park it rather than keep the worker from other models
+                    parked.setdefault(job[2], []).append(job)
+                    continue
+            try:
+                await run_record(job[0], job[1])
+            except Exception as e:
+                logging.error(f"Error running batch record {job[0]} > {e}")
+
+    token = limits.activate()
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(workers, len(pending)))))
+    finally:
+        limits.deactivate(token)
+        if writer is not None:
+            writer.close()
+
+    if output is not None:
+        _write_ordered(output, records, results)
+    return results
+
+
+def run_batch(instruct, records: list, output: str = None, workers: int = DEFAULT_WORKERS, **run_kwargs) -> list:
+    """
+    Synchronous version of `arun_batch`.
+    """
+    return run_sync(arun_batch(instruct, records, output, workers, **run_kwargs), "instruct.arun_batch()")
@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import platform
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+DEFAULT_ROUNDS = 200
+DEFAULT_MODEL_ROUNDS = 3
+DEFAULT_TOLERANCE = 0.2  # relative change flagged as a regression
+
+BENCH_TEMPLATE = """---
+models:
+  - bench
+---
+YOUR CONTEXT
+{{some_knowledge}}
+
+{% if user_company_knowledge %}USER'S COMPANY KNOWLEDGE
+{{user_company_knowledge}}{% endif %}
+
+TASK TO ACCOMPLISH
+{{task_name}}: {{task_definition}}
+
+{% for message in messages %}<message role="{{ message.role }}">{{ message.content }}</message>
+{% endfor %}
+Format:
+<title>TITLE</title>
+<summary>SUMMARY</summary>
+"""
+
+BENCH_VALUES = {
+    "some_knowledge": "Instruct files are Jinja2 templates with a YAML header. " * 20,
+    "task_name": "Summarize",
+    "task_definition": "write a title and a one sentence summary of the conversation",
+    "messages": [{"role": "user" if i % 2 else "assistant", "content": f"Message number {i}"} for i in range(20)],
+}
+
+MODEL_PROMPT = "Count from 1 to 20, separated by spaces."
+
+
+def measure(function: Callable, rounds: int = DEFAULT_ROUNDS, warmup: int = 1) -> dict:
+    """
+    Times a function over several rounds, after some warmup calls.
+
+    Args:
+        function (Callable): The function to time, called without arguments.
+        rounds (int): The number of timed calls.
+        warmup (int): The number of calls before timing.
+
+    Returns:
+        dict: min, median, mean, stddev (seconds), ops (calls per second) and rounds.
+    """
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    mean = statistics.mean(timings)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": mean,
+        "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "ops": 1 / mean if mean else None,
+        "rounds": rounds,
+        "unit": "s",
+        "better": "lower",
+    }
+
+
+def _write_bench_file(directory: str) -> str:
+    path = os.path.join(directory, "bench.instruct")
+    with open(path, "w") as f:
+        f.write(BENCH_TEMPLATE)
+    return path
+
+
+def bench_local(filepath: str = None, rounds: int = DEFAULT_ROUNDS) -> dict:
+    """
+    Benchmarks the local steps of a run, without network: models.yaml load, file parse
+    (cold and cached), render, and the per-call overhead of `Instruct.run` against a
+    mock model answering instantly.
+
+    Args:
+        filepath (str): The Instruct file to benchmark. Defaults to a built-in template.
+        rounds (int): The number of timed calls of each step.
+
+    Returns:
+        dict: The measures by benchmark name (see `measure`).
+    """
+    if filepath is None:
+        with tempfile.TemporaryDirectory(prefix="instruct-bench-") as directory:
+            return _bench_local(_write_bench_file(directory), BENCH_VALUES, rounds)
+    return _bench_local(filepath, {}, rounds)
+
+
+def _bench_local(filepath: str, values: dict, rounds: int) -> dict:
+    from instruct.instruct import Instruct
+    from instruct.llm_engine.mock import MockModel
+    from instruct.llm_engine.model_loader import ModelLoader
+    from instruct.template_cache import TemplateCache
+
+    results = {}
+
+    model_loader = ModelLoader()
+    results["model_config_load"] = measure(model_loader._load_models, rounds=max(rounds // 10, 1))
+
+    # a cache of its own: clearing the process-wide one would drop the templates of the process
+    template_cache = TemplateCache()
+
+    def cold_parse():
+        template_cache.clear()
+        template_cache.get(filepath)
+
+    results["parse"] = measure(cold_parse, rounds)
+    results["parse_cached"] = measure(lambda: template_cache.get(filepath), rounds)
+
+    instruct = Instruct(filepath, **values)
+    results["render"] = measure(lambda: instruct.render_with(), rounds)
+
+    instruct.forced_model = MockModel("mock/bench", "bench", response="<title>T</title><summary>S</summary>")
+    # the prompt is memoized: only the orchestration around the model call is timed
+    results["call_overhead"] = measure(lambda: instruct.run(temperature=0, max_tokens=50, cache=False), rounds)
+    return results
+
+
+def bench_model(model, rounds: int = DEFAULT_MODEL_ROUNDS, max_tokens: int = 100) -> dict:
+    """
+    Measures the time to first token, the generation speed and the total duration of a model,
+    streaming a short completion `rounds` times.
+
+    Args:
+        model (Model): The model to benchmark.
+        rounds (int): The number of completions.
+        max_tokens (int): The maximum number of tokens of each completion.
+
+    Returns:
+        dict: The `ttft`, `tokens_per_second` and `completion` measures, or the `error`.
+    """
+    ttfts, speeds, durations = [], [], []
+    messages = [{"role": "user", "content": MODEL_PROMPT}]
+    try:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            first_token, deltas, usage = None, [], None
+            for chunk in model.stream(messages, 0, max_tokens):
+                if first_token is None and chunk.delta:
+                    first_token = time.perf_counter()
+                deltas.append(chunk.delta)
+                usage = chunk.usage or usage
+            end = time.perf_counter()
+            tokens = (usage or {}).get("completion_tokens") or model.count_tokens("".join(deltas))
+            first_token = first_token or end
+            ttfts.append(first_token - start)
+            durations.append(end - start)
+            if end > first_token and tokens > 1:
+                speeds.append((tokens - 1) / (end - first_token))
+    except Exception as e:
+        logging.error(f"Error benchmarking {model.name} > {e}")
+        return {"error": str(e)}
+
+    def summary(values, unit, better):
+        return {
+            "median": statistics.median(values),
+            "min": min(values),
+            "mean": statistics.mean(values),
+            "rounds": len(values),
+            "unit": unit,
+            "better": better,
+        }
+
+    results = {"ttft": summary(ttfts, "s", "lower"), "completion": summary(durations, "s", "lower")}
+    if speeds:
+        results["tokens_per_second"] = summary(speeds, "tokens/s", "higher")
+    return results
+
+
+def run_bench(
+    filepath: str = None,
+    rounds: int = DEFAULT_ROUNDS,
+    models: list = None,
+    model_rounds: int = DEFAULT_MODEL_ROUNDS,
+) -> dict:
+    """
+    Runs the benchmark suite: the local steps, then each model given.
+
+    Args:
+        filepath (str): The Instruct file of the local benchmarks. Defaults to a built-in template.
+        rounds (int): The number of timed calls of each local step.
+        models (list): The models to benchmark over the network, none by default.
+        model_rounds (int): The number of completions per model.
+
+    Returns:
+        dict: The report: environment and measures by benchmark name,
+            model benchmarks being named `<measure>[<model key>]`.
+    """
+    benchmarks = bench_local(filepath, rounds)
+    errors = {}
+    for model in models or []:
+        for name, result in bench_model(model, model_rounds).items():
+            if name == "error":
+                errors[model.model] = result
+            else:
+                benchmarks[f"{name}[{model.model}]"] = result
+    return {
+        "version": 1,
+        "created": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "file": filepath,
+        "benchmarks": benchmarks,
+        "errors": errors,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """
+    Compares the medians of a report with a baseline report.
+
+    Args:
+        report (dict): The current report (see `run_bench`).
+        baseline (dict): The baseline report.
+        tolerance (float): The relative change above which a slowdown is a regression.
+
+    Returns:
+        list: One dict per benchmark found in both reports: name, baseline, current,
+            change (relative, positive when worse) and regression (bool).
+    """
+    comparisons = []
+    for name, current in report["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous or not previous.get("median"):
+            continue
+        change = (current["median"] - previous["median"]) / previous["median"]
+        if current.get("better") == "higher":
+            change = -change
+        comparisons.append({
+            "name": name,
+            "baseline": previous["median"],
+            "current": current["median"],
+            "unit": current.get("unit", "s"),
+            "change": change,
+            "regression": change > tolerance,
+        })
+    return comparisons
+
+
+def load_report(filepath: str) -> dict:
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+
+def save_report(report: dict, filepath: str):
+    with open(filepath, "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,140 @@
+import importlib.util
+import logging
+import marshal
+import os
+import pickle
+from pathlib import Path
+
+import jinja2
+
+from instruct.template_cache import (
+    ParsedInstruct,
+    TemplateCache,
+    compile_content,
+    content_digest,
+    template_cache,
+    template_from_code,
+)
+
+BUNDLE_FILENAME = "instruct.bundle"
+BUNDLE_FORMAT = 1
+INSTRUCT_EXTENSION = ".instruct"
+
+
+def _bundle_runtime() -> dict:
+    # compiled code objects are only valid for the same Python bytecode and Jinja2 version
+    return {
+        "format": BUNDLE_FORMAT,
+        "python": importlib.util.MAGIC_NUMBER,
+        "jinja2": jinja2.__version__,
+    }
+
+
+def compile_bundle(directory: str, output: str = None):
+    """
+    Compiles every Instruct file of a directory (recursively) into a single bundle.
+
+    The bundle holds, for each file, its parsed header, its compiled Jinja2 code object,
+    its template values and tags, along with the mtime, size and content hash used to
+    detect stale entries when it is loaded.
+
+    Args:
+        directory (str): The directory containing the Instruct files.
+        output (str): The bundle filepath. Defaults to `<directory>/instruct.bundle`.
+
+    Returns:
+        tuple: The bundle filepath, the list of compiled files and the list of skipped files.
+    """
+    directory = Path(directory)
+    output = Path(output) if output else directory / BUNDLE_FILENAME
+
+    entries = {}
+    skipped = []
+    for filepath in sorted(directory.rglob(f"*{INSTRUCT_EXTENSION}")):
+        relative_path = filepath.relative_to(directory).as_posix()
+        try:
+            content = filepath.read_text()
+            stat = filepath.stat()
+            compiled = compile_content(content)
+        except Exception as e:
+            logging.warning(f"Skipping {filepath} > {e}")
+            skipped.append(relative_path)
+            continue
+
+        entries[relative_path] = {
+            "signature": (stat.st_mtime_ns, stat.st_size),
+            "digest": content_digest(content),
+            "header": compiled["header"],
+            "raw_template": compiled["raw_template"],
+            "code": marshal.dumps(compiled["code"]),
+            "template_values": compiled["template_values"],
+            "tags": compiled["tags"],
+        }
+
+    bundle = {
+        **_bundle_runtime(),
+        # the root is stored relative to the bundle so that the pair can be deployed anywhere
+        "root": os.path.relpath(directory.resolve(), output.resolve().parent),
+        "entries": entries,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "wb") as f:
+        pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return output, list(entries), skipped
+
+
+def load_bundle(bundle_path: str, cache: TemplateCache = template_cache) -> int:
+    """
+    Loads a bundle produced by `compile_bundle` into the template cache.
+
+    Entries are checked against the source files on first use: a file whose mtime or
+    size changed is hashed, and parsed again from source if its content differs.
+    The cache is grown if needed so that the whole bundle fits in it.
+
+    Args:
+        bundle_path (str): The bundle filepath.
+        cache (TemplateCache): The cache to load the bundle into.
+
+    Returns:
+        int: The number of Instruct files loaded.
+    """
+    bundle_path = Path(bundle_path)
+    with open(bundle_path, "rb") as f:
+        bundle = pickle.load(f)
+
+    runtime = _bundle_runtime()
+    if any(bundle.get(key) != value for key, value in runtime.items()):
+        raise ValueError(
+            f"Bundle {bundle_path} was compiled for another runtime, run `instruct compile` again"
+        )
+
+    root = bundle_path.resolve().parent / bundle["root"]
+    entries = bundle["entries"]
+    cache.maxsize = max(cache.maxsize, len(entries))
+    for relative_path, entry in entries.items():
+        parsed = ParsedInstruct(
+            entry["header"],
+            entry["raw_template"],
+            template_from_code(marshal.loads(entry["code"])),
+            entry["digest"],
+            entry["template_values"],
+            entry["tags"],
+        )
+        cache.preload(str(root / relative_path), entry["signature"], parsed)
+
+    return len(entries)
+
+
+def load_default_bundle():
+    """
+    Loads the bundle set in the `INSTRUCT_BUNDLE` environment variable, if any.
+    A missing or outdated bundle is logged and Instruct files are parsed from source.
+    """
+    bundle_path = os.environ.get("INSTRUCT_BUNDLE")
+    if not bundle_path:
+        return
+    try:
+        load_bundle(bundle_path)
+    except Exception as e:
+        logging.error(f"Error loading bundle {bundle_path} > {e}")
@@ -1,34 +1,42 @@
 from instruct.instruct import Instruct
 from instruct.sample import generate_sample_values
 from instruct.data_entry import DataEntry
-import yaml
+from instruct.file_value import load_input
+from instruct.llm_engine.usage import format_usage
+from instruct.tracing import SpanCollector, register_hook, unregister_hook
 from rich.console import Console
-from rich.markdown import Markdown
 from rich.text import Text
 import os
 import time
 
 console = Console()
 
-def run_console(filepath, input=None, output=None, temperature=0, max_tokens=200, model=None, ask_feedback=False, interactivity=True):
+def run_console(filepath, input=None, output=None, temperature=0, max_tokens=200, model=None, ask_feedback=False, interactivity=True, hedge=False, hedge_delay=2.0):
+    # the steps of the run, model config load and file parse included
+    spans = SpanCollector()
+    register_hook(spans)
     try:
         console.log(f"Running: [bold green]{filepath}[/bold green]")
         start_time = time.time()
 
         if input:
             console.log(f"Input file: [bold]{input}[/bold]")
-            with open(input, "r") as f:
-                values = yaml.load(f, Loader=yaml.FullLoader)
+            values = load_input(input)
         else:
             values = generate_sample_values(os.path.abspath(filepath), console=console)
             if values:
                 console.log(f"Generated input: [dim]{values}[/dim]")
 
         instruct = Instruct(filepath, forced_model=model, **values)
-        console.log(f"[dim blue]Now running with: [/dim blue][bold green]{instruct.matching_model.name}[/bold green][dim blue] with Temp.: {temperature}, {max_tokens} tokens max[/dim blue]")
-        result = instruct.run(temperature=temperature, max_tokens=max_tokens)
+        run_model = instruct.resolved_model
+        console.log(f"[dim blue]Now running with: [/dim blue][bold green]{run_model.name}[/bold green][dim blue] with Temp.: {temperature}, {max_tokens} tokens max[/dim blue]")
+        result = instruct.run(temperature=temperature, max_tokens=max_tokens, hedge=hedge, hedge_delay=hedge_delay)
 
-        console.print(Markdown(f"# Result with **{instruct.matching_model.name}** model:"))
+        from rich.markdown import Markdown
+
+        # routing, failover or hedging may have answered with another model
+        run_model = instruct.answered_model
+        console.print(Markdown(f"# Result with **{run_model.name}** model:"))
         console.print(Markdown(f"```markdown\n{result}\n```"))
 
         if output and result:
@@ -38,13 +46,27 @@ def run_console(filepath, input=None, output=None, temperature=0, max_tokens=200
 
         performance_text = Text(f"Total: {time.time() - start_time:.2f}s", style="italic dim")
         console.log(performance_text)
+        if instruct.usage:
+            console.log(Text(format_usage(instruct.usage), style="dim"))
+        if spans.spans:
+            console.log(Text(spans.summary(), style="dim"))
+        if hedge and instruct.hedge_report:
+            report = instruct.hedge_report
+            saved = report.get("latency_saved")
+            console.log(
+                f"[dim]Hedged: {'yes' if report['hedged'] else 'no'}, won by [bold]{report['winner']}[/bold]"
+                + (f", ~{saved:.2f}s saved" if saved else "")
+                + "[/dim]"
+            )
 
         if not interactivity:
             return
         feedback = console.input("Feedback (press Enter if satisfied): ") if ask_feedback else None
         feedback = feedback or "Default feedback: Satisfied with the result."
 
-        DataEntry(filepath, query=instruct.prompt, response=result, evaluation=feedback, model=instruct.matching_model.name).save()
+        DataEntry(filepath, query=instruct.prompt, response=result, evaluation=feedback, model=run_model.name, usage=instruct.usage).save()
 
     except Exception as e:
-        console.log(f"[bold red]Error running {filepath} > {e}[/bold red]")
\ No newline at end of file
+        console.log(f"[bold red]Error running {filepath} > {e}[/bold red]")
+    finally:
+        unregister_hook(spans)
\ No newline at end of file
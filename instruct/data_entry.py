@@ -1,10 +1,16 @@
-import jsonlines
 from datetime import datetime
 from pathlib import Path
-import filecmp
+
+from instruct.dataset import get_dataset_writer
+
 
 class DataEntry:
-    def __init__(self, instruct_file_path, query=None, response=None, evaluation=None, model=None):
+    """
+    A record of a run of an Instruct file, saved in `~/.instruct/dataset/<name>/<version>/data.jsonl`
+    (or in the SQLite store with INSTRUCT_DATASET_BACKEND=sqlite) through the shared `dataset.DatasetWriter`.
+    """
+
+    def __init__(self, instruct_file_path, query=None, response=None, evaluation=None, model=None, usage=None):
         try:
             self.instruct_file_path = Path(instruct_file_path)
             self.instruct_file_name = self.instruct_file_path.stem
@@ -12,59 +18,32 @@ class DataEntry:
             self.response = response
             self.evaluation = evaluation
             self.model = model
+            # tokens, cost and latency of the run, see llm_engine/usage.py
+            self.usage = usage if usage is not None else getattr(response, "usage", None)
             self.dateCreated = datetime.now().isoformat()
-            self.default_path = Path.home() / ".instruct" / "dataset"
+            self.writer = get_dataset_writer()
+            self.default_path = self.writer.dataset_path
             self.dataset_path = self.default_path / self.instruct_file_name
-            self.version_path = self._determine_version_path()
+            self.version_path = self.writer.version_path(self.instruct_file_path)
         except Exception as e:
             print(f"Error initializing DataEntry: {e}")
             raise e
 
-    def _determine_version_path(self):
-        if not self.dataset_path.exists():
-            self.dataset_path.mkdir(parents=True, exist_ok=True)
-        
-        versions = sorted([d for d in self.dataset_path.iterdir() if d.is_dir() and d.name.isdigit()], key=lambda x: int(x.name))
-        
-        if not versions:
-            new_version_path = self.dataset_path / "1"
-            new_version_path.mkdir()
-            return new_version_path
-        
-        latest_version_path = versions[-1]
-        latest_instruct_file = latest_version_path / self.instruct_file_path.name
-        
-        current_instruct_file_path = self.instruct_file_path
-        
-        # compare the content of the latest instruct file with the current instruct file
-        if latest_instruct_file.exists() and filecmp.cmp(latest_instruct_file, current_instruct_file_path, shallow=False):
-            return latest_version_path
-        else:
-            new_version_number = int(latest_version_path.name) + 1
-            new_version_path = self.dataset_path / str(new_version_number)
-            new_version_path.mkdir()
-            return new_version_path
-
-    def _save_current_instruct_file(self):
-        instruct_file_path = self.version_path / self.instruct_file_path.name
-        if not instruct_file_path.exists():
-            with open(instruct_file_path, 'w') as instruct_file:
-                # read the file self.instruct_file_name and write its content to instruct_file
-                with open(self.instruct_file_path, 'r') as f:
-                    instruct_file.write(f.read())
-        return instruct_file_path
-
-    def save(self):
-        # if the file data.jsonl does not exist, create it and write the data
-        # otherwise, append the data to the file
-        jsonl_file_path = self.version_path / 'data.jsonl'
-        with jsonlines.open(jsonl_file_path, mode='a') as writer:
-            writer.write({
-                "query": self.query,
-                "response": self.response,
-                "evaluation": self.evaluation,
-                "model": self.model,
-                "dateCreated": self.dateCreated
-            })
-        self._save_current_instruct_file()
+    def save(self, flush=True):
+        """
+        Appends the record to the dataset of its Instruct file version.
 
+        Args:
+            flush (bool): Whether to write it right away. Otherwise, the record is buffered
+                and written with the next batch (see `DatasetWriter`).
+        """
+        self.writer.write(self.instruct_file_path, {
+            "query": self.query,
+            "response": self.response,
+            "evaluation": self.evaluation,
+            "model": self.model,
+            "usage": self.usage,
+            "dateCreated": self.dateCreated
+        })
+        if flush:
+            self.writer.flush()
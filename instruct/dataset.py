@@ -0,0 +1,481 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process locking
+    fcntl = None
+
+DEFAULT_DATASET_PATH = Path.home() / ".instruct" / "dataset"
+DEFAULT_FLUSH_INTERVAL = 1.0  # seconds
+DEFAULT_BUFFER_SIZE = 1000  # records
+
+INDEX_FILENAME = "index.json"
+LOCK_FILENAME = ".lock"
+DATA_FILENAME = "data.jsonl"
+STORE_FILENAME = "dataset.sqlite3"
+
+# `jsonl` (default): one data.jsonl file per version. `sqlite`: an indexed SQLite store (see DatasetStore).
+BACKEND_JSONL = "jsonl"
+BACKEND_SQLITE = "sqlite"
+
+
+def dataset_backend() -> str:
+    """
+    Returns the dataset backend, set with the INSTRUCT_DATASET_BACKEND environment variable.
+    """
+    backend = os.environ.get("INSTRUCT_DATASET_BACKEND", BACKEND_JSONL).lower()
+    if backend not in (BACKEND_JSONL, BACKEND_SQLITE):
+        raise ValueError(f"Unknown INSTRUCT_DATASET_BACKEND `{backend}`, expected `{BACKEND_JSONL}` or `{BACKEND_SQLITE}`")
+    return backend
+
+
+@contextmanager
+def file_lock(path: Path):
+    """
+    Holds an exclusive lock on a file (created if needed) across processes,
+    yielding the file opened for append.
+    """
+    with open(path, "a", encoding="utf-8") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def content_hash(filepath: Path) -> str:
+    with open(filepath, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class DatasetWriter:
+    """
+    Logs the runs of Instruct files into `~/.instruct/dataset/<name>/<version>/data.jsonl`,
+    at high volume, from several threads and processes.
+
+    Each version directory holds a copy of the Instruct file. Versions are found through a
+    content hash → version index (`<name>/index.json`), and the hash of an Instruct file is
+    only computed again when its modification time changes: logging a record costs a `stat`.
+    Records are buffered and appended in batches, every `flush_interval` seconds or
+    `buffer_size` records, and on exit. Version creation and appends are serialized across
+    processes with file locks.
+
+    Attributes:
+        dataset_path (Path): The root of the datasets.
+        flush_interval (float): The maximum time a record stays in memory, in seconds.
+        buffer_size (int): The number of buffered records triggering a flush.
+    """
+
+    def __init__(
+        self,
+        dataset_path: Path = None,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ):
+        self.dataset_path = Path(dataset_path or DEFAULT_DATASET_PATH)
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._versions = {}  # instruct file path -> (mtime_ns, size, version path)
+        self._buffers = {}  # version path -> (record, encoded record)
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        atexit.register(self.close)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # the records buffered by the parent are its own to write, and threads do not survive a fork
+        self._buffers, self._buffered = {}, 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def version_path(self, instruct_file_path) -> Path:
+        """
+        Returns the version directory of the current content of an Instruct file,
+        creating the version if the content is new.
+        """
+        key = os.fspath(instruct_file_path)
+        stat = os.stat(key)
+        cached = self._versions.get(key)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        instruct_file_path = Path(instruct_file_path)
+        version_path = self._resolve_version(instruct_file_path, content_hash(instruct_file_path))
+        self._versions[key] = (stat.st_mtime_ns, stat.st_size, version_path)
+        return version_path
+
+    def _resolve_version(self, instruct_file_path: Path, digest: str) -> Path:
+        dataset_path = self.dataset_path / instruct_file_path.stem
+        dataset_path.mkdir(parents=True, exist_ok=True)
+        # other processes may be creating versions of the same dataset
+        with file_lock(dataset_path / LOCK_FILENAME):
+            index = self._load_index(dataset_path, instruct_file_path.name)
+            version = index.get(digest)
+            if version is None:
+                versions = [int(d.name) for d in dataset_path.iterdir() if d.is_dir() and d.name.isdigit()]
+                version = max(versions, default=0) + 1
+                version_path = dataset_path / str(version)
+                version_path.mkdir()
+                with open(instruct_file_path, "rb") as source, open(version_path / instruct_file_path.name, "wb") as copy:
+                    copy.write(source.read())
+                index[digest] = version
+                self._save_index(dataset_path, index)
+        return dataset_path / str(version)
+
+    def _load_index(self, dataset_path: Path, instruct_file_name: str) -> dict:
+        try:
+            with open(dataset_path / INDEX_FILENAME, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Rebuilding {dataset_path / INDEX_FILENAME} > {e}")
+        # datasets written before the index: hash the Instruct file of each version
+        index = {}
+        for version_path in sorted(
+            (d for d in dataset_path.iterdir() if d.is_dir() and d.name.isdigit()), key=lambda d: int(d.name)
+        ):
+            saved_file = version_path / instruct_file_name
+            if saved_file.exists():
+                index.setdefault(content_hash(saved_file), int(version_path.name))
+        if index:
+            self._save_index(dataset_path, index)
+        return index
+
+    def _save_index(self, dataset_path: Path, index: dict):
+        tmp_path = dataset_path / f"{INDEX_FILENAME}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, dataset_path / INDEX_FILENAME)
+
+    def write(self, instruct_file_path, record: dict) -> Path:
+        """
+        Buffers a record of a run of an Instruct file.
+
+        Args:
+            instruct_file_path (str): The Instruct file that was run.
+            record (dict): The record (query, response, evaluation, model, usage, dateCreated...).
+
+        Returns:
+            Path: The version directory the record is written to.
+        """
+        version_path = self.version_path(instruct_file_path)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._buffers.setdefault(version_path, []).append((record, line))
+            self._buffered += 1
+            full = self._buffered >= self.buffer_size
+        if full:
+            self.flush()
+        else:
+            self._start_flusher()
+        return version_path
+
+    def flush(self):
+        """
+        Appends the buffered records to their data files.
+        """
+        with self._flush_lock:
+            with self._lock:
+                buffers, self._buffers, self._buffered = self._buffers, {}, 0
+            for version_path, entries in buffers.items():
+                try:
+                    self._append(version_path, entries)
+                except Exception as e:
+                    logging.error(f"Error writing {len(entries)} records of {version_path} > {e}")
+
+    def _append(self, version_path: Path, entries: list):
+        with file_lock(version_path / DATA_FILENAME) as f:
+            f.write("".join(line for _, line in entries))
+            f.flush()
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                self._flusher.start()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            if self._buffered:
+                self.flush()
+
+    def close(self):
+        """
+        Flushes the buffered records and stops the periodic flush.
+        """
+        self._closed.set()
+        self.flush()
+
+
+def read_entries(dataset_path: Path = None, name: str = None):
+    """
+    Reads the records of the JSONL datasets, in file order.
+
+    Args:
+        dataset_path (Path): The datasets directory. Defaults to `~/.instruct/dataset`.
+        name (str): Only read the dataset of this Instruct file (name without extension).
+
+    Yields:
+        tuple: The Instruct name, the version, the line number and the record.
+    """
+    dataset_path = Path(dataset_path or DEFAULT_DATASET_PATH)
+    if not dataset_path.exists():
+        return
+    for instruct_path in sorted(dataset_path.iterdir()):
+        if not instruct_path.is_dir() or (name is not None and instruct_path.name != name):
+            continue
+        versions = sorted((d for d in instruct_path.iterdir() if d.name.isdigit()), key=lambda d: int(d.name))
+        for version_path in versions:
+            data_path = version_path / DATA_FILENAME
+            if not data_path.exists():
+                continue
+            with open(data_path, "r", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        yield instruct_path.name, int(version_path.name), line_number, json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning(f"Skipped a malformed record of {data_path}:{line_number}")
+
+
+def _evaluation_text(evaluation):
+    # evaluations are free-form: structured ones are matched on their JSON
+    return evaluation if evaluation is None or isinstance(evaluation, str) else json.dumps(evaluation, ensure_ascii=False)
+
+
+class DatasetStore:
+    """
+    The records of the datasets in SQLite (`~/.instruct/dataset/dataset.sqlite3`), indexed by
+    Instruct name, version, model, date and evaluation, so that e.g. the poorly rated responses
+    of a model across versions are found without reading every file.
+    The versions (and their Instruct file copies) stay in the dataset directories.
+
+    Attributes:
+        path (Path): The SQLite database filepath.
+    """
+
+    COLUMNS = ("instruct", "version", "model", "date_created", "evaluation", "record", "source")
+
+    def __init__(self, dataset_path: Path = None):
+        dataset_path = Path(dataset_path or DEFAULT_DATASET_PATH)
+        dataset_path.mkdir(parents=True, exist_ok=True)
+        self.path = dataset_path / STORE_FILENAME
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "id INTEGER PRIMARY KEY, instruct TEXT, version INTEGER, model TEXT, date_created TEXT, "
+                "evaluation TEXT, record TEXT, source TEXT UNIQUE)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS records_instruct ON records (instruct, version)")
+            db.execute("CREATE INDEX IF NOT EXISTS records_model ON records (model, evaluation)")
+            db.execute("CREATE INDEX IF NOT EXISTS records_date ON records (date_created)")
+            db.execute("CREATE INDEX IF NOT EXISTS records_evaluation ON records (evaluation)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, sqlite3 connections are not shareable
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def insert(self, instruct: str, version: int, records: list, sources: list = None) -> int:
+        """
+        Inserts the records of an Instruct file version, in a single transaction.
+
+        Args:
+            instruct (str): The Instruct name (file name without extension).
+            version (int): The version.
+            records (list): The records (see `DataEntry`), as dicts or encoded JSON.
+            sources (list): Where each record comes from (e.g. `<file>:<line>` when migrated):
+                a record already inserted from the same source is skipped.
+
+        Returns:
+            int: The number of inserted records.
+        """
+        rows = []
+        for index, record in enumerate(records):
+            encoded = record if isinstance(record, str) else json.dumps(record, ensure_ascii=False)
+            record = json.loads(record) if isinstance(record, str) else record
+            rows.append((
+                instruct,
+                version,
+                record.get("model"),
+                record.get("dateCreated"),
+                _evaluation_text(record.get("evaluation")),
+                encoded.rstrip("\n"),
+                sources[index] if sources else None,
+            ))
+        with self._connection() as db:
+            before = db.total_changes
+            db.executemany(
+                f"INSERT OR IGNORE INTO records ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                rows,
+            )
+            return db.total_changes - before
+
+    def query(
+        self,
+        instruct: str = None,
+        version: int = None,
+        model: str = None,
+        evaluation: str = None,
+        since: str = None,
+        until: str = None,
+        limit: int = None,
+    ):
+        """
+        Streams the records matching every filter given, oldest first.
+
+        Args:
+            instruct (str): The Instruct name.
+            version (int): The version.
+            model (str): The model name.
+            evaluation (str): The evaluation, or a LIKE pattern when it contains `%`.
+            since (str): The first creation date (ISO 8601, e.g. `2024-10-01`).
+            until (str): The creation date to stop before (ISO 8601).
+            limit (int): The maximum number of records.
+
+        Yields:
+            dict: The records, with their `instruct` name and `version`.
+        """
+        conditions, parameters = [], []
+        for column, value in (("instruct", instruct), ("version", version), ("model", model)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if evaluation is not None:
+            conditions.append("evaluation LIKE ?" if "%" in evaluation else "evaluation = ?")
+            parameters.append(evaluation)
+        if since is not None:
+            conditions.append("date_created >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("date_created < ?")
+            parameters.append(until)
+        sql = "SELECT instruct, version, record FROM records"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY date_created, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        # a dedicated cursor: rows are fetched as they are consumed
+        for instruct_name, version_number, record in self._connection().execute(sql, parameters):
+            yield {"instruct": instruct_name, "version": version_number, **json.loads(record)}
+
+    def migrate(self, dataset_path: Path = None) -> int:
+        """
+        Imports the JSONL datasets. Records already imported are skipped, so that
+        it can run again to import the records written since.
+
+        Args:
+            dataset_path (Path): The datasets directory. Defaults to `~/.instruct/dataset`.
+
+        Returns:
+            int: The number of imported records.
+        """
+        imported, batch, key = 0, [], None
+        for instruct, version, line_number, record in read_entries(dataset_path):
+            if key != (instruct, version) or len(batch) >= DEFAULT_BUFFER_SIZE:
+                if batch:
+                    imported += self.insert(*key, [r for r, _ in batch], [s for _, s in batch])
+                key, batch = (instruct, version), []
+            batch.append((record, f"{instruct}/{version}/{DATA_FILENAME}:{line_number}"))
+        if batch:
+            imported += self.insert(*key, [r for r, _ in batch], [s for _, s in batch])
+        return imported
+
+
+class SQLiteDatasetWriter(DatasetWriter):
+    """
+    A DatasetWriter inserting the records in the DatasetStore instead of the data.jsonl files.
+    """
+
+    def __init__(self, dataset_path: Path = None, **kwargs):
+        super().__init__(dataset_path, **kwargs)
+        self.store = DatasetStore(self.dataset_path)
+
+    def _after_fork(self):
+        super()._after_fork()
+        # SQLite connections must not be used across a fork
+        self.store._local = threading.local()
+
+    def _append(self, version_path: Path, entries: list):
+        self.store.insert(version_path.parent.name, int(version_path.name), [line for _, line in entries])
+
+
+def query_records(dataset_path: Path = None, **filters):
+    """
+    Streams the saved records from the configured backend (see `dataset_backend`).
+    The JSONL backend is scanned linearly.
+
+    Args:
+        dataset_path (Path): The datasets directory. Defaults to `~/.instruct/dataset`.
+        **filters: The filters of `DatasetStore.query`.
+
+    Yields:
+        dict: The records, with their `instruct` name and `version`.
+    """
+    if dataset_backend() == BACKEND_SQLITE:
+        yield from DatasetStore(dataset_path).query(**filters)
+        return
+    evaluation = filters.get("evaluation")
+    evaluation_pattern = None
+    if evaluation is not None and "%" in evaluation:
+        # the LIKE pattern, case-insensitive as in SQLite
+        evaluation_pattern = re.compile(
+            "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in evaluation), re.IGNORECASE | re.DOTALL
+        )
+    count = 0
+    for instruct, version, _, record in read_entries(dataset_path, filters.get("instruct")):
+        if filters.get("limit") is not None and count >= filters["limit"]:
+            return
+        date_created = record.get("dateCreated") or ""
+        record_evaluation = _evaluation_text(record.get("evaluation"))
+        if (
+            (filters.get("version") is not None and version != filters["version"])
+            or (filters.get("model") is not None and record.get("model") != filters["model"])
+            or (evaluation is not None and not (
+                record_evaluation is not None
+                and (evaluation_pattern.fullmatch(record_evaluation) if evaluation_pattern else record_evaluation == evaluation)
+            ))
+            or (filters.get("since") is not None and date_created < filters["since"])
+            or (filters.get("until") is not None and date_created >= filters["until"])
+        ):
+            continue
+        count += 1
+        yield {"instruct": instruct, "version": version, **record}
+
+
+_dataset_writer = None
+
+
+def get_dataset_writer() -> DatasetWriter:
+    """
+    Returns the dataset writer shared by the process, for the configured backend.
+    """
+    global _dataset_writer
+    if _dataset_writer is None:
+        _dataset_writer = SQLiteDatasetWriter() if dataset_backend() == BACKEND_SQLITE else DatasetWriter()
+    return _dataset_writer
@@ -0,0 +1,40 @@
+import asyncio
+import threading
+
+_local = threading.local()
+
+
+class RunningLoopError(RuntimeError):
+    """
+    Raised when a sync method needing the event loop (sampling, hedging, batch) is called
+    from a running event loop, e.g. in Jupyter, Textual or any async code.
+    """
+
+
+def run_sync(coroutine, alternative: str):
+    """
+    Runs a coroutine from sync code, on an event loop kept for the thread: the pooled async
+    clients of the models, bound to their loop (see `ConnectionPool.async_client`), are reused
+    by the next calls instead of being created, and left open, on a new loop each time.
+
+    Args:
+        coroutine (Coroutine): The coroutine to run.
+        alternative (str): The async method to use instead from a running loop, e.g. `instruct.arun()`.
+
+    Returns:
+        The result of the coroutine.
+
+    Raises:
+        RunningLoopError: When an event loop is already running in the thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        coroutine.close()
+        raise RunningLoopError(f"An event loop is already running in this thread: use `await {alternative}` instead")
+    loop = getattr(_local, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _local.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
@@ -0,0 +1,132 @@
+import codecs
+import mmap
+import os
+import threading
+import weakref
+
+import yaml
+
+
+class FileValue:
+    """
+    A template value backed by a file.
+
+    The file is only read when the template renders the value, through a memory map,
+    and decoded on each rendering: the decoded text is not kept, only the prompt it is
+    rendered into. Use `file_value()` to get deduplicated instances.
+
+    Attributes:
+        path (str): The real path of the file.
+        encoding (str): The encoding used to decode the file.
+    """
+
+    def __init__(self, path: str, encoding: str = "utf-8"):
+        self.path = os.path.realpath(path)
+        self.encoding = encoding
+
+    @property
+    def text(self) -> str:
+        """
+        The decoded content of the file, read on each access.
+        """
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # decode straight from the mapping, without an intermediate bytes copy
+                with memoryview(mapped) as view:
+                    return str(view, self.encoding)
+
+    def __str__(self):
+        return self.text
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks())
+
+    def chunks(self, size: int = 1024 * 1024):
+        """
+        Yields the decoded content of the file piece by piece, without decoding it whole.
+
+        Args:
+            size (int): The number of bytes decoded at a time.
+
+        Yields:
+            str: The successive pieces of the content.
+        """
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for start in range(0, len(view), size):
+                        chunk = decoder.decode(view[start : start + size])
+                        if chunk:
+                            yield chunk
+                    chunk = decoder.decode(b"", final=True)
+                    if chunk:
+                        yield chunk
+
+    def __repr__(self):
+        return f"FileValue({self.path!r})"
+
+
+_file_values = weakref.WeakValueDictionary()
+_file_values_lock = threading.Lock()
+
+
+def file_value(path: str, encoding: str = "utf-8") -> FileValue:
+    """
+    Returns the FileValue of a file, shared with every other user of the same
+    unchanged file so that it is read and decoded only once.
+
+    Args:
+        path (str): The filepath.
+        encoding (str): The encoding used to decode the file.
+
+    Returns:
+        FileValue: The lazy template value.
+    """
+    real_path = os.path.realpath(path)
+    stat = os.stat(real_path)
+    key = (real_path, stat.st_mtime_ns, stat.st_size, encoding)
+    with _file_values_lock:
+        value = _file_values.get(key)
+        if value is None:
+            value = FileValue(real_path, encoding)
+            _file_values[key] = value
+        return value
+
+
+class InputLoader(yaml.FullLoader):
+    """
+    YAML loader for input values, supporting `!file <path>` to reference a file lazily.
+    Relative paths are resolved from the directory of the input file.
+    """
+
+    base_dir = "."
+
+
+def _construct_file_value(loader: InputLoader, node):
+    path = os.path.join(loader.base_dir, os.path.expanduser(loader.construct_scalar(node)))
+    return file_value(path)
+
+
+InputLoader.add_constructor("!file", _construct_file_value)
+
+
+def load_input(filepath: str) -> dict:
+    """
+    Loads template values from a YAML input file.
+
+    Args:
+        filepath (str): The input filepath.
+
+    Returns:
+        dict: The template values.
+    """
+    loader_class = type(
+        "BoundInputLoader", (InputLoader,), {"base_dir": os.path.dirname(os.path.abspath(filepath))}
+    )
+    with open(filepath, "r") as f:
+        return yaml.load(f, Loader=loader_class) or {}
@@ -5,9 +5,9 @@ from rich import print
 
 from instruct.gui.widgets.top_menu import TopMenu
 from instruct.gui.widgets.result_viewer import ResultViewer
-import pyperclip
 
 from instruct.instruct import Instruct
+from instruct.tracing import SpanCollector
 import os
 
 from textual.reactive import reactive
@@ -23,6 +23,7 @@ logging.basicConfig(level=logging.ERROR)
 
 class InstructApp(App):
     SAVED_FILE_EXT = ".md"
+    REFRESH_INTERVAL = 0.1  # seconds between two renderings of a streamed result
 
     CSS_PATH = "instruct_app.tcss"
 
@@ -67,7 +68,7 @@ class InstructApp(App):
         self.instruct = Instruct(
             filepath=self.instruct_file, no_templating=True, **self.input if self.input else {}
         )
-        self.model = self.instruct.matching_model.name
+        self.model = self.instruct.resolved_model.name
 
     def compose(self) -> ComposeResult:
         yield TopMenu(
@@ -81,7 +82,7 @@ class InstructApp(App):
     async def on_mount(self):
         self.title = "Instruct"
         self.sub_title = "Result Viewer"
-        self.model = self.instruct.matching_model.name
+        self.model = self.instruct.resolved_model.name
         result_viewer = self.query_one("#result_viewer")
         result_viewer.styles.height = "9fr"
         result_viewer.styles.border = ("heavy", "white")
@@ -96,25 +97,37 @@ class InstructApp(App):
     async def run_instruct(self):
         try:
             self._write_to_log(
-                f"Running instruct with model: {self.instruct.matching_model.model}"
+                f"Running instruct with model: {self.instruct.resolved_model.model}"
             )
             self.call_run_instruct()
         except Exception as e:
             self.notify(f"Error running instruct: {e}", severity="error", title="Error")
 
-    @work(thread=True)
-    def call_run_instruct(self):
-        self.call_from_thread(lambda : self.query_one("#log").write("Running instruct..."))
-        self.call_from_thread(lambda: setattr(self.query_one("#result_viewer"), 'loading', True))
-        result = self.instruct.run(
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            stream=True,
-            stream_callback=lambda token: self.app.call_from_thread(
-                self._token_received, token
-            ),
-        )
-        self.call_from_thread(lambda: self._token_received(result))
+    @work(exclusive=True)
+    async def call_run_instruct(self):
+        # runs on the app's event loop: no thread per in-flight request
+        self.query_one("#log").write("Running instruct...")
+        self.query_one("#result_viewer").loading = True
+        deltas = []
+        last_refresh = 0
+        spans = SpanCollector()
+        self.instruct.hooks.append(spans)
+        try:
+            async for chunk in self.instruct.astream(
+                temperature=self.temperature, max_tokens=self.max_tokens
+            ):
+                deltas.append(chunk.delta)
+                # re-render the markdown at a bounded rate, not on every delta
+                if time.monotonic() - last_refresh >= InstructApp.REFRESH_INTERVAL:
+                    self._token_received("".join(deltas))
+                    last_refresh = time.monotonic()
+        except Exception as e:
+            self.notify(f"Error running instruct: {e}", severity="error", title="Error")
+        finally:
+            self.instruct.hooks.remove(spans)
+        self._token_received("".join(deltas))
+        if spans.spans:
+            self._write_to_log(spans.summary())
 
     def _token_received(self, token):
         try:
@@ -130,6 +143,8 @@ class InstructApp(App):
 
     def action_copy_result(self):
         try:
+            import pyperclip
+
             pyperclip.copy(self.content)
             self.notify(f"Copied to clipboard")
         except Exception as e:
@@ -149,7 +164,7 @@ class InstructApp(App):
                 no_templating=True,
             )
 
-            self.model = self.instruct.matching_model.name
+            self.model = self.instruct.resolved_model.name
 
             # clear log
             self.query_one("#log").clear()
@@ -1,10 +1,8 @@
 from instruct.instruct import Instruct
 from instruct.sample import generate_sample_values
 from instruct.data_entry import DataEntry
-import yaml
+from instruct.file_value import load_input
 from rich.console import Console
-from rich.markdown import Markdown
-from rich.text import Text
 import os
 
 
@@ -16,8 +14,7 @@ def run_gui(filepath, input=None, output=None, temperature=0, max_tokens=200, mo
     try:
 
         if input:
-            with open(input, "r") as f:
-                input = yaml.load(f, Loader=yaml.FullLoader)
+            input = load_input(input)
         else:
             values = generate_sample_values(os.path.abspath(filepath), console=console)
             if values:
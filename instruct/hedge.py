@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+
+from instruct.llm_engine import completion_cache
+from instruct.llm_engine.health import get_model_health
+from instruct.llm_engine.usage import Completion
+
+DEFAULT_HEDGE_DELAY = 2.0  # seconds
+
+
+async def _attempt(model, messages, temperature, max_tokens, response_format, stop, first_token: asyncio.Event) -> Completion:
+    # streams a completion, setting `first_token` as soon as some text arrives
+    start = time.perf_counter()
+    deltas, usage = [], None
+    async for chunk in model.astream(
+        messages, temperature, max_tokens, stream=True, response_format=response_format, stop=stop
+    ):
+        if chunk.delta and not first_token.is_set():
+            first_token.set()
+        deltas.append(chunk.delta)
+        usage = chunk.usage or usage
+    text = "".join(deltas)
+    return Completion(text, model._call_usage(messages, text, usage, time.perf_counter() - start))
+
+
+def _expected_latency(model):
+    stats = get_model_health().stats.get(model.model)
+    return stats["latency"] if stats else None
+
+
+async def arun_hedged(
+    instruct,
+    models: list,
+    temperature,
+    max_tokens,
+    hedge_delay: float = DEFAULT_HEDGE_DELAY,
+    stream_callback=None,
+    response_format=None,
+    cache=False,
+    stop=None,
+) -> str:
+    """
+    Runs an Instruct with a hedged request: if the primary model has not produced a first
+    token within `hedge_delay` seconds (or failed), the same prompt is sent to the next model.
+    The first response to complete wins and the other request is cancelled.
+
+    The stats of the run are stored in `instruct.hedge_report`: the winner (configuration key,
+    e.g. `openai/gpt-4o`), whether the backup request was sent, the latency, and the latency
+    saved, estimated from the primary model's average latency (see `health.ModelHealth`).
+
+    Args:
+        instruct (Instruct): The Instruct to run.
+        models (list): The models to try, primary first. Only the first two are used.
+        temperature (float): Temperature parameter for generating responses.
+        max_tokens (int): Maximum number of tokens in the generated response.
+        hedge_delay (float): How long to wait for the primary's first token, in seconds.
+        stream_callback (function): Called once with the winner's complete text.
+        response_format (dict): The response format, e.g. {"type": "json_object"}.
+        cache (bool): Whether to serve and store the result through the completion cache.
+        stop (list): Stop sequences (see `Model.invoke`).
+
+    Returns:
+        Completion: The result of the winning model, or None if every request failed.
+            The usage of the cancelled request is not known.
+    """
+    health = get_model_health()
+    start = time.perf_counter()
+    expected = _expected_latency(models[0])
+    requests = []
+    for model in models[:2]:
+        messages = [{"role": "user", "content": instruct._routed(model).prompt_for(model, max_tokens)}]
+        requests.append((model, messages))
+
+    primary, primary_messages = requests[0]
+    cache_keys = {}
+    if cache:
+        for model, messages in requests:
+            params = model._completion_params(messages, temperature, max_tokens, False, response_format, stop)
+            cache_keys[model.model] = model._cache_key(params)
+            cached = completion_cache.safe_get(cache_keys[model.model])
+            if cached is not None:
+                instruct.hedge_report = {"winner": model.model, "hedged": False, "cached": True}
+                return model._replay(cached, True, stream_callback)
+
+    first_token = asyncio.Event()
+    tasks = {}
+
+    def launch(model, messages):
+        task = asyncio.ensure_future(
+            _attempt(model, messages, temperature, max_tokens, response_format, stop, first_token)
+        )
+        tasks[task] = (model, time.perf_counter())
+
+    launch(primary, primary_messages)
+    hedged = False
+    result, winner = None, None
+    try:
+        # wait for the primary's first token, or its failure
+        waiter = asyncio.ensure_future(first_token.wait())
+        await asyncio.wait([waiter, *tasks], timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        primary_done = all(task.done() for task in tasks)
+        primary_failed = primary_done and (
+            next(iter(tasks)).exception() is not None or not next(iter(tasks)).result()
+        )
+        if len(requests) > 1 and (not first_token.is_set() or primary_failed):
+            hedged = True
+            logging.info(f"{instruct} > no first token from {primary.name} after {hedge_delay}s, hedging with {requests[1][0].name}")
+            launch(*requests[1])
+
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                model, launched = tasks[task]
+                latency = time.perf_counter() - launched
+                error = task.exception()
+                if error is None and task.result():
+                    health.record(model, latency, True)
+                    if winner is None:
+                        result, winner = task.result(), model
+                else:
+                    health.record(model, latency, False, str(error) if error else "empty response")
+                    logging.warning(f"{instruct} > hedged request to {model.name} failed > {error}")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    latency = time.perf_counter() - start
+    latency_saved = 0.0
+    if hedged and winner is not None and winner is not primary:
+        # unknown without an average latency of the primary
+        latency_saved = max(0.0, expected - latency) if expected is not None else None
+    instruct.hedge_report = {
+        "winner": winner.model if winner else None,
+        "hedged": hedged,
+        "cached": False,
+        "latency": latency,
+        "latency_saved": latency_saved,
+    }
+    if winner is None:
+        return None
+    logging.info(f"{instruct} > hedged run won by {winner.name} in {latency:.2f}s")
+    if cache:
+        completion_cache.safe_set(cache_keys[winner.model], winner.model, result)
+    return winner._replay(result, True, stream_callback)
@@ -1,22 +1,63 @@
-import jinja2
-import re
-import yaml
+import copy
+import time
 
+from instruct.batch import DEFAULT_WORKERS, arun_batch, run_batch
+from instruct.llm_engine.completion_cache import cache_enabled
+from instruct.llm_engine.health import get_model_health
 from instruct.llm_engine.model import Model
+from instruct.llm_engine.usage import Completion, add_usage, sum_usage
+from instruct.bundle import load_default_bundle
+from instruct.event_loop import RunningLoopError, run_sync
+from instruct.hedge import DEFAULT_HEDGE_DELAY, arun_hedged
+from instruct.minify import minify, minify_options
+from instruct.tags import TagStreamParser, stop_sequences
+from instruct.sampling import DEFAULT_AGGREGATOR, aggregate_samples, get_aggregator
+from instruct.template_cache import COMPACT_JSON, template_cache
+from instruct.token_budget import fit_prompt
+from instruct.tracing import activate, start_span
 import logging
 from typing import List
 
 from rich.console import Console
-from rich.markdown import Markdown
-from rich.text import Text
 
 logging.basicConfig(level=logging.ERROR)
 
 console = Console()
 
+# precompiled templates from `instruct compile`, when INSTRUCT_BUNDLE is set
+load_default_bundle()
+
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_MAX_TOKENS = 1000
 
+# Model selection: the first matching model, or the fastest healthy one with failover.
+ROUTING_FIRST = "first"
+ROUTING_FASTEST = "fastest"
+
+
+def _result_usage(result) -> dict:
+    if isinstance(result, list):  # every sample, see `sampling.all_samples`
+        return sum_usage([getattr(sample, "usage", None) for sample in result])
+    return getattr(result, "usage", None)
+
+
+class _ValueRef:
+    """
+    A template value in a binding key: equal only to the same object. The key keeps a
+    reference to the value, so that its id cannot be reused by another object while memoized.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, _ValueRef) and other.value is self.value
+
+    def __hash__(self):
+        return id(self.value)
+
 
 class Instruct:
     """
@@ -31,6 +72,9 @@ class Instruct:
         tags (list): Returns a list of tags extracted from the template.
         template_values (list): Returns a list of jinja2 values extracted from the template.
         prompt (str): Returns the rendered prompt using the provided keyword arguments.
+        hooks (list): Tracing hooks receiving the spans of the runs (see `instruct.tracing`).
+        usage (dict): The tokens, cost and latency of the last run (see `llm_engine.usage.call_usage`).
+        total_usage (dict): The calls, tokens, cost and latency of all the runs, bound copies included.
 
     Methods:
         _parse_file(): Parses the Instruct file and extracts instruct_models and template.
@@ -39,27 +83,28 @@ class Instruct:
 
     def __init__(self, filepath: str, forced_model=None, no_templating=False, **kwargs):
         self.filepath = filepath
+        self._rendered_prompt = None
+        self._forced_model = None
+        self._declared_models = []
+        self._resolved_models = None
+        self._matched_models = None
+        self.hooks = []
 
         try:
             from instruct.llm_engine.model_loader import ModelLoader
 
-            self.available_models: List[Model] = ModelLoader().models
-            # console.print(f"[dim]available models: {self.available_models}[/dim]")
+            self.model_loader = ModelLoader()
         except Exception as e:
-            self.available_models = None
             raise Exception(f"Error loading available models: {e}")
         try:
-            if forced_model is not None and self.available_models is not None:
+            if forced_model is not None:
                 console.print(f"forced model: {forced_model}")
-                for model in self.available_models:
-                    if model.name == forced_model:
-                        self.forced_model: Model = model
-                        logging.info(f"Forced model: {forced_model}")
-                        break
-                if self.forced_model is None:
+                matches = self.model_loader.find(forced_model)
+                if matches:
+                    self.forced_model = matches[0]
+                    logging.info(f"Forced model: {forced_model}")
+                else:
                     logging.info(f"Forced model not found: {forced_model}")
-            else:
-                self.forced_model = None
 
             # store the other arguments for later use
             self.kwargs = kwargs
@@ -68,115 +113,319 @@ class Instruct:
             self.template = None
             self.raw_template = None
             self.response_format = None
+            self.token_budget = {}
+            self.minify = {}
+            self.minify_report = None
+            self.hedge_report = None
+            self.sampling_report = None
+            self.usage = None
+            self.total_usage = {}
+            self.sections = {}
+            self.cache = None
+            self.routing = ROUTING_FIRST
+            self.stop = []
             self._parse_file()
-
-            from instruct.llm_engine.model_loader import ModelLoader
-
-            self.available_models = ModelLoader().models
-            # console.print(f"[dim]available models: {self.available_models}[/dim]")
             self.models = [d["model"] for d in self.instruct_models]
         except Exception as e:
             raise Exception(f"Error initializing Instruct: {e}")
 
+    @property
+    def kwargs(self) -> dict:
+        """
+        The keyword arguments used for templating.
+        Assigning new kwargs invalidates the memoized prompt.
+        """
+        return self._kwargs
+
+    @kwargs.setter
+    def kwargs(self, kwargs: dict):
+        self._kwargs = kwargs
+        self._rendered_prompt = None
+
+    @property
+    def forced_model(self) -> Model:
+        """
+        The Model forced at construction, if any.
+        Assigning a new forced model invalidates the memoized prompt.
+        """
+        return self._forced_model
+
+    @forced_model.setter
+    def forced_model(self, forced_model: Model):
+        self._forced_model = forced_model
+        self._rendered_prompt = None
+
     @property
     def tags(self):
         """
-        Extracts tags from the template.
+        Tags extracted from the template when the file was parsed.
         Tags are in the format: <tag_name>
 
         Returns:
             list: A list of tags extracted from the template.
         """
-        return re.findall(r"(<[^>]*>)", self.raw_template)
+        return list(self._tags)
 
     @property
     def template_values(self):
         """
-        Extracts jinja2 values from the template.
-        Jinja2 values are in the format: {{ value }}
+        Jinja2 values expected by the template, computed from its AST when the file was parsed.
+        The `model` value is injected by Instruct and is not part of the list.
 
         Returns:
-            list: A list of jinja2 values extracted from the template.
+            list: A sorted list of the undeclared jinja2 variables of the template.
         """
-        return list(set(re.findall(r"{{([^}]*)}}", self.raw_template)))
+        return list(self._template_values)
 
     @property
     def prompt(self):
         """
         Returns the rendered prompt using the provided keyword arguments.
 
-        Args:
-            **kwargs: Keyword arguments to be used for templating.
+        The rendered prompt is memoized per binding: it is rendered again only when
+        the kwargs (or one of their values) are reassigned or the resolved model changes.
+        Values mutated in place are not detected.
 
         Returns:
             str: The rendered prompt.
         """
-        
+
         if self.no_templating:
             return self.raw_template
 
+        binding = self._binding_key()
+        if self._rendered_prompt is not None and self._rendered_prompt[0] == binding:
+            return self._rendered_prompt[1]
+
+        model_name = binding[0]
         if self.forced_model is not None:
+            logging.info(f"Prompt template resolved with forced_model: {model_name}")
+
+        if model_name is not None:
+            prompt = self._perform_templating(**self.kwargs, model=model_name)
+        else:
+            prompt = self._perform_templating(**self.kwargs)
+
+        if prompt is not None:
+            self._rendered_prompt = (binding, prompt)
+        return prompt
+
+    def render_stream(self):
+        """
+        Yields the rendered prompt chunk by chunk, through Jinja's generate path,
+        without materializing it as a single string. Useful to write or process very
+        large prompts (e.g. built from `FileValue`s) incrementally.
+        An already memoized prompt is yielded as is.
+
+        Yields:
+            str: The successive chunks of the rendered prompt.
+        """
+        if self.no_templating:
+            yield self.raw_template
+            return
+
+        binding = self._binding_key()
+        if self._rendered_prompt is not None and self._rendered_prompt[0] == binding:
+            yield self._rendered_prompt[1]
+            return
+
+        kwargs = self._resolve_kwargs(self.kwargs)
+        if binding[0] is not None:
+            kwargs["model"] = binding[0]
+        yield from self.template.generate(**kwargs)
+
+    def render_with(self, **overrides) -> str:
+        """
+        Renders the prompt with some template values overridden, without changing the
+        Instruct's own kwargs nor its memoized prompt.
+
+        Args:
+            **overrides: Template values replacing the Instruct's kwargs.
+
+        Returns:
+            str: The rendered prompt.
+        """
+        if self.no_templating:
+            return self.raw_template
+        model_name = self._binding_key()[0]
+        kwargs = {**self.kwargs, **overrides}
+        if model_name is not None:
+            kwargs["model"] = model_name
+        return self._perform_templating(**kwargs)
+
+    def prompt_for(self, model: Model, max_tokens: int) -> str:
+        """
+        Returns the prompt to send to a model: the rendered prompt, compacted if the
+        `minify` header is set, then fitted to the model's context window
+        (see `token_budget.fit_prompt`).
+
+        Args:
+            model (Model): The model the prompt is sent to.
+            max_tokens (int): The maximum number of tokens of the completion.
+
+        Returns:
+            str: The prompt to send.
+        """
+        prompt = self.prompt
+        compacted = self.compact(prompt)
+        if self.minify and prompt is not None:
+            self.minify_report = {
+                "model": model.name,
+                "before": model.count_tokens(prompt),
+                "after": model.count_tokens(compacted),
+            }
             logging.info(
-                f"Prompt template resolved with forced_model: {self.forced_model.name}"
+                f"{self} > minified prompt: {self.minify_report['before']} -> {self.minify_report['after']} tokens"
             )
-            return self._perform_templating(**self.kwargs, model=self.forced_model)
-        elif self.matching_model is not None:
-            return self._perform_templating(
-                **self.kwargs, model=self.matching_model.name
-            )
-        else:
-            return self._perform_templating(**self.kwargs)
+        return fit_prompt(self, model, max_tokens, prompt=compacted)
+
+    def compact(self, prompt: str) -> str:
+        """
+        Applies the minification pass declared by the `minify` header to a rendered prompt.
+
+        Args:
+            prompt (str): The rendered prompt.
+
+        Returns:
+            str: The compacted prompt, or the prompt as is when minification is disabled.
+        """
+        if not self.minify or prompt is None:
+            return prompt
+        return minify(prompt, self.minify)
+
+    def _resolve_kwargs(self, kwargs: dict) -> dict:
+        # composed Instructs are replaced by their (memoized) prompt
+        resolved = {
+            k: v.prompt if isinstance(v, Instruct) else v for k, v in kwargs.items()
+        }
+        if self.minify.get("compact_json"):
+            resolved[COMPACT_JSON] = True
+        return resolved
+
+    def _binding_key(self, _path=()):
+        """
+        Returns the key identifying the current templating binding: the resolved model
+        name and, for each kwarg, its value compared by identity (see `_ValueRef`) or, for
+        a composed Instruct, its own binding key. A node re-renders only when this key
+        changes, so in a composition only the Instructs whose inputs changed are rendered
+        again. A value mutated in place (e.g. a list) is the same object: assign a new one.
+        """
+        path = self._enter(_path)
+        model = self.resolved_model
+        return (
+            model.name if model is not None else None,
+            tuple(
+                (k, v._binding_key(path) if isinstance(v, Instruct) else _ValueRef(v))
+                for k, v in self.kwargs.items()
+            ),
+        )
+
+    def _enter(self, path):
+        # guard against cycles while walking the composition graph
+        if any(node is self for node in path):
+            raise ValueError(f"Cyclic Instruct composition: {self}")
+        return path + (self,)
+
+    @property
+    def dependencies(self) -> List["Instruct"]:
+        """
+        The Instructs composed into this one, i.e. passed as kwargs.
+        Together they form a DAG whose nodes memoize their prompt and models.
+
+        Returns:
+            list: The child Instructs.
+        """
+        return [v for v in self.kwargs.values() if isinstance(v, Instruct)]
+
+    @property
+    def models(self) -> List[str]:
+        """
+        The model names this Instruct is compatible with: the models of the Instruct file,
+        restricted to the ones shared with every composed Instruct.
+        Memoized until the composition or one of the model lists changes.
+
+        Returns:
+            list: The compatible model names, in the order of the Instruct file.
+        """
+        key = self._models_key()
+        if self._resolved_models is None or self._resolved_models[0] != key:
+            models = list(self._declared_models)
+            for dependency in self.dependencies:
+                dependency_models = set(dependency.models)
+                models = [model for model in models if model in dependency_models]
+            self._resolved_models = (key, models)
+        return self._resolved_models[1]
+
+    @models.setter
+    def models(self, models: List[str]):
+        self._declared_models = list(models)
+        self._resolved_models = None
+
+    def _models_key(self, _path=()):
+        # the model lists compared by identity, held so that their ids cannot be reused
+        path = self._enter(_path)
+        return (
+            _ValueRef(self._declared_models),
+            tuple(dependency._models_key(path) for dependency in self.dependencies),
+        )
+
+    @property
+    def available_models(self) -> List[Model]:
+        """
+        The models configured in models.yaml (see `ModelLoader`).
+        """
+        return self.model_loader.models
 
     @property
     def matching_model(self) -> Model:
-        # return the first available model in the config file matching with the instruct_models
-        try:
-            selected_model = None
-            for model in self.models:
-                for available_model in self.available_models:
-                    if available_model.name == model:
-                        selected_model = available_model
-                        break
-
-                if selected_model is not None:
-                    break
-            return selected_model
-        except Exception as e:
-            logging.error(f"Error finding matching model: {e}")
-            return None
+        """
+        The first configured model matching the Instruct's models, or None.
+        """
+        compatible_models = self.compatible_models
+        return compatible_models[0] if compatible_models else None
+
+    @property
+    def resolved_model(self) -> Model:
+        """
+        The model a run uses without routing: the forced model, or the matching one.
+        """
+        return self.forced_model if self.forced_model is not None else self.matching_model
+
+    @property
+    def answered_model(self) -> Model:
+        """
+        The model that answered the last run, which routing, failover or hedging may have
+        picked instead of `resolved_model`. Falls back to `resolved_model` when unknown.
+        """
+        key = (self.usage or {}).get("model") or (self.hedge_report or {}).get("winner")
+        model = self.model_loader.get(key) if key else None
+        return model if model is not None else self.resolved_model
 
     def _parse_file(self):
-        try:
-            with open(self.filepath, "r") as file:
-                content = file.read()
-                # print(f"File content:\n{content}")  # Debug print
-
-                parts = content.split("\n---\n", 1)
-                if len(parts) != 2:
-                    raise ValueError(
-                        "File content is not properly formatted. Expected a header and a template separated by '\\n---\\n'"
-                    )
-
-                header_content, self.raw_template = parts
-                # print(f"Header content:\n{header_content}")  # Debug print
-                # print(f"Raw template:\n{self.raw_template}")  # Debug print
-
-                header = yaml.safe_load(header_content)
-                if header is None:
-                    raise ValueError("Header content is empty or not valid YAML")
-
-                self.instruct_models = [
-                    {"model": model} for model in header.get("models", [])
-                ]
-                self.response_format = header.get("response_format", None)
-
-                # print(f"instruct_models: {self.instruct_models}")
-
-                self.template = jinja2.Template(self.raw_template)
-        except FileNotFoundError as e:
-            raise FileNotFoundError(f"File not found: {self.filepath}")
-        except Exception as e:
-            raise Exception(f"Error parsing file: {self.filepath} - {e}")
+        with start_span("instruct.parse", self.hooks, file=self.filepath):
+            try:
+                # parsed headers and compiled templates are shared through the process-wide cache
+                parsed = template_cache.get(self.filepath)
+            except FileNotFoundError as e:
+                raise FileNotFoundError(f"File not found: {self.filepath}")
+            except Exception as e:
+                raise Exception(f"Error parsing file: {self.filepath} - {e}")
+
+        self.raw_template = parsed.raw_template
+        self.instruct_models = [
+            {"model": model} for model in parsed.header.get("models", [])
+        ]
+        self.response_format = parsed.header.get("response_format", None)
+        self.token_budget = parsed.header.get("token_budget", None) or {}
+        self.minify = minify_options(parsed.header.get("minify", None))
+        self.cache = parsed.header.get("cache", None)
+        self.routing = parsed.header.get("routing", ROUTING_FIRST)
+        if self.routing not in (ROUTING_FIRST, ROUTING_FASTEST):
+            raise ValueError(f"Unknown routing `{self.routing}`, expected `{ROUTING_FIRST}` or `{ROUTING_FASTEST}`")
+        self.template = parsed.template
+        self._template_values = parsed.template_values
+        self._tags = parsed.tags
+        self.stop = stop_sequences(parsed.header.get("stop", None), parsed.tags)
 
     def _perform_templating(self, **kwargs):
         """
@@ -188,21 +437,17 @@ class Instruct:
         Returns:
             str: The rendered template.
         """
-        # if one of the args is of type Instruct, call its prompt method
-        for k, v in kwargs.items():
-            if isinstance(v, Instruct):
-                kwargs[k] = v.prompt
-                # also retrieve the models from the Instruct and choose the common model with the current Instruct
-                self.models = list(set(self.models).intersection(v.models))
-
-        try:
-            return self.template.render(**kwargs)
-        except Exception as e:
-            logging.error(f"Error performing templating: {e}")
-            logging.error(
-                f"Check that you passed all the template values: {self.template_values}"
-            )
-            return None
+        with start_span("instruct.render", self.hooks, file=self.filepath):
+            kwargs = self._resolve_kwargs(kwargs)
+
+            try:
+                return self.template.render(**kwargs)
+            except Exception as e:
+                logging.error(f"Error performing templating: {e}")
+                logging.error(
+                    f"Check that you passed all the template values: {self.template_values}"
+                )
+                return None
 
     def __str__(self):
         """
@@ -213,42 +458,410 @@ class Instruct:
         """
         return f"Instruct: {self.filepath}"
 
-    def run(
-        self, temperature=DEFAULT_TEMPERATURE, max_tokens=DEFAULT_MAX_TOKENS, **kwargs
-    ):
+    def bind(self, **kwargs) -> "Instruct":
         """
-        Run the prompt to the appropriate model.
+        Returns a copy of this Instruct with some template values replaced.
+        The copy shares the parsed template and the models, without parsing the file again.
+
+        Args:
+            **kwargs: Template values replacing the Instruct's kwargs.
 
         Returns:
-            str: The result of the Model call.
+            Instruct: The bound copy.
         """
-        try:
+        bound = copy.copy(self)
+        bound.kwargs = {**self.kwargs, **kwargs}
+        return bound
 
-            if self.response_format is not None:
-                if self.response_format == "json_object":
-                    kwargs["response_format"] = {"type": "json_object"}
+    def run_batch(self, records: list, output: str = None, workers: int = DEFAULT_WORKERS, **kwargs) -> list:
+        """
+        Run the Instruct over many records of template values, with a bounded number of
+        concurrent calls. See `batch.arun_batch` for output and checkpoint details.
 
-            if self.forced_model is not None:
-                logging.info(
-                    f"Running prompt with forced model: {self.forced_model.name}"
-                )
+        Args:
+            records (list): The template values of each run.
+            output (str): The output JSONL filepath, also used as checkpoint.
+            workers (int): The maximum number of concurrent calls.
+            **kwargs: Arguments of `run` (temperature, max_tokens...).
+
+        Returns:
+            list: The results, in input order.
+        """
+        return run_batch(self, records, output, workers, **kwargs)
+
+    async def arun_batch(self, records: list, output: str = None, workers: int = DEFAULT_WORKERS, **kwargs) -> list:
+        """
+        Async version of `run_batch`.
+        """
+        return await arun_batch(self, records, output, workers, **kwargs)
+
+    @property
+    def compatible_models(self) -> List[Model]:
+        """
+        All the available models matching the Instruct's models, in the order of the Instruct file.
+        Resolved once through the registry's name index, until the model list or models.yaml changes.
+        """
+        models = self.models
+        version = self.model_loader.version
+        matched = self._matched_models
+        if matched is None or matched[0] is not models or matched[1] != version:
+            compatible_models = [model for name in models for model in self.model_loader.find(name)]
+            self._matched_models = matched = (models, version, compatible_models)
+        return matched[2]
+
+    def candidate_models(self, routing: str = None) -> List[Model]:
+        """
+        Returns the models to run the prompt with, in order of preference.
 
-                return self.forced_model.interpret(self, temperature, max_tokens, **kwargs)
+        Args:
+            routing (str): `first` (default): the first matching model only.
+                `fastest`: every compatible model, the fastest healthy one first (see `health.ModelHealth.rank`).
 
-            elif self.matching_model is not None:
-                logging.info(f"run with args: {kwargs}")
-                return self.matching_model.interpret(self, temperature, max_tokens, **kwargs)
-            else:
-                raise Exception(
-                    f"""
+        Returns:
+            list: The models to try, in order.
+        """
+        if self.forced_model is not None:
+            return [self.forced_model]
+        if (routing or self.routing) == ROUTING_FASTEST:
+            return get_model_health().rank(self.compatible_models)
+        model = self.matching_model
+        return [model] if model is not None else []
+
+    def _routed(self, model: Model) -> "Instruct":
+        # a copy rendering the prompt for the routed model
+        routed = self.bind()
+        routed.forced_model = model
+        return routed
+
+    def _run_routed(self, temperature, max_tokens, **kwargs):
+        health = get_model_health()
+        for model in self.candidate_models(ROUTING_FASTEST):
+            start = time.perf_counter()
+            result = model.interpret(self._routed(model), temperature, max_tokens, **kwargs)
+            health.record(model, time.perf_counter() - start, result is not None)
+            if result is not None:
+                return result
+            logging.warning(f"{self} > {model.name} failed, failing over to the next model")
+        self._run_model()  # raises the "no matching model" error when there is no candidate
+        raise Exception(f"{self} > all compatible models failed: {self.models}")
+
+    async def _arun_routed(self, temperature, max_tokens, **kwargs):
+        health = get_model_health()
+        for model in self.candidate_models(ROUTING_FASTEST):
+            start = time.perf_counter()
+            result = await model.ainterpret(self._routed(model), temperature, max_tokens, **kwargs)
+            health.record(model, time.perf_counter() - start, result is not None)
+            if result is not None:
+                return result
+            logging.warning(f"{self} > {model.name} failed, failing over to the next model")
+        self._run_model()
+        raise Exception(f"{self} > all compatible models failed: {self.models}")
+
+    def _hedge_models(self, routing: str) -> List[Model]:
+        # the preferred model, then the next compatible one as backup
+        models = self.candidate_models(routing)
+        if self.forced_model is None:
+            models += [model for model in self.compatible_models if model not in models]
+        return models
+
+    def _run_model(self) -> Model:
+        """
+        Returns the Model to run the prompt with: the forced model, or the matching one.
+        """
+        model = self.resolved_model
+        if model is not None:
+            if model is self.forced_model:
+                logging.info(f"Running prompt with forced model: {model.name}")
+            return model
+        else:
+            raise Exception(
+                f"""
 {self} > No matching provider <> model found:
 providers: {self.available_models}
 Instruct's compatibility list: {self.models}
 To fix the problem:
 1. Check the providers in the ~/.instruct/models.yaml file.
 2. Check the Instruct file's instruct_models for compatibility with the providers."""
-                )
+            )
+
+    def _run_kwargs(self, kwargs: dict, temperature) -> dict:
+        if self.response_format is not None:
+            if self.response_format == "json_object":
+                kwargs["response_format"] = {"type": "json_object"}
+        if self.stop:
+            kwargs.setdefault("stop", self.stop)
+        # the `cache` header, or deterministic calls only (see completion_cache.cache_enabled)
+        kwargs.setdefault("cache", cache_enabled(self.cache, temperature))
+        return kwargs
+
+    def run(
+        self, temperature=DEFAULT_TEMPERATURE, max_tokens=DEFAULT_MAX_TOKENS, **kwargs
+    ):
+        """
+        Run the prompt to the appropriate model.
+
+        Args:
+            routing (str): Overrides the `routing` header: `first` or `fastest`, which runs the
+                fastest healthy compatible model and fails over to the next ones.
+            hedge (bool): If the model has not produced a first token within `hedge_delay` seconds,
+                send the prompt to the next compatible model too; the first response wins
+                (see `hedge.arun_hedged`, stats in `hedge_report`).
+            hedge_delay (float): The hedging delay, in seconds.
+            samples (int): Generate this many completions concurrently and aggregate them
+                (see `_arun_samples`, the samples are kept in `sampling_report`).
+            aggregate (str | Callable): The aggregation of the samples: `majority` (default)
+                vote on the tags, first valid `json`, or `all` the samples (returns a list).
+                See `sampling.register_aggregator` for custom strategies.
+            on_section (function): Called with a `tags.SectionEvent` as soon as each `<tag>` section
+                of the result is closed; the result is then streamed. The sections of the result are
+                kept in `sections` in any case.
+
+        The run is traced in an `instruct.run` span, see `hooks`.
+
+        Returns:
+            Completion: The result of the Model call, a str with the usage of the run in `usage`.
+        """
+        with start_span("instruct.run", self.hooks, file=self.filepath):
+            parser, on_section = self._section_parser(kwargs)
+            result = self._run(temperature, max_tokens, **kwargs)
+            self._record_usage(_result_usage(result))
+            with start_span("instruct.postprocess", self.hooks):
+                self.sections = self._close_sections(parser, on_section, result)
+            return result
+
+    def _run(self, temperature, max_tokens, **kwargs):
+        try:
+            samples = kwargs.pop("samples", None) or 1
+            aggregate = kwargs.pop("aggregate", None) or DEFAULT_AGGREGATOR
+            if samples > 1:
+                return run_sync(self._arun_samples(temperature, max_tokens, samples, aggregate, **kwargs), "instruct.arun()")
+            routing = kwargs.pop("routing", None) or self.routing
+            if kwargs.pop("hedge", False):
+                return run_sync(self._arun_hedged(routing, temperature, max_tokens, **kwargs), "instruct.arun()")
+            kwargs.pop("hedge_delay", None)
+            if routing == ROUTING_FASTEST and self.forced_model is None:
+                return self._run_routed(temperature, max_tokens, **self._run_kwargs(kwargs, temperature))
+
+            model = self._run_model()
+            logging.info(f"run with args: {kwargs}")
+            return model.interpret(self, temperature, max_tokens, **self._run_kwargs(kwargs, temperature))
+
+        except RunningLoopError:
+            raise
+        except Exception as e:
+            logging.error(f"Error running Instruct: {self} > {e}")
+            return None
+
+    async def arun(
+        self, temperature=DEFAULT_TEMPERATURE, max_tokens=DEFAULT_MAX_TOKENS, **kwargs
+    ):
+        """
+        Run the prompt to the appropriate model, on the event loop.
+        Accepts the same arguments as `run` (stream, stream_callback, routing, hedge, hedge_delay,
+        samples, aggregate, on_section).
+
+        Returns:
+            Completion: The result of the Model call.
+        """
+        with start_span("instruct.run", self.hooks, file=self.filepath):
+            parser, on_section = self._section_parser(kwargs)
+            result = await self._arun(temperature, max_tokens, **kwargs)
+            self._record_usage(_result_usage(result))
+            with start_span("instruct.postprocess", self.hooks):
+                self.sections = self._close_sections(parser, on_section, result)
+            return result
+
+    async def _arun(self, temperature, max_tokens, **kwargs):
+        try:
+            samples = kwargs.pop("samples", None) or 1
+            aggregate = kwargs.pop("aggregate", None) or DEFAULT_AGGREGATOR
+            if samples > 1:
+                return await self._arun_samples(temperature, max_tokens, samples, aggregate, **kwargs)
+            routing = kwargs.pop("routing", None) or self.routing
+            if kwargs.pop("hedge", False):
+                return await self._arun_hedged(routing, temperature, max_tokens, **kwargs)
+            kwargs.pop("hedge_delay", None)
+            if routing == ROUTING_FASTEST and self.forced_model is None:
+                return await self._arun_routed(temperature, max_tokens, **self._run_kwargs(kwargs, temperature))
+
+            model = self._run_model()
+            logging.info(f"arun with args: {kwargs}")
+            return await model.ainterpret(
+                self, temperature, max_tokens, **self._run_kwargs(kwargs, temperature)
+            )
 
         except Exception as e:
             logging.error(f"Error running Instruct: {self} > {e}")
             return None
+
+    def _record_usage(self, usage: dict):
+        self.usage = usage or None
+        if usage:
+            add_usage(self.total_usage, usage)
+
+    def _section_parser(self, kwargs: dict):
+        # with `on_section`, the result is streamed through the parser as it is generated
+        parser = TagStreamParser()
+        on_section = kwargs.pop("on_section", None)
+        if on_section is None:
+            return parser, None
+        stream_callback = kwargs.get("stream_callback")
+
+        def callback(text):
+            self._emit_sections(parser.feed_text(text), on_section)
+            if stream_callback is not None:
+                stream_callback(text)
+
+        kwargs["stream"] = True
+        kwargs["stream_callback"] = callback
+        return parser, on_section
+
+    def _close_sections(self, parser: TagStreamParser, on_section, result) -> dict:
+        events = []
+        if isinstance(result, str):
+            # the rest of the result, or all of it when it was not streamed through the parser
+            events += parser.feed_text(result)
+        events += parser.close()
+        self._emit_sections(events, on_section)
+        return parser.sections
+
+    async def _arun_samples(self, temperature, max_tokens, samples, aggregate=DEFAULT_AGGREGATOR, **kwargs):
+        """
+        Generates `samples` completions with the run model, in a single request when the provider
+        supports it (`n` parameter) or concurrently, then aggregates them.
+        Streaming, routing and hedging options do not apply to sampled runs.
+        The usage of the run sums the usage of the samples.
+        """
+        get_aggregator(aggregate)  # fail before any request on an unknown strategy
+        model = self._run_model()
+        kwargs = self._run_kwargs(kwargs, temperature)
+        messages = [{"role": "user", "content": self.prompt_for(model, max_tokens)}]
+        results = await model.asample(
+            messages, temperature, max_tokens, samples, kwargs.get("response_format"), kwargs.get("stop")
+        )
+        usage = sum_usage([getattr(sample, "usage", None) for sample in results])
+        self.sampling_report = {
+            "model": model.name,
+            "aggregate": getattr(aggregate, "__name__", aggregate),
+            "samples": results,
+            "usage": usage,
+        }
+        result = aggregate_samples(results, self, aggregate)
+        # the usage of the run is the usage of every sample
+        return Completion(result, usage) if isinstance(result, str) else result
+
+    async def _arun_hedged(self, routing, temperature, max_tokens, hedge_delay=DEFAULT_HEDGE_DELAY, **kwargs):
+        models = self._hedge_models(routing)
+        if not models:
+            self._run_model()  # raises the "no matching model" error
+        kwargs = self._run_kwargs(kwargs, temperature)
+        kwargs.pop("stream", None)  # hedged requests are always streamed, to detect the first token
+        return await arun_hedged(self, models, temperature, max_tokens, hedge_delay, **kwargs)
+
+    def _stream_request(self, temperature, max_tokens):
+        model = self._run_model()
+        kwargs = self._run_kwargs({}, temperature)
+        del kwargs["cache"]  # streamed deltas are not cached
+        messages = [{"role": "user", "content": self.prompt_for(model, max_tokens)}]
+        return model, messages, kwargs
+
+    def stream(
+        self, temperature=DEFAULT_TEMPERATURE, max_tokens=DEFAULT_MAX_TOKENS, on_section=None
+    ):
+        """
+        Run the prompt to the appropriate model and yield the result as it is generated.
+
+        Args:
+            on_section (function): Called with a `tags.SectionEvent` as soon as each `<tag>` section
+                is closed. The sections are kept in `sections` once the stream is consumed.
+
+        Yields:
+            StreamChunk: The successive deltas of the result, with their index, finish reason and usage.
+        """
+        # the span is current only while the generator runs, see `tracing.activate`
+        span = start_span("instruct.run", self.hooks, file=self.filepath, stream=True)
+        chunks, error = None, None
+        try:
+            with activate(span):
+                model, messages, kwargs = self._stream_request(temperature, max_tokens)
+                chunks = model.stream(messages, temperature, max_tokens, stream=True, **kwargs)
+            parser = TagStreamParser()
+            start, usage = time.perf_counter(), None
+            while True:
+                with activate(span):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                self._emit_sections(parser.feed(chunk.delta), on_section)
+                usage = chunk.usage or usage
+                yield chunk
+            with activate(span), start_span("instruct.postprocess", self.hooks):
+                self._emit_sections(parser.close(), on_section)
+                self.sections = parser.sections
+                self._record_stream_usage(model, messages, parser, usage, start)
+        except GeneratorExit:
+            # the consumer stopped reading
+            raise
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            if chunks is not None:
+                with activate(span):
+                    chunks.close()
+            span.finish(error=error)
+
+    async def astream(
+        self, temperature=DEFAULT_TEMPERATURE, max_tokens=DEFAULT_MAX_TOKENS, on_section=None
+    ):
+        """
+        Async version of `stream`.
+
+        Yields:
+            StreamChunk: The successive deltas of the result, with their index, finish reason and usage.
+        """
+        span = start_span("instruct.run", self.hooks, file=self.filepath, stream=True)
+        chunks, error = None, None
+        try:
+            with activate(span):
+                model, messages, kwargs = self._stream_request(temperature, max_tokens)
+                chunks = model.astream(messages, temperature, max_tokens, stream=True, **kwargs)
+            parser = TagStreamParser()
+            start, usage = time.perf_counter(), None
+            while True:
+                with activate(span):
+                    chunk = await anext(chunks, None)
+                if chunk is None:
+                    break
+                self._emit_sections(parser.feed(chunk.delta), on_section)
+                usage = chunk.usage or usage
+                yield chunk
+            with activate(span), start_span("instruct.postprocess", self.hooks):
+                self._emit_sections(parser.close(), on_section)
+                self.sections = parser.sections
+                self._record_stream_usage(model, messages, parser, usage, start)
+        except GeneratorExit:
+            # the consumer stopped reading
+            raise
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            if chunks is not None:
+                with activate(span):
+                    await chunks.aclose()
+            span.finish(error=error)
+
+    def _record_stream_usage(self, model: Model, messages: list, parser: TagStreamParser, usage: dict, start: float):
+        # the parser holds the whole streamed text, to count its tokens when the provider did not
+        text = parser.text if usage is None else None
+        self._record_usage(model._call_usage(messages, text, usage, time.perf_counter() - start))
+
+    def _emit_sections(self, events: list, on_section):
+        if on_section is None:
+            return
+        for event in events:
+            try:
+                on_section(event)
+            except Exception as e:
+                logging.error(f"🔴 Error in on_section: {e}")
@@ -0,0 +1,252 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_CACHE_DIR = "~/.instruct/cache"
+DEFAULT_TTL = 7 * 24 * 3600  # seconds
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024  # bytes
+
+# Evict at most every N writes: eviction scans the whole table.
+EVICTION_INTERVAL = 100
+# Write the hit/miss counters and access times every N lookups (and with every `set`):
+# a write per lookup would take the database write lock on every cache hit.
+STATS_FLUSH_INTERVAL = 100
+
+
+def completion_key(model: str, messages: list, temperature, max_tokens, response_format, stop=None, endpoint=None) -> str:
+    """
+    Returns the content address of a completion request. The endpoint (base URL and API
+    version) tells apart the models of the same name served by different servers.
+    """
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "response_format": response_format,
+    }
+    if stop:
+        request["stop"] = stop
+    if endpoint:
+        request["endpoint"] = endpoint
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Persistent, content-addressed cache of completions, stored in SQLite.
+
+    Entries expire after `ttl` seconds and the least recently used ones are evicted
+    when the cache grows over `max_size` bytes. SQLite (WAL mode) makes it safe to
+    share between threads and processes.
+
+    Attributes:
+        path (Path): The SQLite database filepath.
+        ttl (int): The time to live of an entry, in seconds.
+        max_size (int): The maximum size of the cached responses, in bytes.
+    """
+
+    def __init__(self, directory: str = None, ttl: int = DEFAULT_TTL, max_size: int = DEFAULT_MAX_SIZE):
+        directory = Path(os.path.expanduser(directory or os.environ.get("INSTRUCT_CACHE_DIR", DEFAULT_CACHE_DIR)))
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / "completions.sqlite3"
+        self.ttl = ttl
+        self.max_size = max_size
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0}
+        self._accessed = {}
+        self._lookups = 0
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+            db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, sqlite3 connections are not shareable
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _write_stats(self, db):
+        # writes the counters and access times kept in memory since the last write
+        with self._lock:
+            counts, accessed = self._counts, self._accessed
+            self._counts, self._accessed, self._lookups = {"hits": 0, "misses": 0}, {}, 0
+        db.executemany(
+            "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            [(name, value) for name, value in counts.items() if value],
+        )
+        db.executemany("UPDATE completions SET accessed = ? WHERE key = ?", [(now, key) for key, now in accessed.items()])
+
+    def get(self, key: str):
+        """
+        Returns the cached response of a request, or None.
+
+        Args:
+            key (str): The request key (see `completion_key`).
+
+        Returns:
+            str: The cached response.
+        """
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT response FROM completions WHERE key = ? AND created > ?",
+            (key, now - self.ttl),
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self._counts["misses"] += 1
+            else:
+                self._counts["hits"] += 1
+                self._accessed[key] = now
+            self._lookups += 1
+            due = self._lookups >= STATS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+        return row[0] if row is not None else None
+
+    def set(self, key: str, model: str, response: str):
+        """
+        Stores the response of a request.
+
+        Args:
+            key (str): The request key (see `completion_key`).
+            model (str): The model that generated the response.
+            response (str): The response.
+        """
+        now = time.time()
+        with self._connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._write_stats(db)
+        self._writes += 1
+        if self._writes % EVICTION_INTERVAL == 1:
+            self.evict()
+
+    def flush(self):
+        """
+        Writes the hit/miss counters and access times kept in memory.
+        """
+        with self._lock:
+            if not self._lookups:
+                return
+        with self._connection() as db:
+            self._write_stats(db)
+
+    def evict(self):
+        """
+        Removes the expired entries, then the least recently used ones until the cache fits in `max_size`.
+        """
+        with self._connection() as db:
+            db.execute("DELETE FROM completions WHERE created <= ?", (time.time() - self.ttl,))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+            if total <= self.max_size:
+                return
+            removed = []
+            for key, size in db.execute("SELECT key, size FROM completions ORDER BY accessed"):
+                if total <= self.max_size:
+                    break
+                removed.append((key,))
+                total -= size
+            db.executemany("DELETE FROM completions WHERE key = ?", removed)
+
+    def clear(self):
+        """
+        Removes all the entries and statistics.
+        """
+        with self._lock:
+            self._counts, self._accessed, self._lookups = {"hits": 0, "misses": 0}, {}, 0
+        with self._connection() as db:
+            db.execute("DELETE FROM completions")
+            db.execute("DELETE FROM stats")
+
+    @property
+    def stats(self) -> dict:
+        """
+        Returns the cache statistics, shared by every process using the cache.
+
+        Returns:
+            dict: hits, misses, hit_rate, entries and size (bytes).
+        """
+        self.flush()
+        with self._connection() as db:
+            counters = dict(db.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": entries,
+            "size": size,
+        }
+
+
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> CompletionCache:
+    """
+    Returns the process-wide completion cache, created on first use.
+    """
+    global _completion_cache
+    with _completion_cache_lock:
+        if _completion_cache is None:
+            _completion_cache = CompletionCache()
+            atexit.register(_flush_completion_cache)
+        return _completion_cache
+
+
+def _flush_completion_cache():
+    try:
+        _completion_cache.flush()
+    except Exception as e:
+        logging.error(f"Error writing completion cache stats > {e}")
+
+
+def cache_enabled(header_value, temperature) -> bool:
+    """
+    Tells whether a call should go through the completion cache.
+
+    The `cache` header of the Instruct file opts in (`true`) or out (`false`).
+    Without header, only deterministic calls (temperature 0) are cached.
+    `INSTRUCT_CACHE=0` disables the cache for the whole process.
+    """
+    if os.environ.get("INSTRUCT_CACHE", "1") == "0":
+        return False
+    if header_value is not None:
+        return bool(header_value)
+    return temperature == 0
+
+
+def safe_get(key: str):
+    try:
+        return get_completion_cache().get(key)
+    except Exception as e:
+        logging.error(f"Error reading completion cache > {e}")
+        return None
+
+
+def safe_set(key: str, model: str, response: str):
+    try:
+        get_completion_cache().set(key, model, response)
+    except Exception as e:
+        logging.error(f"Error writing completion cache > {e}")
@@ -0,0 +1,56 @@
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+_model_limits = ContextVar("instruct_model_limits", default=None)
+
+
+class ModelLimits:
+    """
+    The per-model concurrency limits of a group of calls, e.g. a batch: at most
+    `max_concurrency` (models.yaml) concurrent calls per model, `default` otherwise.
+    Active in the context where `activate` was called, tasks started from it included.
+
+    Attributes:
+        default (int): The limit of the models without `max_concurrency`.
+    """
+
+    def __init__(self, default: int):
+        self.default = default
+        self._slots = {}
+
+    def slot(self, model) -> asyncio.Semaphore:
+        """
+        Returns the semaphore of a model, by configuration key: entries sharing a name
+        (e.g. `openai/gpt-4o` and `azure/gpt-4o`) have their own limits.
+        """
+        slot = self._slots.get(model.model)
+        if slot is None:
+            slot = self._slots[model.model] = asyncio.Semaphore(model.max_concurrency or self.default)
+        return slot
+
+    def activate(self):
+        """
+        Applies the limits to the model calls of the current context.
+
+        Returns:
+            Token: The token to pass to `deactivate`.
+        """
+        return _model_limits.set(self)
+
+    def deactivate(self, token):
+        _model_limits.reset(token)
+
+
+@asynccontextmanager
+async def model_slot(model):
+    """
+    Holds a slot of the model under the active ModelLimits, if any, for the duration of a call.
+    Routed and hedged runs take the slot of the model actually called.
+    """
+    limits = _model_limits.get()
+    if limits is None:
+        yield
+        return
+    async with limits.slot(model):
+        yield
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_KEEP_ALIVE = 60  # seconds
+
+# Providers whose calls accept a pooled SDK client through LiteLLM's `client` parameter.
+POOLED_PROVIDERS = ["openai", "azure"]
+
+DEFAULT_BASE_URLS = {"openai": "https://api.openai.com/v1"}
+
+# the async clients being closed, referenced until done
+_closing = set()
+
+
+class ConnectionPool:
+    """
+    Persistent keep-alive HTTP connections of a Model, reused by all its calls
+    instead of a TLS/HTTP handshake per request.
+
+    Only the providers in POOLED_PROVIDERS are pooled; the other providers keep
+    LiteLLM's own connection handling.
+
+    Attributes:
+        pool_size (int): The maximum number of connections.
+        keep_alive (float): How long an idle connection is kept open, in seconds.
+    """
+
+    def __init__(self, model, pool_size: int = None, keep_alive: float = None):
+        self.model = model
+        self.provider = model.model.split("/")[0]
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self.keep_alive = keep_alive if keep_alive is not None else DEFAULT_KEEP_ALIVE
+        self._client = None
+        self._http_client = None  # the pooled httpx.Client of the sync SDK client
+        # async clients are bound to the event loop they were created in
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._retired = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.provider in POOLED_PROVIDERS and not self._retired
+
+    @property
+    def base_url(self) -> str:
+        return self.model.base_url or DEFAULT_BASE_URLS.get(self.provider)
+
+    def _limits(self):
+        import httpx
+
+        return httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.keep_alive,
+        )
+
+    def _sdk_client(self, http_client, asynchronous: bool):
+        import openai
+
+        if self.provider == "azure":
+            client_class = openai.AsyncAzureOpenAI if asynchronous else openai.AzureOpenAI
+            return client_class(
+                api_key=self.model.api_key,
+                api_version=self.model.api_version,
+                azure_endpoint=self.model.base_url,
+                http_client=http_client,
+            )
+        client_class = openai.AsyncOpenAI if asynchronous else openai.OpenAI
+        return client_class(
+            api_key=self.model.api_key,
+            base_url=self.model.base_url,
+            http_client=http_client,
+        )
+
+    def client(self):
+        """
+        Returns the pooled SDK client for sync calls, or None if the provider is not pooled.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._client is None:
+                try:
+                    import httpx
+
+                    http_client = httpx.Client(limits=self._limits())
+                    self._client = self._sdk_client(http_client, asynchronous=False)
+                    self._http_client = http_client
+                except Exception as e:
+                    logging.error(f"Error creating pooled client for {self.model.name} > {e}")
+                    self.provider = None  # fall back to LiteLLM's connections
+                    return None
+            return self._client
+
+    def async_client(self):
+        """
+        Returns the pooled SDK client of the running event loop, or None if the provider is not pooled.
+        """
+        if not self.enabled:
+            return None
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                try:
+                    import httpx
+
+                    client = self._sdk_client(httpx.AsyncClient(limits=self._limits()), asynchronous=True)
+                except Exception as e:
+                    logging.error(f"Error creating pooled client for {self.model.name} > {e}")
+                    return None
+                self._async_clients[loop] = client
+            return client
+
+    def preconnect(self):
+        """
+        Opens a connection to the model's endpoint, so that the first call does not pay
+        the TCP/TLS handshake. The response itself is ignored.
+        """
+        if self.client() is None or self.base_url is None:
+            return
+        try:
+            # through the pooled connections the SDK client was given
+            self._http_client.get(self.base_url, timeout=5)
+        except Exception as e:
+            logging.info(f"Pre-connection to {self.base_url} failed > {e}")
+
+    @contextmanager
+    def in_use(self):
+        """
+        Marks a call using the pooled clients, for the duration of the call:
+        a retired pool is closed once its last call completes.
+        """
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                close = self._retired and not self._in_use
+            if close:
+                self.close()
+
+    def retire(self):
+        """
+        Closes the pooled clients of a model removed from the registry (see `ModelLoader.reload`),
+        once the calls in progress complete. The following calls are not pooled.
+        """
+        with self._lock:
+            self._retired = True
+            close = not self._in_use
+        if close:
+            self.close()
+
+    def close(self):
+        """
+        Closes the pooled clients, the async ones on the event loop they are bound to.
+        """
+        with self._lock:
+            client, self._client, self._http_client = self._client, None, None
+            async_clients = list(self._async_clients.items())
+            self._async_clients.clear()
+        if client is not None:
+            client.close()
+        for loop, async_client in async_clients:
+            try:
+                loop.call_soon_threadsafe(_close_async_client, async_client)
+            except RuntimeError:
+                # the loop is closed, and its connections with it
+                pass
+
+
+def _close_async_client(client):
+    task = asyncio.ensure_future(client.close())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
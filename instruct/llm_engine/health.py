@@ -0,0 +1,198 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DEFAULT_HEALTH_FILE = "~/.instruct/health.json"
+DEFAULT_PROBE_TIMEOUT = 10  # seconds
+
+# Weight of the latest observation in the moving averages.
+EWMA_ALPHA = 0.3
+
+# Models failing more often than this are routed to last.
+MAX_ERROR_RATE = 0.5
+
+# The stats of the calls are saved every N records or after a delay (seconds), and on exit.
+SAVE_INTERVAL = 20
+SAVE_DELAY = 30.0
+
+
+class ModelHealth:
+    """
+    Exponentially weighted moving averages of the latency and error rate of each model,
+    persisted in `~/.instruct/health.json`. Models are identified by their configuration
+    key (e.g. `openai/gpt-4o`), as several models can share the same name.
+    Saves are throttled, and merged with the stats other processes saved meanwhile.
+    """
+
+    def __init__(self, filepath: str = DEFAULT_HEALTH_FILE):
+        self.filepath = Path(os.path.expanduser(filepath))
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        self.stats = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.filepath, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.error(f"Error loading {self.filepath} > {e}")
+            return {}
+
+    def save(self):
+        """
+        Writes the stats, merged with the file: for each model, the latest checked stats win.
+        """
+        with self._lock:
+            tmp_filepath = None
+            try:
+                self.filepath.parent.mkdir(parents=True, exist_ok=True)
+                for key, stats in self._load().items():
+                    current = self.stats.get(key)
+                    if current is None or (stats.get("last_checked") or 0) > (current.get("last_checked") or 0):
+                        self.stats[key] = stats
+                fd, tmp_filepath = tempfile.mkstemp(dir=self.filepath.parent, prefix=self.filepath.name, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.stats, f, indent=2)
+                os.replace(tmp_filepath, self.filepath)
+                self._unsaved = 0
+                self._saved_at = time.monotonic()
+            except Exception as e:
+                logging.error(f"Error saving {self.filepath} > {e}")
+                if tmp_filepath is not None and os.path.exists(tmp_filepath):
+                    os.remove(tmp_filepath)
+
+    def flush(self):
+        """
+        Saves the stats recorded since the last save, if any.
+        """
+        if self._unsaved:
+            self.save()
+
+    def record(self, model, latency: float, ok: bool, error: str = None, save: bool = True):
+        """
+        Records the outcome of a call (or a probe) to a model.
+
+        Args:
+            model (Model): The model called.
+            latency (float): The duration of the call, in seconds.
+            ok (bool): Whether the call succeeded.
+            error (str): The error, if the call failed.
+            save (bool): Whether the stats may be saved, once SAVE_INTERVAL records or SAVE_DELAY
+                seconds passed since the last save (off the event loop when one is running).
+        """
+        with self._lock:
+            stats = self.stats.get(model.model)
+            if stats is None:
+                stats = self.stats[model.model] = {
+                    "latency": latency if ok else None,
+                    "error_rate": 0.0 if ok else 1.0,
+                }
+            else:
+                if ok:
+                    stats["latency"] = (
+                        latency
+                        if stats["latency"] is None
+                        else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * stats["latency"]
+                    )
+                stats["error_rate"] = EWMA_ALPHA * (0.0 if ok else 1.0) + (1 - EWMA_ALPHA) * stats["error_rate"]
+            stats["last_error"] = error
+            stats["last_checked"] = time.time()
+            self._unsaved += 1
+            due = save and (self._unsaved >= SAVE_INTERVAL or time.monotonic() - self._saved_at >= SAVE_DELAY)
+            if due:
+                # a single save scheduled at a time
+                self._unsaved, self._saved_at = 0, time.monotonic()
+        if due:
+            try:
+                asyncio.get_running_loop().run_in_executor(None, self.save)
+            except RuntimeError:
+                self.save()
+
+    def is_healthy(self, model) -> bool:
+        stats = self.stats.get(model.model)
+        return stats is None or stats["error_rate"] <= MAX_ERROR_RATE
+
+    def rank(self, models: list) -> list:
+        """
+        Orders models for routing: healthy models by increasing latency, then the healthy
+        models never measured, then the unhealthy ones. The order is stable otherwise.
+
+        Args:
+            models (list): The candidate models.
+
+        Returns:
+            list: The models, fastest healthy first.
+        """
+        def key(model):
+            stats = self.stats.get(model.model)
+            if not self.is_healthy(model):
+                return (2, 0)
+            if stats is None or stats["latency"] is None:
+                return (1, 0)
+            return (0, stats["latency"])
+
+        return sorted(models, key=key)
+
+
+def probe(model, timeout: float = DEFAULT_PROBE_TIMEOUT) -> dict:
+    """
+    Sends a minimal request to a model.
+
+    Returns:
+        dict: model, ok, latency (seconds) and error of the probe.
+    """
+    start = time.perf_counter()
+    try:
+        model.ping(timeout=timeout)
+        return {"model": model, "ok": True, "latency": time.perf_counter() - start, "error": None}
+    except Exception as e:
+        return {"model": model, "ok": False, "latency": time.perf_counter() - start, "error": str(e)}
+
+
+def check_models(models: list, timeout: float = DEFAULT_PROBE_TIMEOUT, health: ModelHealth = None) -> list:
+    """
+    Probes every model concurrently and records the results.
+
+    Args:
+        models (list): The models to check.
+        timeout (float): The timeout of each probe, in seconds.
+        health (ModelHealth): The health stats to update. Defaults to the process-wide ones.
+
+    Returns:
+        list: The probe results, in the order of `models`.
+    """
+    health = health or get_model_health()
+    if not models:
+        return []
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        results = list(executor.map(lambda model: probe(model, timeout), models))
+    for result in results:
+        health.record(result["model"], result["latency"], result["ok"], result["error"], save=False)
+    health.save()
+    return results
+
+
+_model_health = None
+_model_health_lock = threading.Lock()
+
+
+def get_model_health() -> ModelHealth:
+    """
+    Returns the process-wide model health stats, loaded on first use.
+    """
+    global _model_health
+    with _model_health_lock:
+        if _model_health is None:
+            _model_health = ModelHealth()
+            atexit.register(_model_health.flush)
+        return _model_health
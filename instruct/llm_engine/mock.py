@@ -0,0 +1,308 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+
+from instruct.llm_engine.model import Model
+from instruct.llm_engine.stream import StreamChunk
+
+TOKEN_PATTERN = re.compile(r"\s*\S+|\s+")
+
+
+class MockError(Exception):
+    """
+    An error injected by a mock model, with the HTTP status a provider would answer.
+    """
+
+    status_code = 500
+    error_type = "server_error"
+
+
+class MockRateLimitError(MockError):
+    status_code = 429
+    error_type = "rate_limit_error"
+
+
+def mock_tokens(text: str) -> list:
+    """
+    Splits a text into word-like tokens; joining them gives back the text.
+    """
+    return TOKEN_PATTERN.findall(text)
+
+
+class MockResponder:
+    """
+    Generates the responses of a mock model: deterministic or scripted text, with a
+    configurable time to first token, generation speed, and injected failures.
+
+    Attributes:
+        response (str): The response to every request. Defaults to an echo of the last message.
+        responses (list): Scripted responses, returned in turn (takes precedence over `response`).
+        ttft (float): The time to first token, in seconds.
+        tokens_per_second (float): The generation speed, unlimited if None.
+        error_rate (float): The probability of a server error (HTTP 500).
+        rate_limit_rate (float): The probability of a rate limit error (HTTP 429).
+        seed (int): The seed of the failures, for reproducible runs.
+    """
+
+    def __init__(
+        self,
+        response: str = None,
+        responses: list = None,
+        ttft: float = 0.0,
+        tokens_per_second: float = None,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.response = response
+        self.responses = responses or []
+        self.ttft = ttft or 0.0
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate or 0.0
+        self.rate_limit_rate = rate_limit_rate or 0.0
+        self._random = random.Random(seed)
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def token_interval(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def check(self):
+        """
+        Raises the injected failure of the next request, if any.
+        """
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.rate_limit_rate:
+            raise MockRateLimitError("Mock rate limit exceeded")
+        if draw < self.rate_limit_rate + self.error_rate:
+            raise MockError("Mock server error")
+
+    def reply(self, messages: list) -> str:
+        with self._lock:
+            call = self._calls
+            self._calls += 1
+        if self.responses:
+            return str(self.responses[call % len(self.responses)])
+        if self.response is not None:
+            return str(self.response)
+        return f"Mock response to: {messages[-1]['content'] if messages else ''}"
+
+    def plan(self, messages: list, max_tokens: int = None):
+        """
+        Decides the response of a request, raising the injected failure if any.
+
+        Args:
+            messages (list): The request messages.
+            max_tokens (int): The maximum number of tokens of the response.
+
+        Returns:
+            tuple: The response tokens, and the finish reason (`stop`, or `length` when truncated).
+        """
+        self.check()
+        tokens = mock_tokens(self.reply(messages))
+        if max_tokens and len(tokens) > max_tokens:
+            return tokens[:max_tokens], "length"
+        return tokens, "stop"
+
+
+class MockModel(Model):
+    """
+    A model answering locally, without network, declared in models.yaml with a `mock/` key:
+
+        mock/fast:
+          name: mock
+          ttft: 0.2
+          tokens_per_second: 80
+
+    See MockResponder for the settings. Errors are raised as MockError.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        name: str,
+        response: str = None,
+        responses: list = None,
+        ttft: float = 0.0,
+        tokens_per_second: float = None,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: int = 0,
+        **kwargs,
+    ):
+        super().__init__(model, name, **kwargs)
+        self.responder = MockResponder(
+            response, responses, ttft, tokens_per_second, error_rate, rate_limit_rate, seed
+        )
+
+    def ping(self, timeout: float = None):
+        self.responder.check()
+
+    def _usage(self, messages: list, tokens: list) -> dict:
+        prompt_tokens = sum(self.count_tokens(message["content"]) for message in messages)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+
+    def _provider_chunks(self, params: dict):
+        tokens, finish_reason = self.responder.plan(params["messages"], params["max_tokens"])
+        usage = self._usage(params["messages"], tokens)
+        time.sleep(self.responder.ttft)
+        if not params["stream"]:
+            time.sleep(self.responder.token_interval * max(len(tokens) - 1, 0))
+            yield StreamChunk(0, "".join(tokens), finish_reason, usage)
+            return
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(self.responder.token_interval)
+            yield StreamChunk(index, token)
+        yield StreamChunk(len(tokens), "", finish_reason, usage)
+
+    async def _aprovider_chunks(self, params: dict):
+        tokens, finish_reason = self.responder.plan(params["messages"], params["max_tokens"])
+        usage = self._usage(params["messages"], tokens)
+        await asyncio.sleep(self.responder.ttft)
+        if not params["stream"]:
+            await asyncio.sleep(self.responder.token_interval * max(len(tokens) - 1, 0))
+            yield StreamChunk(0, "".join(tokens), finish_reason, usage)
+            return
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(self.responder.token_interval)
+            yield StreamChunk(index, token)
+        yield StreamChunk(len(tokens), "", finish_reason, usage)
+
+
+def _completion_chunk(completion_id: str, model: str, delta: dict, finish_reason=None, usage=None) -> dict:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if usage is None else [],
+        "usage": usage,
+    }
+
+
+def mock_server(responder: MockResponder, host: str = "127.0.0.1", port: int = 8000):
+    """
+    Creates an OpenAI-compatible HTTP server (`/v1/chat/completions`, `/v1/models`) answering
+    with a mock model, streamed or not, with keep-alive connections. Point an `openai/...` model
+    of models.yaml to it with `base_url: http://<host>:<port>/v1` to exercise the real network
+    code path. Failures are answered with the provider's status codes (429 with `Retry-After`, 500).
+
+    Args:
+        responder (MockResponder): The responses, timings and failures to serve.
+        host (str): The interface to listen on.
+        port (int): The port to listen on, 0 for any free port (see `server.server_port`).
+
+    Returns:
+        ThreadingHTTPServer: The server, to run with `serve_forever()` (e.g. in a thread).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict, headers: dict = None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_event(self, body):
+            data = body if isinstance(body, str) else json.dumps(body)
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "instruct"}]})
+            else:
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            messages = request.get("messages", [])
+            model = request.get("model", "mock")
+            completion_id = f"chatcmpl-mock-{time.time_ns()}"
+            try:
+                plans = [responder.plan(messages, request.get("max_tokens")) for _ in range(request.get("n") or 1)]
+            except MockError as e:
+                headers = {"Retry-After": "1"} if isinstance(e, MockRateLimitError) else None
+                self._send_json(e.status_code, {"error": {"message": str(e), "type": e.error_type}}, headers)
+                return
+
+            prompt_tokens = sum(len(mock_tokens(str(message.get("content", "")))) for message in messages)
+            completion_tokens = sum(len(tokens) for tokens, _ in plans)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+            time.sleep(responder.ttft)
+
+            if not request.get("stream"):
+                time.sleep(responder.token_interval * max(len(plans[0][0]) - 1, 0))
+                self._send_json(200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {"index": index, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": finish_reason}
+                        for index, (tokens, finish_reason) in enumerate(plans)
+                    ],
+                    "usage": usage,
+                })
+                return
+
+            tokens, finish_reason = plans[0]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self._send_event(_completion_chunk(completion_id, model, {"role": "assistant", "content": ""}))
+            for index, token in enumerate(tokens):
+                if index:
+                    time.sleep(responder.token_interval)
+                self._send_event(_completion_chunk(completion_id, model, {"content": token}))
+            self._send_event(_completion_chunk(completion_id, model, {}, finish_reason))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self._send_event(_completion_chunk(completion_id, model, {}, usage=usage))
+            self._send_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(responder: MockResponder, host: str = "127.0.0.1", port: int = 8000):
+    """
+    Runs the mock OpenAI-compatible server (see `mock_server`) until interrupted.
+    """
+    server = mock_server(responder, host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -1,8 +1,39 @@
+import asyncio
 import logging
-import litellm as llm
+import time
 
-llm.logging = False
-logging.getLogger("LiteLLM").setLevel(logging.ERROR)
+from instruct.llm_engine import completion_cache
+from instruct.llm_engine.concurrency import model_slot
+from instruct.llm_engine.connection_pool import ConnectionPool
+from instruct.llm_engine.stream import (
+    StopSequenceCutter,
+    StreamChunk,
+    TextCallbackAdapter,
+    chunk_from_response,
+    chunk_from_stream,
+    reported_stop_sequence,
+    usage_dict,
+)
+from instruct.llm_engine.tokenizer import get_token_counter
+from instruct.llm_engine.usage import Completion, add_usage, call_usage
+from instruct.tracing import start_span
+
+_litellm = None
+
+
+def litellm():
+    """
+    Returns the litellm module, imported on first use: importing it takes seconds,
+    which commands that never call a model should not pay.
+    """
+    global _litellm
+    if _litellm is None:
+        import litellm as llm
+
+        llm.logging = False
+        logging.getLogger("LiteLLM").setLevel(logging.ERROR)
+        _litellm = llm
+    return _litellm
 
 
 class Model:
@@ -17,6 +48,14 @@ class Model:
         api_key: str = None,
         api_version: str = None,
         base_url: str = None,
+        tokenizer: str = None,
+        context_window: int = None,
+        max_concurrency: int = None,
+        pool_size: int = None,
+        keep_alive: float = None,
+        preconnect: bool = False,
+        input_cost: float = None,
+        output_cost: float = None,
         **kwargs,
     ):
         """
@@ -24,12 +63,111 @@ class Model:
 
         Args:
             model_conf (dict): The configuration for the model.
+            tokenizer (str): The offline token counter, e.g. `tiktoken:cl100k_base`. Defaults to the model family's one.
+            context_window (int): The maximum number of tokens (prompt + completion) of the model.
+            max_concurrency (int): The maximum number of concurrent calls to the model in a batch.
+            pool_size (int): The maximum number of pooled keep-alive connections to the model.
+            keep_alive (float): How long an idle pooled connection is kept open, in seconds.
+            preconnect (bool): Whether to open a connection to the model when the CLI starts.
+            input_cost (float): The price of a million prompt tokens, to compute the cost of the calls.
+            output_cost (float): The price of a million completion tokens.
+
+        Attributes:
+            hooks (list): Tracing hooks receiving the spans of the model calls (see `instruct.tracing`).
+            total_usage (dict): The calls, tokens, cost and latency of the model since it was loaded.
         """
         self.model = model
         self.name = name
         self.api_key = api_key
         self.api_version = api_version
         self.base_url = base_url
+        self.tokenizer = tokenizer
+        self.context_window = context_window
+        self.max_concurrency = max_concurrency
+        self.preconnect = preconnect
+        self.input_cost = input_cost
+        self.output_cost = output_cost
+        self.total_usage = {}
+        self.connection_pool = ConnectionPool(self, pool_size, keep_alive)
+        self.hooks = []
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Counts the tokens of a text offline, with the model's tokenizer.
+
+        Args:
+            text (str): The text to count.
+
+        Returns:
+            int: The number of tokens.
+        """
+        return get_token_counter(self.tokenizer, self.model)(text)
+
+    def price(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """
+        Returns the cost of a call from the model's rates (`input_cost` and `output_cost`
+        per million tokens), or None when the model has no rates.
+        """
+        if self.input_cost is None and self.output_cost is None:
+            return None
+        return (prompt_tokens * (self.input_cost or 0) + completion_tokens * (self.output_cost or 0)) / 1_000_000
+
+    def _call_usage(self, messages: list, text: str, usage: dict, latency: float, cached: bool = False) -> dict:
+        # the usage of a call, added to the model's totals
+        usage = call_usage(self, messages, text, usage, latency, cached)
+        add_usage(self.total_usage, usage)
+        return usage
+
+    def ping(self, timeout: float = None):
+        """
+        Sends a minimal completion request to check that the model answers.
+        Unlike `invoke`, errors are raised.
+
+        Args:
+            timeout (float): The request timeout, in seconds.
+        """
+        params = self._completion_params([{"role": "user", "content": "ping"}], 0, 1)
+        with self.connection_pool.in_use():
+            litellm().completion(**params, **self._client_params(), timeout=timeout)
+
+    def _client_params(self, asynchronous: bool = False) -> dict:
+        # pooled connections, when the provider supports it
+        pool = self.connection_pool
+        client = pool.async_client() if asynchronous else pool.client()
+        return {"client": client} if client is not None else {}
+
+    def _completion_params(
+        self, messages, temperature, max_tokens, stream=False, response_format=None, stop=None
+    ) -> dict:
+        """
+        Builds the completion parameters shared by the sync and async paths.
+        """
+        openai_compatible = self.model.split("/")[0] in [
+            "openai",
+            "azure",
+        ]
+        use_response_format = (
+            openai_compatible and (response_format is not None)
+        )  # for now, json format supported only for openai and azure models
+
+        params = dict(
+            model=self.model,
+            api_key=self.api_key,
+            api_version=self.api_version,
+            base_url=self.base_url,
+            messages=messages,
+            stream=stream if not use_response_format else False, # no stream support for json format
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format=response_format if use_response_format else None,
+            # format = "json" #TODO fix LiteLLM issue with ollama format (see workdir/lllm_ollama_format_json_bug.py)
+        )
+        if stop:
+            params["stop"] = stop
+        if params["stream"] and openai_compatible:
+            # ask for the usage block on the last chunk
+            params["stream_options"] = {"include_usage": True}
+        return params
 
     def invoke(
         self,
@@ -39,6 +177,8 @@ class Model:
         stream=False,
         stream_callback=None,
         response_format=None,
+        cache=False,
+        stop=None,
     ):
         """
         Perform a Model chat completion.
@@ -49,56 +189,306 @@ class Model:
             max_tokens (int): Maximum number of tokens in the generated response.
             stream (bool): Whether to stream the response.
             stream_callback (function): Callback function for streaming.
+            cache (bool): Whether to serve and store the response through the completion cache.
+            stop (list): Stop sequences, also applied client-side (see `stream.StopSequenceCutter`).
             api_key (str): API key for the model.
             api_version (str): API version for the model.
             base_url (str): Base URL for the model.
 
         Returns:
-            Response from the model.
+            Completion: Response from the model, with the tokens, cost and latency of the call in `usage`.
         """
         try:
+            params = self._completion_params(
+                messages, temperature, max_tokens, stream, response_format, stop
+            )
+            if cache:
+                cache_key = self._cache_key(params)
+                cached = completion_cache.safe_get(cache_key)
+                if cached is not None:
+                    return self._replay(cached, params["stream"], stream_callback)
 
+            response = self._complete(params, stream_callback)
+            if cache and response is not None:
+                completion_cache.safe_set(cache_key, self.model, response)
+            return response
+        except Exception as e:
+            logging.error(f"Error in Model invoke: {e}")
 
-            use_response_format = (
-                (self.model.split("/")[0]
-                in [
-                    "openai",
-                    "azure",
-                ])
-                and (response_format is not None)
-            )  # for now, json format supported only for openai and azure models
-
-            completion_result = llm.completion(
-                model=self.model,
-                api_key=self.api_key,
-                api_version=self.api_version,
-                base_url=self.base_url,
-                messages=messages,
-                stream=stream if not use_response_format else False, # no stream support for json format
-                temperature=temperature,
-                max_tokens=max_tokens,
-                response_format=response_format if use_response_format else None,
-                # format = "json" #TODO fix LiteLLM issue with ollama format (see workdir/lllm_ollama_format_json_bug.py)
+    def _cache_key(self, params: dict) -> str:
+        return completion_cache.completion_key(
+            params["model"],
+            params["messages"],
+            params["temperature"],
+            params["max_tokens"],
+            params["response_format"],
+            params.get("stop"),
+            [params["base_url"], params["api_version"]] if params["base_url"] or params["api_version"] else None,
+        )
+
+    def _replay(self, response: str, stream: bool, stream_callback=None) -> Completion:
+        # a cached streamed result still drives the stream callback
+        if stream and stream_callback is not None:
+            try:
+                stream_callback(response)
+            except Exception as e:
+                logging.error(f"🔴 Error in stream_callback: {e}")
+        if isinstance(response, Completion):
+            return response
+        return Completion(response, self._call_usage([], response, None, 0.0, cached=True))
+
+    def _complete(self, params: dict, stream_callback=None) -> Completion:
+        start = time.perf_counter()
+        adapter = TextCallbackAdapter(stream_callback if params["stream"] else None)
+        deltas, usage = [], None
+        for chunk in self._chunks(params):
+            deltas.append(chunk.delta)
+            usage = chunk.usage or usage
+            adapter(chunk)
+        # the complete text is built once, at the end
+        text = "".join(deltas)
+        return Completion(text, self._call_usage(params["messages"], text, usage, time.perf_counter() - start))
+
+    def _chunks(self, params: dict):
+        span = start_span("model.call", self.hooks, model=self.model, stream=params["stream"])
+        timer = _CallTimer(span)
+        cutter = StopSequenceCutter(params.get("stop"))
+        provider_chunks = self._provider_chunks(params)
+        try:
+            for chunk in provider_chunks:
+                if span.recording:
+                    timer(chunk)
+                if not cutter.done:
+                    yield cutter(chunk)
+                elif chunk.usage:
+                    yield _usage_chunk(chunk)
+        except GeneratorExit:
+            # the consumer stopped reading
+            raise
+        except BaseException as e:
+            timer.error = str(e) or type(e).__name__
+            raise
+        finally:
+            provider_chunks.close()
+            timer.finish()
+
+    async def _achunks(self, params: dict):
+        # within a batch, the call waits for a slot of this model (see `concurrency.ModelLimits`)
+        async with model_slot(self):
+            span = start_span("model.call", self.hooks, model=self.model, stream=params["stream"])
+            timer = _CallTimer(span)
+            cutter = StopSequenceCutter(params.get("stop"))
+            provider_chunks = self._aprovider_chunks(params)
+            try:
+                async for chunk in provider_chunks:
+                    if span.recording:
+                        timer(chunk)
+                    if not cutter.done:
+                        yield cutter(chunk)
+                    elif chunk.usage:
+                        yield _usage_chunk(chunk)
+            except GeneratorExit:
+                # the consumer stopped reading
+                raise
+            except BaseException as e:
+                timer.error = str(e) or type(e).__name__
+                raise
+            finally:
+                await provider_chunks.aclose()
+                timer.finish()
+
+    def _provider_chunks(self, params: dict):
+        with self.connection_pool.in_use():
+            # the provider call, through LiteLLM
+            completion_result = litellm().completion(**params, **self._client_params())
+
+            if not params["stream"]: # no stream support if response_format set
+                yield chunk_from_response(completion_result)
+                return
+
+            for index, stream_chunk in enumerate(completion_result):
+                yield chunk_from_stream(index, stream_chunk)
+
+    async def _aprovider_chunks(self, params: dict):
+        with self.connection_pool.in_use():
+            completion_result = await litellm().acompletion(**params, **self._client_params(asynchronous=True))
+
+            if not params["stream"]:
+                yield chunk_from_response(completion_result)
+                return
+
+            index = 0
+            try:
+                async for stream_chunk in completion_result:
+                    yield chunk_from_stream(index, stream_chunk)
+                    index += 1
+            finally:
+                # release the pooled connection of a response left unread
+                aclose = getattr(completion_result, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+
+    def stream(
+        self,
+        messages,
+        temperature,
+        max_tokens,
+        stream=True,
+        response_format=None,
+        stop=None,
+    ):
+        """
+        Perform a Model chat completion and yield the deltas as they arrive.
+        When the response cannot be streamed (response_format set), a single chunk holds the whole text.
+
+        Args:
+            messages (list): List of messages.
+            temperature (float): Temperature parameter for generating responses.
+            max_tokens (int): Maximum number of tokens in the generated response.
+            stream (bool): Whether to stream the response.
+            response_format (dict): The response format, e.g. {"type": "json_object"}.
+            stop (list): Stop sequences, also applied client-side (see `stream.StopSequenceCutter`).
+
+        Yields:
+            StreamChunk: The successive deltas, with their index, finish reason and usage.
+        """
+        yield from self._chunks(
+            self._completion_params(messages, temperature, max_tokens, stream, response_format, stop)
+        )
+
+    async def ainvoke(
+        self,
+        messages,
+        temperature,
+        max_tokens,
+        stream=False,
+        stream_callback=None,
+        response_format=None,
+        cache=False,
+        stop=None,
+    ):
+        """
+        Perform a Model chat completion on the event loop, with the same
+        response_format, stream and cache semantics as `invoke`.
+
+        Args:
+            messages (list): List of messages.
+            temperature (float): Temperature parameter for generating responses.
+            max_tokens (int): Maximum number of tokens in the generated response.
+            stream (bool): Whether to stream the response.
+            stream_callback (function): Callback function for streaming, called with the text so far.
+            cache (bool): Whether to serve and store the response through the completion cache.
+            stop (list): Stop sequences, also applied client-side (see `stream.StopSequenceCutter`).
+
+        Returns:
+            Completion: Response from the model, with the usage of the call.
+        """
+        try:
+            start = time.perf_counter()
+            params = self._completion_params(
+                messages, temperature, max_tokens, stream, response_format, stop
             )
+            if cache:
+                cache_key = self._cache_key(params)
+                cached = completion_cache.safe_get(cache_key)
+                if cached is not None:
+                    return self._replay(cached, params["stream"], stream_callback)
 
-            if use_response_format or not stream: # no stream support if response_format set
-                return completion_result["choices"][0]["message"]["content"]
-
-            else:
-                complete_text = ""
-                for stream_chunk in completion_result:
-                    complete_text += stream_chunk.choices[0].delta.content or ""
-                    if stream_callback is not None:
-                        try:
-                            stream_callback(complete_text)
-                        except Exception as e:
-                            logging.error(f"🔴 Error in stream_callback: {e}")
-                print(f"complete_text: {complete_text}")
-                response = complete_text
+            adapter = TextCallbackAdapter(stream_callback if params["stream"] else None)
+            deltas, usage = [], None
+            async for chunk in self._achunks(params):
+                deltas.append(chunk.delta)
+                usage = chunk.usage or usage
+                adapter(chunk)
+            text = "".join(deltas)
+            response = Completion(text, self._call_usage(messages, text, usage, time.perf_counter() - start))
 
+            if cache:
+                completion_cache.safe_set(cache_key, self.model, response)
             return response
         except Exception as e:
-            logging.error(f"Error in Model invoke: {e}")
+            logging.error(f"Error in Model ainvoke: {e}")
+
+    @property
+    def supports_n(self) -> bool:
+        """
+        Whether the provider generates several choices per request (`n` parameter).
+        """
+        return self.model.split("/")[0] in ["openai", "azure"]
+
+    async def asample(self, messages, temperature, max_tokens, n, response_format=None, stop=None) -> list:
+        """
+        Generates `n` completions of the same messages: in a single request when the
+        provider supports the `n` parameter, with `n` concurrent requests otherwise.
+        Samples are never cached.
+
+        Args:
+            messages (list): List of messages.
+            temperature (float): Temperature parameter for generating responses.
+            max_tokens (int): Maximum number of tokens in each generated response.
+            n (int): The number of samples.
+            response_format (dict): The response format, e.g. {"type": "json_object"}.
+            stop (list): Stop sequences, also applied client-side (see `stream.StopSequenceCutter`).
+
+        Returns:
+            list: The samples (Completions), None for the failed ones. Samples generated in a
+                single request share its usage.
+        """
+        if not self.supports_n:
+            return list(await asyncio.gather(
+                *(
+                    self.ainvoke(messages, temperature, max_tokens, response_format=response_format, stop=stop)
+                    for _ in range(n)
+                )
+            ))
+        try:
+            params = self._completion_params(messages, temperature, max_tokens, False, response_format, stop)
+            start = time.perf_counter()
+            async with model_slot(self):
+                with start_span("model.call", self.hooks, model=self.model, stream=False, n=n), self.connection_pool.in_use():
+                    response = await litellm().acompletion(**params, n=n, **self._client_params(asynchronous=True))
+            texts = []
+            for choice in response["choices"]:
+                chunk = StreamChunk(
+                    0, choice["message"]["content"] or "", choice.get("finish_reason"), None, reported_stop_sequence(choice)
+                )
+                texts.append(StopSequenceCutter(stop)(chunk).delta)
+            usage = self._call_usage(
+                messages, "".join(texts), usage_dict(response.get("usage")), time.perf_counter() - start
+            )
+            return [Completion(text, usage) for text in texts]
+        except Exception as e:
+            logging.error(f"Error in Model asample: {e}")
+            return [None] * n
+
+    async def astream(
+        self,
+        messages,
+        temperature,
+        max_tokens,
+        stream=True,
+        response_format=None,
+        stop=None,
+    ):
+        """
+        Perform a Model chat completion on the event loop and yield the deltas as they arrive.
+        When the response cannot be streamed (response_format set), a single chunk holds the whole text.
+
+        Args:
+            messages (list): List of messages.
+            temperature (float): Temperature parameter for generating responses.
+            max_tokens (int): Maximum number of tokens in the generated response.
+            stream (bool): Whether to stream the response.
+            response_format (dict): The response format, e.g. {"type": "json_object"}.
+            stop (list): Stop sequences, also applied client-side (see `stream.StopSequenceCutter`).
+
+        Yields:
+            StreamChunk: The successive deltas, with their index, finish reason and usage.
+        """
+        async for chunk in self._achunks(
+            self._completion_params(messages, temperature, max_tokens, stream, response_format, stop)
+        ):
+            yield chunk
 
     def interpret(
         self,
@@ -108,6 +498,8 @@ class Model:
         stream=False,
         stream_callback=None,
         response_format=None,
+        cache=False,
+        stop=None,
     ):
         """
         Perform the interpretation of an Instruct object using the Model.
@@ -118,12 +510,14 @@ class Model:
             max_tokens (int): Maximum number of tokens in the generated response.
             stream (bool): Whether to stream the response.
             stream_callback (function): Callback function for streaming.
+            cache (bool): Whether to go through the completion cache.
+            stop (list): Stop sequences, also applied client-side (see `stream.StopSequenceCutter`).
 
         Returns:
             None
         """
         try:
-            messages = [{"role": "user", "content": instruct.prompt}]
+            messages = [{"role": "user", "content": instruct.prompt_for(self, max_tokens)}]
             return self.invoke(
                 messages=messages,
                 temperature=temperature,
@@ -131,6 +525,94 @@ class Model:
                 stream=stream,
                 stream_callback=stream_callback,
                 response_format=response_format,
+                cache=cache,
+                stop=stop,
             )
         except Exception as e:
             logging.error(f"Error in Model interpret: {e}")
+
+    async def ainterpret(
+        self,
+        instruct,
+        temperature,
+        max_tokens,
+        stream=False,
+        stream_callback=None,
+        response_format=None,
+        cache=False,
+        stop=None,
+    ):
+        """
+        Perform the interpretation of an Instruct object using the Model, on the event loop.
+
+        Args:
+            instruct (Instruct): The Instruct object.
+            temperature (float): Temperature parameter for generating responses.
+            max_tokens (int): Maximum number of tokens in the generated response.
+            stream (bool): Whether to stream the response.
+            stream_callback (function): Callback function for streaming.
+            cache (bool): Whether to go through the completion cache.
+            stop (list): Stop sequences, also applied client-side (see `stream.StopSequenceCutter`).
+
+        Returns:
+            Response from the model.
+        """
+        try:
+            messages = [{"role": "user", "content": instruct.prompt_for(self, max_tokens)}]
+            return await self.ainvoke(
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=stream,
+                stream_callback=stream_callback,
+                response_format=response_format,
+                cache=cache,
+                stop=stop,
+            )
+        except Exception as e:
+            logging.error(f"Error in Model ainterpret: {e}")
+
+
+def _usage_chunk(chunk: StreamChunk) -> StreamChunk:
+    # after a client-side cut, the stream is read on for its usage only: the provider
+    # sends it last, and got the stop sequences, so it stops generating shortly after
+    return StreamChunk(chunk.index, "", None, chunk.usage)
+
+
+class _CallTimer:
+    """
+    Times the steps of a model call for its `model.call` span: the request until the first
+    chunk (`model.request`), the time to first token (`model.ttft`) and the generation of
+    the following tokens (`model.stream`).
+    """
+
+    def __init__(self, span):
+        self.span = span
+        self.first_chunk = None
+        self.first_token = None
+        self.usage = None
+        self.error = None
+
+    def __call__(self, chunk: StreamChunk):
+        now = time.time_ns()
+        if self.first_chunk is None:
+            self.first_chunk = now
+        if self.first_token is None and chunk.delta:
+            self.first_token = now
+        self.usage = chunk.usage or self.usage
+
+    def finish(self):
+        span = self.span
+        if not span.recording:
+            return
+        end = time.time_ns()
+        span.child("model.request", span.start, self.first_chunk or end)
+        if self.first_token is not None:
+            span.child("model.ttft", span.start, self.first_token)
+            span.child("model.stream", self.first_token, end)
+        if self.usage:
+            span.set(
+                prompt_tokens=self.usage.get("prompt_tokens"),
+                completion_tokens=self.usage.get("completion_tokens"),
+            )
+        span.finish(end, self.error)
@@ -1,14 +1,33 @@
 import logging
 import os
+import threading
+import time
 from typing import List
 import yaml
+from instruct.llm_engine.mock import MockModel
 from instruct.llm_engine.model import Model
+from instruct.tracing import start_span
 
 
 logging.basicConfig(level=logging.ERROR)
 
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 class ModelLoader:
+    """
+    The registry of the models configured in `~/.instruct/models.yaml`, shared by the process.
+
+    Models are indexed by name (see `find`) and configuration key (see `get`). The file is
+    reloaded when it changes (checked at most every `reload_interval` seconds): long-running
+    workers pick up new endpoints without restarting. Models whose configuration did not
+    change are kept, with their connection pool and usage totals.
+
+    Attributes:
+        version (int): Incremented on each (re)load, to invalidate the models resolved from the registry.
+    """
+
     models_conf_filename = "~/.instruct/models.yaml"
+    reload_interval = 1.0  # seconds
     _instance = None
     _initialized = False
 
@@ -19,23 +38,134 @@ class ModelLoader:
 
     def __init__(self):
         if not self._initialized:
-            self.models: list[Model] = self._load_models()
+            self._lock = threading.Lock()
+            self._entries = []  # (key, data, model)
+            self._models = []
+            self._by_name = {}
+            self._by_key = {}
+            self._stamp = None
+            self._checked = 0.0
+            self._version = 0
+            self.reload()
             self._initialized = True
 
-    def _load_models(self):
+    @property
+    def version(self) -> int:
+        self._refresh()
+        return self._version
+
+    @property
+    def models(self) -> List[Model]:
+        """
+        The configured models, in the order of the file.
+        """
+        self._refresh()
+        return self._models
+
+    def find(self, name: str) -> List[Model]:
+        """
+        Returns the models with a name (several models can share one), in the order of the file.
+        """
+        self._refresh()
+        return self._by_name.get(name, [])
+
+    def get(self, key: str) -> Model:
+        """
+        Returns the model of a configuration key, e.g. `openai/gpt-4o`, or None.
+        """
+        self._refresh()
+        return self._by_key.get(key)
+
+    def _file_stamp(self):
         try:
-            with open(os.path.expanduser(self.models_conf_filename), "r") as f:
-                config = yaml.load(f, Loader=yaml.FullLoader) or {}
+            stat = os.stat(os.path.expanduser(self.models_conf_filename))
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        if self._file_stamp() != self._stamp:
+            logging.info(f"{self.models_conf_filename} changed, reloading the models")
+            self.reload()
+
+    def reload(self):
+        """
+        Loads the models from the configuration file.
+        """
+        with self._lock:
+            stamp = self._file_stamp()
+            entries = self._load_models(self._entries)
+            by_name, by_key = {}, {}
+            for key, _, model in entries:
+                by_name.setdefault(model.name, []).append(model)
+                by_key.setdefault(key, model)
+            removed = [model for model in self._models if not any(model is kept for _, _, kept in entries)]
+            self._entries = entries
+            self._models = [model for _, _, model in entries]
+            self._by_name, self._by_key = by_name, by_key
+            self._stamp = stamp
+            self._checked = time.monotonic()
+            self._version += 1
+        # the models removed or reconfigured release their pooled connections
+        for model in removed:
+            model.connection_pool.retire()
+
+    def _load_models(self, previous: list = ()) -> list:
+        """
+        Reads the configuration file.
+
+        Args:
+            previous (list): The entries of the previous load: the models whose configuration
+                did not change are reused.
+
+        Returns:
+            list: A (configuration key, configuration, Model) tuple per model,
+                the previous entries if the file cannot be loaded.
+        """
+        with start_span("models.load", file=self.models_conf_filename) as span:
+            try:
+                with open(os.path.expanduser(self.models_conf_filename), "r") as f:
+                    # the C loader (libyaml) when available
+                    config = yaml.load(f, Loader=YAML_LOADER) or {}
+
+                reusable = {key: (data, model) for key, data, model in previous}
+                entries = []
+                for _, models_data in config.items():
+                    for conf_model, data in models_data.items():
+                        model = conf_model
+                        data = data or {}
+                        if model in reusable and reusable[model][0] == data:
+                            entries.append((model, data, reusable[model][1]))
+                            continue
+                        # `mock/...` models answer locally, see llm_engine/mock.py
+                        model_class = MockModel if model.startswith("mock/") else Model
+                        provider = model_class(model=model, **data)
+                        entries.append((model, data, provider))
+                span.set(models=len(entries))
+                return entries
 
-            model_list: List[Model] = []
-            for _, models_data in config.items():
-                for conf_model, data in models_data.items():
-                    model = conf_model
-                    provider = Model(model=model, **data)
-                    model_list.append(provider)
-            return model_list
+            except Exception as e:
+                logging.error(f"Error loading {self.models_conf_filename}: {e}")
+                span.set(error=str(e))
+                # e.g. a file being edited: the previous models are kept
+                return list(previous)
 
-        except Exception as e:
-            logging.error(f"Error loading {self.models_conf_filename}: {e}")
-            return []
+    def preconnect(self) -> list:
+        """
+        Opens, in background threads, a connection to each model configured with
+        `preconnect: true`, so that their first call skips the connection setup.
 
+        Returns:
+            list: The started threads.
+        """
+        threads = []
+        for model in self.models:
+            if model.preconnect and model.connection_pool.enabled:
+                thread = threading.Thread(target=model.connection_pool.preconnect, daemon=True)
+                thread.start()
+                threads.append(thread)
+        return threads
@@ -0,0 +1,150 @@
+import logging
+import re
+
+
+class StreamChunk:
+    """
+    A delta of a streamed completion.
+
+    Attributes:
+        index (int): The position of the chunk in the stream.
+        delta (str): The text generated since the previous chunk.
+        finish_reason (str): Why the generation stopped, on the last chunk(s) only.
+        usage (dict): The token usage reported by the provider, usually on the last chunk only.
+        stop_sequence (str): The stop sequence the generation stopped on, when the provider reports it.
+    """
+
+    __slots__ = ("index", "delta", "finish_reason", "usage", "stop_sequence")
+
+    def __init__(self, index: int, delta: str, finish_reason: str = None, usage: dict = None, stop_sequence: str = None):
+        self.index = index
+        self.delta = delta
+        self.finish_reason = finish_reason
+        self.usage = usage
+        self.stop_sequence = stop_sequence
+
+    def __repr__(self):
+        return f"StreamChunk(index={self.index}, delta={self.delta!r}, finish_reason={self.finish_reason!r})"
+
+
+def usage_dict(usage) -> dict:
+    """
+    Converts the usage block of a provider response to a plain dict.
+    """
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return dict(usage)
+    if hasattr(usage, "model_dump"):
+        return usage.model_dump()
+    return dict(usage)
+
+
+def reported_stop_sequence(choice) -> str:
+    """
+    Returns the stop sequence a provider reports having stopped on, if any: `stop_sequence`
+    (e.g. Anthropic) or a string `stop_reason` (e.g. vLLM). OpenAI reports `finish_reason: stop`
+    for both a stop sequence and a natural end, without telling them apart.
+    """
+    for field in ("stop_sequence", "stop_reason"):
+        value = choice.get(field) if isinstance(choice, dict) else getattr(choice, field, None)
+        if isinstance(value, str) and value:
+            return value
+    return None
+
+
+def chunk_from_stream(index: int, stream_chunk) -> StreamChunk:
+    """
+    Builds a StreamChunk from a chunk of a streamed provider response.
+    """
+    delta, finish_reason, stop_sequence = "", None, None
+    if stream_chunk.choices:
+        choice = stream_chunk.choices[0]
+        delta = choice.delta.content or ""
+        finish_reason = choice.finish_reason
+        if finish_reason is not None:
+            stop_sequence = reported_stop_sequence(choice)
+    return StreamChunk(index, delta, finish_reason, usage_dict(getattr(stream_chunk, "usage", None)), stop_sequence)
+
+
+def chunk_from_response(response) -> StreamChunk:
+    """
+    Builds a single StreamChunk from a complete (non streamed) provider response.
+    """
+    choice = response["choices"][0]
+    return StreamChunk(
+        0,
+        choice["message"]["content"] or "",
+        choice.get("finish_reason"),
+        usage_dict(response.get("usage")),
+        reported_stop_sequence(choice),
+    )
+
+
+class TextCallbackAdapter:
+    """
+    Adapts the legacy `stream_callback(text_so_far)` to a stream of deltas.
+    The text so far is only built when such a callback is set.
+    """
+
+    def __init__(self, stream_callback):
+        self.stream_callback = stream_callback
+        self.text = ""
+
+    def __call__(self, chunk: StreamChunk):
+        if self.stream_callback is None or not chunk.delta:
+            return
+        self.text += chunk.delta
+        try:
+            self.stream_callback(self.text)
+        except Exception as e:
+            logging.error(f"🔴 Error in stream_callback: {e}")
+
+
+class StopSequenceCutter:
+    """
+    Applies stop sequences to a stream of deltas, client-side.
+
+    The stream is cut right after the first stop sequence, which is kept in the text:
+    providers may not support stop sequences, or send a few more tokens before stopping.
+    Conversely, providers that stopped on a closing tag (e.g. `</answer>`) drop it from
+    their output: it is appended back when the provider reports that stop sequence
+    (see `reported_stop_sequence`) and its opening tag is left open.
+
+    Attributes:
+        stop (list): The stop sequences.
+        done (bool): Whether a stop sequence was found; the following deltas are dropped.
+    """
+
+    def __init__(self, stop: list = None):
+        self.stop = [sequence for sequence in stop or [] if sequence]
+        self.done = False
+        self._parts = []
+        self._tail = ""
+        self._tail_length = max((len(sequence) for sequence in self.stop), default=1) - 1
+
+    def __call__(self, chunk: StreamChunk) -> StreamChunk:
+        if not self.stop or self.done:
+            return chunk
+        window = self._tail + chunk.delta
+        ends = [window.find(sequence) + len(sequence) for sequence in self.stop if sequence in window]
+        if ends:
+            chunk.delta = chunk.delta[: min(ends) - len(self._tail)]
+            chunk.finish_reason = "stop"
+            self.done = True
+        elif chunk.stop_sequence in self.stop:
+            chunk.delta += self._closing_tag(chunk.stop_sequence, chunk.delta)
+        self._parts.append(chunk.delta)
+        self._tail = window[-self._tail_length:] if self._tail_length else ""
+        return chunk
+
+    def _closing_tag(self, sequence: str, delta: str) -> str:
+        # the closing tag the provider stopped on, if its tag is left open
+        if not (sequence.startswith("</") and sequence.endswith(">")):
+            return ""
+        text = "".join(self._parts) + delta
+        # `<answer>` or `<answer ...>`, not `<answers>`
+        openings = [match.end() for match in re.finditer(rf"<{re.escape(sequence[2:-1])}[\s>]", text)]
+        if openings and sequence not in text[openings[-1]:]:
+            return sequence
+        return ""
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import math
+import os
+import tempfile
+from functools import lru_cache
+from typing import Callable
+
+# Average number of characters per token used when no tokenizer is available.
+HEURISTIC_CHARS_PER_TOKEN = 4
+
+# Providers whose models are tokenized with tiktoken by default.
+TIKTOKEN_PROVIDERS = ["openai", "azure"]
+
+# Where tiktoken downloads the BPE file of an encoding from, and caches it under sha1(url).
+TIKTOKEN_BPE_URL = "https://openaipublic.blob.core.windows.net/encodings/{}.tiktoken"
+
+TokenCounter = Callable[[str], int]
+
+
+def heuristic_token_count(text: str) -> int:
+    """
+    Estimates the number of tokens of a text from its length.
+    """
+    return math.ceil(len(text) / HEURISTIC_CHARS_PER_TOKEN)
+
+
+def _heuristic_counter(argument: str, model: str) -> TokenCounter:
+    return heuristic_token_count
+
+
+def tiktoken_cache_path(encoding_name: str) -> str:
+    """
+    Returns the file of an encoding in tiktoken's local cache (TIKTOKEN_CACHE_DIR,
+    DATA_GYM_CACHE_DIR or `<tmp>/data-gym-cache`, as tiktoken resolves it), None if caching is disabled.
+    """
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR", os.environ.get("DATA_GYM_CACHE_DIR"))
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if cache_dir == "":
+        return None
+    return os.path.join(cache_dir, hashlib.sha1(TIKTOKEN_BPE_URL.format(encoding_name).encode()).hexdigest())
+
+
+def _tiktoken_counter(argument: str, model: str) -> TokenCounter:
+    import tiktoken
+    from tiktoken.model import encoding_name_for_model
+
+    if argument:
+        encoding_name = argument
+    else:
+        try:
+            encoding_name = encoding_name_for_model(model.split("/", 1)[-1])
+        except KeyError:
+            encoding_name = "o200k_base"
+    # tiktoken downloads a missing encoding, which fails or hangs offline: only the cached ones are used
+    cache_path = tiktoken_cache_path(encoding_name)
+    if cache_path is None or not os.path.exists(cache_path):
+        raise LookupError(f"the {encoding_name} encoding is not in the tiktoken cache (set TIKTOKEN_CACHE_DIR)")
+    encoding = tiktoken.get_encoding(encoding_name)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def _tokenizers_counter(argument: str, model: str) -> TokenCounter:
+    from tokenizers import Tokenizer
+
+    # local tokenizer.json file: no network access when counting
+    tokenizer = Tokenizer.from_file(argument)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+# Token counter factories, by name. A factory receives the argument of the
+# `tokenizer` setting (after the colon, e.g. `tiktoken:cl100k_base`) and the model.
+token_counters = {
+    "heuristic": _heuristic_counter,
+    "tiktoken": _tiktoken_counter,
+    "tokenizers": _tokenizers_counter,
+}
+
+
+def register_token_counter(name: str, factory: Callable[[str, str], TokenCounter]):
+    """
+    Registers a token counter factory usable from the `tokenizer` setting of models.yaml.
+
+    Args:
+        name (str): The name of the counter, e.g. `sentencepiece`.
+        factory (callable): Receives the setting argument and the model, returns a `text -> int` function.
+    """
+    token_counters[name] = factory
+    get_token_counter.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(tokenizer: str = None, model: str = "") -> TokenCounter:
+    """
+    Returns the offline token counter for a model. Counting never goes to the network:
+    tiktoken encodings are loaded from tiktoken's local cache only (see `tiktoken_cache_path`;
+    fill it once with network access, e.g. `tiktoken.get_encoding("o200k_base")`, or copy
+    the files to TIKTOKEN_CACHE_DIR), and `tokenizers` reads a local tokenizer.json.
+
+    Args:
+        tokenizer (str): The `tokenizer` setting of the model, e.g. `tiktoken:cl100k_base`,
+            `tokenizers:/path/to/tokenizer.json` or `heuristic`. Defaults to the model family's counter.
+        model (str): The model, e.g. `openai/gpt-4o`.
+
+    Returns:
+        callable: A function returning the number of tokens of a text.
+        Falls back to the heuristic counter when the tokenizer is not available.
+    """
+    if tokenizer is None:
+        tokenizer = "tiktoken" if model.split("/")[0] in TIKTOKEN_PROVIDERS else "heuristic"
+
+    name, _, argument = tokenizer.partition(":")
+    try:
+        return token_counters[name](argument, model)
+    except Exception as e:
+        logging.warning(f"Tokenizer {tokenizer} unavailable for {model}, using heuristic count > {e}")
+        return heuristic_token_count
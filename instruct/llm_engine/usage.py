@@ -0,0 +1,113 @@
+import threading
+
+TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+_lock = threading.Lock()
+
+
+class Completion(str):
+    """
+    The text of a model response, with the usage of the call in `usage` (see `call_usage`).
+    Everywhere else, it is a plain str.
+    """
+
+    def __new__(cls, text: str, usage: dict = None):
+        completion = super().__new__(cls, text)
+        completion.usage = usage or {}
+        return completion
+
+    @property
+    def cost(self) -> float:
+        """
+        The price of the call, None if the model has no rates in models.yaml.
+        """
+        return self.usage.get("cost")
+
+
+def call_usage(model, messages: list, text: str, usage: dict, latency: float, cached: bool = False) -> dict:
+    """
+    Builds the usage of a model call. When the provider did not report it (e.g. streamed
+    responses of some providers), the tokens are counted offline and `estimated` is set.
+
+    Args:
+        model (Model): The model called.
+        messages (list): The request messages.
+        text (str): The response text.
+        usage (dict): The usage reported by the provider, if any.
+        latency (float): The duration of the call, in seconds.
+        cached (bool): Whether the response came from the completion cache: no token was billed.
+
+    Returns:
+        dict: model (configuration key), prompt_tokens, completion_tokens, total_tokens,
+            cost (None without rates), latency, cached and estimated.
+    """
+    estimated = False
+    if cached:
+        prompt_tokens, completion_tokens = 0, 0
+    elif usage and usage.get("completion_tokens") is not None:
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens") or 0, usage["completion_tokens"]
+    else:
+        prompt_tokens = sum(model.count_tokens(message["content"]) for message in messages)
+        completion_tokens = model.count_tokens(text) if text else 0
+        estimated = True
+    return {
+        "model": model.model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cost": model.price(prompt_tokens, completion_tokens),
+        "latency": latency,
+        "cached": cached,
+        "estimated": estimated,
+    }
+
+
+def add_usage(totals: dict, usage: dict) -> dict:
+    """
+    Adds the usage of a call (or other totals) to running totals: calls, tokens, cost and latency.
+
+    Args:
+        totals (dict): The totals, updated in place.
+        usage (dict): The usage of the call (see `call_usage`), or totals.
+
+    Returns:
+        dict: The totals.
+    """
+    with _lock:
+        totals["calls"] = totals.get("calls", 0) + usage.get("calls", 1)
+        for field in TOKEN_FIELDS:
+            totals[field] = totals.get(field, 0) + (usage.get(field) or 0)
+        if usage.get("cost") is not None:
+            totals["cost"] = totals.get("cost", 0.0) + usage["cost"]
+        totals["latency"] = totals.get("latency", 0.0) + (usage.get("latency") or 0.0)
+    return totals
+
+
+def sum_usage(usages: list) -> dict:
+    """
+    Sums the usage of several calls. Samples generated in a single request share its usage,
+    which is counted once.
+    """
+    totals, seen = {}, set()
+    for usage in usages:
+        if usage and id(usage) not in seen:
+            seen.add(id(usage))
+            add_usage(totals, usage)
+    return totals
+
+
+def format_usage(usage: dict) -> str:
+    """
+    Formats a usage on one line, e.g. `1,204 tokens (1,150 prompt + 54 completion) · $0.0031`.
+    """
+    text = (
+        f"{usage.get('total_tokens', 0):,} tokens "
+        f"({usage.get('prompt_tokens', 0):,} prompt + {usage.get('completion_tokens', 0):,} completion)"
+    )
+    if usage.get("estimated"):
+        text += " estimated"
+    if usage.get("cached"):
+        text += " · cached"
+    if usage.get("cost") is not None:
+        text += f" · ${usage['cost']:.4f}"
+    return text
@@ -1,33 +1,79 @@
 import logging
+import sys
+from typing import List
+
 import typer
-from rich.traceback import install
-from rich.logging import RichHandler
 from rich import print
 
-# Setup logging and install Rich traceback for beautiful error reporting
+
+class DeferredRichHandler(logging.Handler):
+    """
+    Logging handler creating the RichHandler on the first record, as importing
+    rich's logging and traceback modules slows down every command.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.handler = None
+
+    def emit(self, record):
+        if self.handler is None:
+            from rich.logging import RichHandler
+
+            self.handler = RichHandler(rich_tracebacks=True)
+            self.handler.setFormatter(self.formatter)
+        self.handler.handle(record)
+
+
+def rich_excepthook(*exc_info):
+    # install Rich traceback for beautiful error reporting, on the first uncaught exception
+    from rich.traceback import install
+
+    install()
+    sys.excepthook(*exc_info)
+
+
+# Setup logging and Rich traceback, both loaded on first use
 logging.basicConfig(
     level="INFO",
     format="%(message)s",
     datefmt="[%X]",
-    handlers=[RichHandler(rich_tracebacks=True)],
+    handlers=[DeferredRichHandler()],
 )
-install()
+sys.excepthook = rich_excepthook
 
 app = typer.Typer()
 
 @app.command()
-def models():
+def models(
+    check: bool = typer.Option(False, help="Probe every model concurrently"),
+    timeout: float = typer.Option(10, help="Timeout of each probe, in seconds"),
+):
     from instruct.llm_engine.model_loader import ModelLoader
+    from instruct.llm_engine.health import check_models, get_model_health
 
     model_loader = ModelLoader()
     models = model_loader.models
-    
+    health = get_model_health()
+
+    if check:
+        check_models(models, timeout=timeout, health=health)
+
     print(f"[bold]Available models:[/bold]")
     for model in models:
-        print(f"[bold green]{model.name}[/bold green] [dim]({model.model})[/dim]")
-    # TODO perform a health check on the models  
+        stats = health.stats.get(model.model)
+        if stats is None:
+            status = "[dim]not checked[/dim]"
+        else:
+            state = "[green]healthy[/green]" if health.is_healthy(model) else "[red]unhealthy[/red]"
+            latency = f"{stats['latency'] * 1000:.0f} ms" if stats["latency"] is not None else "n/a"
+            status = f"{state} [dim]latency {latency}, errors {stats['error_rate'] * 100:.0f}%[/dim]"
+            if check and stats.get("last_error"):
+                status += f" [dim red]{stats['last_error'][:80]}[/dim red]"
+        print(f"[bold green]{model.name}[/bold green] [dim]({model.model})[/dim] {status}")
 
     print("[blue]Note: [/blue] [bold]instruct[/bold] uses the first model in the list which [bold blue]name[/bold blue] matches with the first in the `.instruct` file's shebang.")
+    print("[blue]Note: [/blue] with [bold]routing: fastest[/bold] in the `.instruct` header, the fastest healthy compatible model is used, with failover.")
     print("[bold blue]See instruct file structure doc[/bold blue] to learn more.")
 
 
@@ -42,8 +88,42 @@ def run(
     model: str = typer.Option(None, help="Model to use"),
     interactivity: bool = typer.Option(True, help="Enable interactivity"),
     gui: bool = typer.Option(True, help="Launch GUI"),
+    batch: str = typer.Option(None, help="Inputs JSONL file: run once per line"),
+    workers: int = typer.Option(8, help="Maximum number of concurrent calls in batch mode"),
+    hedge: bool = typer.Option(False, help="Send the prompt to the next compatible model too if the first one is slow to answer"),
+    hedge_delay: float = typer.Option(2.0, help="Seconds to wait for a first token before hedging"),
 ):
-    if gui:  # Run in GUI mode
+    from instruct.llm_engine.model_loader import ModelLoader
+
+    # warm up the connections of the models configured with `preconnect: true` while the template is parsed
+    ModelLoader().preconnect()
+
+    if batch:  # Run once per input record
+        from instruct.instruct import Instruct
+        from instruct.batch import read_records
+
+        output = output or f"{batch.rsplit('.', 1)[0]}.results.jsonl"
+        records = read_records(batch)
+        instruct = Instruct(file, forced_model=model)
+        results = instruct.run_batch(
+            records,
+            output=output,
+            workers=workers,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            hedge=hedge,
+            hedge_delay=hedge_delay,
+        )
+        failed = sum(result is None for result in results)
+        print(f"[bold green]{len(results) - failed}[/bold green]/{len(results)} records written to [bold]{output}[/bold]")
+        if failed:
+            print(f"[bold red]{failed} failed[/bold red]: run the same command again to retry them.")
+        if instruct.total_usage:
+            from rich.markup import escape
+            from instruct.llm_engine.usage import format_usage
+
+            print(f"[dim]{escape(format_usage(instruct.total_usage))}[/dim]")
+    elif gui:  # Run in GUI mode
         from instruct.gui.run import run_gui
 
         run_gui(
@@ -68,6 +148,8 @@ def run(
             model=model,
             ask_feedback=feedback,
             interactivity=interactivity,
+            hedge=hedge,
+            hedge_delay=hedge_delay,
         )
 
 
@@ -87,6 +169,272 @@ def sample(
         print(values)
 
 
+@app.command("compile")
+def compile_bundle(
+    directory: str,
+    output: str = typer.Option(None, help="Bundle file (default: <directory>/instruct.bundle)"),
+):
+    from instruct.bundle import compile_bundle
+
+    bundle_path, compiled, skipped = compile_bundle(directory, output)
+
+    print(f"[bold green]{len(compiled)}[/bold green] Instruct files compiled into [bold]{bundle_path}[/bold]")
+    for filepath in skipped:
+        print(f"[yellow]Skipped[/yellow] [dim]{filepath}[/dim]")
+    print(f"[blue]Note: [/blue] set [bold]INSTRUCT_BUNDLE={bundle_path}[/bold] to load it. Stale entries fall back to the source files.")
+
+
+@app.command()
+def bench(
+    file: str = typer.Argument(None, help="Instruct file to benchmark (default: a built-in template)"),
+    rounds: int = typer.Option(200, help="Timed calls of each local step"),
+    model: List[str] = typer.Option(None, help="Model name or key to benchmark over the network (repeatable)"),
+    all_models: bool = typer.Option(False, "--all-models", help="Benchmark every configured model"),
+    model_rounds: int = typer.Option(3, help="Completions per model"),
+    output: str = typer.Option(None, help="Write the JSON report to this file"),
+    baseline: str = typer.Option(None, help="Compare with this JSON report, exit code 1 on regression"),
+    tolerance: float = typer.Option(0.2, help="Relative slowdown flagged as a regression"),
+):
+    from rich.markup import escape
+    from instruct.bench import compare, load_report, run_bench, save_report
+    from instruct.llm_engine.model_loader import ModelLoader
+
+    model = model or []
+    models = [m for m in ModelLoader().models if all_models or m.name in model or m.model in model]
+    logging.disable(logging.INFO)  # runs log each call
+    try:
+        report = run_bench(file, rounds, models, model_rounds)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    print(f"[bold]Benchmarks[/bold] [dim]({file or 'built-in template'}, median of {rounds} rounds)[/dim]")
+    for name, result in report["benchmarks"].items():
+        if result["unit"] == "s":
+            value = f"{result['median'] * 1000:10.3f} ms"
+        else:
+            value = f"{result['median']:10.1f} {result['unit']}"
+        ops = f" [dim]({result['ops']:.0f}/s)[/dim]" if result.get("ops") and result["median"] < 0.1 else ""
+        print(f"{escape(name):<48} {value}{ops}")
+    for model_key, error in report["errors"].items():
+        print(f"[bold red]{model_key}[/bold red] [dim red]{error[:80]}[/dim red]")
+
+    if output:
+        save_report(report, output)
+        print(f"Report written to [bold]{output}[/bold]")
+
+    if baseline:
+        comparisons = compare(report, load_report(baseline), tolerance)
+        regressions = [c for c in comparisons if c["regression"]]
+        for comparison in comparisons:
+            color = "red" if comparison["regression"] else "green" if comparison["change"] < -tolerance else "dim"
+            print(f"[{color}]{escape(comparison['name']):<48} {comparison['change'] * 100:+7.1f}%[/{color}]")
+        if regressions:
+            print(f"[bold red]{len(regressions)} regression(s)[/bold red] over {tolerance * 100:.0f}% against [bold]{baseline}[/bold]")
+            raise typer.Exit(1)
+        print(f"[bold green]No regression[/bold green] against [bold]{baseline}[/bold]")
+
+
+@app.command("mock-server")
+def mock_server(
+    host: str = typer.Option("127.0.0.1", help="Interface to listen on"),
+    port: int = typer.Option(8000, help="Port to listen on"),
+    model: str = typer.Option(None, help="Serve the settings of this mock/... model of models.yaml"),
+    response: str = typer.Option(None, help="Response to every request (default: echo of the prompt)"),
+    ttft: float = typer.Option(0.0, help="Time to first token, in seconds"),
+    tokens_per_second: float = typer.Option(None, help="Generation speed (default: unlimited)"),
+    error_rate: float = typer.Option(0.0, help="Probability of a server error (HTTP 500)"),
+    rate_limit_rate: float = typer.Option(0.0, help="Probability of a rate limit error (HTTP 429)"),
+    seed: int = typer.Option(0, help="Seed of the injected failures"),
+):
+    from instruct.llm_engine.mock import MockModel, MockResponder, serve
+
+    if model:
+        from instruct.llm_engine.model_loader import ModelLoader
+
+        mock_models = [m for m in ModelLoader().models if isinstance(m, MockModel) and model in (m.model, m.name)]
+        if not mock_models:
+            print(f"[bold red]No mock model {model} in models.yaml[/bold red]")
+            raise typer.Exit(1)
+        responder = mock_models[0].responder
+    else:
+        responder = MockResponder(response, None, ttft, tokens_per_second, error_rate, rate_limit_rate, seed)
+
+    print(f"Mock OpenAI-compatible API on [bold]http://{host}:{port}/v1[/bold] [dim](Ctrl+C to stop)[/dim]")
+    print(f"[blue]Note: [/blue] use it with an [bold]openai/...[/bold] model of models.yaml with [bold]base_url: http://{host}:{port}/v1[/bold]")
+    try:
+        serve(responder, host, port)
+    except KeyboardInterrupt:
+        pass
+
+
+@app.command()
+def minify(
+    files: List[str],
+    input: str = typer.Option(None, help="Input file with the template values"),
+    tokenizer: str = typer.Option("tiktoken", help="Token counter: tiktoken[:<encoding>], tokenizers:<file>, heuristic"),
+):
+    from instruct.file_value import load_input
+    from instruct.instruct import Instruct
+    from instruct.llm_engine.tokenizer import get_token_counter
+    from instruct.minify import DEFAULT_MINIFY_OPTIONS
+
+    count_tokens = get_token_counter(tokenizer)
+    values = load_input(input) if input else {}
+    total_before, total_after = 0, 0
+
+    for file in files:
+        try:
+            instruct = Instruct(file, **values)
+        except Exception as e:
+            print(f"[yellow]Skipped[/yellow] [dim]{file}[/dim] > {e}")
+            continue
+        # measure with the file's options, or the default ones if minification is not enabled yet
+        options = instruct.minify or DEFAULT_MINIFY_OPTIONS
+        # without input values, a template that cannot be rendered is measured as is
+        instruct.minify = {}
+        before = count_tokens(instruct.render_with() or instruct.raw_template)
+        instruct.minify = options
+        after = count_tokens(instruct.compact(instruct.render_with() or instruct.raw_template))
+        total_before, total_after = total_before + before, total_after + after
+        print(f"[bold]{file}[/bold]: {before} -> [bold green]{after}[/bold green] tokens [dim]({_saving(before, after)})[/dim]")
+
+    print(f"[bold]Total[/bold]: {total_before} -> [bold green]{total_after}[/bold green] tokens [dim]({_saving(total_before, total_after)})[/dim]")
+
+
+def _saving(before, after):
+    return f"-{(before - after) / before * 100:.1f}%" if before else "n/a"
+
+
+@app.command()
+def stats(
+    name: str = typer.Argument(None, help="Only the runs of this Instruct file (name without extension)"),
+    by: str = typer.Option("instruct,version,model", help="Grouping: comma-separated instruct, version, model"),
+    sort: str = typer.Option("cost", help="Order, most first: cost, tokens, latency or runs"),
+    json_output: bool = typer.Option(False, "--json", help="Print the rows as JSON"),
+):
+    from rich.markup import escape
+    from rich.table import Table
+    from instruct.stats import collect_stats
+
+    try:
+        rows = collect_stats(name=name, by=tuple(field.strip() for field in by.split(",") if field.strip()), sort=sort)
+    except ValueError as e:
+        print(f"[bold red]{e}[/bold red]")
+        raise typer.Exit(1)
+
+    if json_output:
+        import json
+
+        sys.stdout.write(json.dumps(rows, indent=2) + "\n")
+        return
+    if not rows:
+        print("No saved runs in [bold]~/.instruct/dataset[/bold]: runs are saved by [bold]instruct run[/bold].")
+        return
+
+    fields = [field for field in ("instruct", "version", "model") if field in rows[0]]
+    table = Table(title="Usage of the saved runs")
+    for field in fields:
+        table.add_column(field.capitalize())
+    for column in ("Runs", "Prompt tokens", "Completion tokens", "Cost", "Median latency"):
+        table.add_column(column, justify="right")
+    for row in rows:
+        untracked = row["runs"] - row["tracked"]
+        table.add_row(
+            *(escape(str(row[field])) for field in fields),
+            f"{row['runs']}" + (f" [dim]({untracked} untracked)[/dim]" if untracked else ""),
+            f"{row['prompt_tokens']:,}",
+            f"{row['completion_tokens']:,}",
+            f"${row['cost']:.4f}" if row["cost"] is not None else "[dim]n/a[/dim]",
+            f"{row['latency']:.2f}s" if row["latency"] is not None else "[dim]n/a[/dim]",
+        )
+    print(table)
+    print("[blue]Note: [/blue] costs need [bold]input_cost[/bold] and [bold]output_cost[/bold] (per million tokens) on the models of models.yaml.")
+
+
+cache_app = typer.Typer(help="Manage the completion cache (~/.instruct/cache)")
+app.add_typer(cache_app, name="cache")
+
+
+@cache_app.command("stats")
+def cache_stats():
+    from instruct.llm_engine.completion_cache import get_completion_cache
+
+    completion_cache = get_completion_cache()
+    stats = completion_cache.stats
+    print(f"[bold]Completion cache[/bold] [dim]({completion_cache.path})[/dim]")
+    print(f"entries: [bold]{stats['entries']}[/bold] ({stats['size'] / 1024:.1f} KiB)")
+    print(f"hits: [bold green]{stats['hits']}[/bold green] misses: [bold]{stats['misses']}[/bold] hit rate: [bold]{stats['hit_rate'] * 100:.1f}%[/bold]")
+
+
+@cache_app.command("clear")
+def cache_clear():
+    from instruct.llm_engine.completion_cache import get_completion_cache
+
+    get_completion_cache().clear()
+    print("[bold]Completion cache cleared[/bold]")
+
+
+dataset_app = typer.Typer(help="Query and migrate the saved runs (~/.instruct/dataset)")
+app.add_typer(dataset_app, name="dataset")
+
+QUERY_COLUMNS = ("instruct", "version", "model", "dateCreated", "evaluation", "query", "response", "usage")
+
+
+@dataset_app.command("query")
+def dataset_query(
+    name: str = typer.Argument(None, help="Only the runs of this Instruct file (name without extension)"),
+    version: int = typer.Option(None, help="Only the runs of this version"),
+    model: str = typer.Option(None, help="Only the runs of this model"),
+    evaluation: str = typer.Option(None, help="Only the runs with this evaluation, or a LIKE pattern with %, e.g. 'bad%'"),
+    since: str = typer.Option(None, help="Only the runs created since this date (ISO 8601)"),
+    until: str = typer.Option(None, help="Only the runs created before this date (ISO 8601)"),
+    limit: int = typer.Option(None, help="The maximum number of runs"),
+    output_format: str = typer.Option("jsonl", "--format", help="Output format: jsonl or csv"),
+    output: str = typer.Option(None, help="Write to this file instead of stdout"),
+):
+    import csv
+    import json
+    from instruct.dataset import query_records
+
+    if output_format not in ("jsonl", "csv"):
+        print(f"[bold red]Unknown format {output_format}, expected jsonl or csv[/bold red]")
+        raise typer.Exit(1)
+    records = query_records(
+        instruct=name, version=version, model=model, evaluation=evaluation, since=since, until=until, limit=limit
+    )
+    f = open(output, "w", encoding="utf-8", newline="") if output else sys.stdout
+    count = 0
+    try:
+        if output_format == "csv":
+            writer = csv.writer(f)
+            writer.writerow(QUERY_COLUMNS)
+        # written as they are read, the whole result is never held in memory
+        for record in records:
+            if output_format == "csv":
+                writer.writerow([
+                    json.dumps(record.get(column), ensure_ascii=False) if isinstance(record.get(column), (dict, list)) else record.get(column)
+                    for column in QUERY_COLUMNS
+                ])
+            else:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        if output:
+            f.close()
+    if output:
+        print(f"[bold]{count}[/bold] runs written to [bold]{output}[/bold]")
+
+
+@dataset_app.command("migrate")
+def dataset_migrate():
+    from instruct.dataset import DatasetStore
+
+    store = DatasetStore()
+    imported = store.migrate()
+    print(f"[bold]{imported}[/bold] runs imported in [bold]{store.path}[/bold]")
+    print("[blue]Note: [/blue] set [bold]INSTRUCT_DATASET_BACKEND=sqlite[/bold] to save and query the runs in it.")
+
+
 def cli():
     app()
 
@@ -0,0 +1,86 @@
+import re
+import textwrap
+
+# Options applied by `minify: true` in the Instruct file header.
+DEFAULT_MINIFY_OPTIONS = {
+    "whitespace": True,
+    "dedupe": True,
+    "compact_json": False,
+}
+
+# Repeated paragraphs shorter than this are kept (closing tags, separators...).
+MIN_DEDUPE_LENGTH = 40
+
+_INNER_SPACES = re.compile(r"(?<=\S)[ \t]{2,}")
+_TRAILING_SPACES = re.compile(r"[ \t]+$", re.MULTILINE)
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def minify_options(header_value) -> dict:
+    """
+    Returns the minification options declared by the `minify` header of an Instruct file.
+
+    The header is either a boolean, or a mapping overriding some of the default options:
+
+        minify:
+          whitespace: true
+          dedupe: true
+          compact_json: true
+
+    Args:
+        header_value (bool | dict): The value of the `minify` header.
+
+    Returns:
+        dict: The options, empty when minification is disabled.
+    """
+    if not header_value:
+        return {}
+    if header_value is True:
+        return dict(DEFAULT_MINIFY_OPTIONS)
+    return {**DEFAULT_MINIFY_OPTIONS, **header_value}
+
+
+def collapse_whitespace(text: str) -> str:
+    """
+    Removes trailing spaces, the common indentation, runs of spaces inside lines
+    and consecutive blank lines. Relative indentation is kept.
+    """
+    text = _TRAILING_SPACES.sub("", text)
+    text = textwrap.dedent(text)
+    text = _INNER_SPACES.sub(" ", text)
+    text = _BLANK_LINES.sub("\n\n", text)
+    return text.strip("\n")
+
+
+def dedupe_blocks(text: str) -> str:
+    """
+    Removes the paragraphs (blocks separated by blank lines) repeating an earlier one.
+    """
+    seen = set()
+    blocks = []
+    for block in re.split(r"\n[ \t]*\n", text):
+        key = block.strip()
+        if len(key) >= MIN_DEDUPE_LENGTH:
+            if key in seen:
+                continue
+            seen.add(key)
+        blocks.append(block)
+    return "\n\n".join(blocks)
+
+
+def minify(text: str, options: dict) -> str:
+    """
+    Compacts a rendered prompt. `compact_json` is applied at render time by the `tojson` filter.
+
+    Args:
+        text (str): The rendered prompt.
+        options (dict): The minification options (see `minify_options`).
+
+    Returns:
+        str: The compacted prompt.
+    """
+    if options.get("dedupe"):
+        text = dedupe_blocks(text)
+    if options.get("whitespace"):
+        text = collapse_whitespace(text)
+    return text
@@ -0,0 +1,116 @@
+import json
+import logging
+import re
+from collections import Counter
+from typing import Callable
+
+from instruct.tags import extract_sections, tag_names
+
+JSON_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+def majority_vote(samples: list, instruct) -> str:
+    """
+    Majority vote on the tags of the Instruct file found in each sample.
+
+    Samples are first grouped by the set of tags they contain (e.g. `<question_to_ask>` vs.
+    `<meeting_recap>`), then, within the largest group, by the content of these tags.
+    Samples without any of the tags are compared on their whole text.
+
+    Returns:
+        str: The first sample of the winning group.
+    """
+    names = tag_names(instruct.tags)
+
+    def structure(sample):
+        return tuple(name for name in names if name in extract_sections(sample, [name]))
+
+    def content(sample):
+        sections = extract_sections(sample, names)
+        if not sections:
+            return _normalize(sample)
+        return tuple((name, _normalize(text)) for name, text in sections.items())
+
+    # Counter.most_common keeps the first seen key among ties
+    winning_structure = Counter(structure(sample) for sample in samples).most_common(1)[0][0]
+    group = [sample for sample in samples if structure(sample) == winning_structure]
+    winning_content = Counter(content(sample) for sample in group).most_common(1)[0][0]
+    return next(sample for sample in group if content(sample) == winning_content)
+
+
+def first_valid_json(samples: list, instruct) -> str:
+    """
+    Returns the first sample that parses as JSON (code fences allowed), or None.
+    """
+    for sample in samples:
+        match = JSON_FENCE_PATTERN.match(sample.strip())
+        try:
+            json.loads(match.group(1) if match else sample)
+            return sample
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def all_samples(samples: list, instruct) -> list:
+    """
+    Returns every sample, without aggregation.
+    """
+    return list(samples)
+
+
+# Aggregation strategies of `Instruct.run(samples=k, aggregate=...)`, by name.
+aggregators = {
+    "majority": majority_vote,
+    "json": first_valid_json,
+    "all": all_samples,
+}
+
+DEFAULT_AGGREGATOR = "majority"
+
+
+def register_aggregator(name: str, aggregator: Callable):
+    """
+    Registers an aggregation strategy for `Instruct.run(samples=k, aggregate=name)`.
+
+    Args:
+        name (str): The strategy name.
+        aggregator (Callable): Takes the list of samples and the Instruct, returns the result.
+    """
+    aggregators[name] = aggregator
+
+
+def get_aggregator(aggregate=DEFAULT_AGGREGATOR) -> Callable:
+    """
+    Returns an aggregation strategy from its name (see `aggregators`), or the function itself.
+    """
+    aggregator = aggregate if callable(aggregate) else aggregators.get(aggregate)
+    if aggregator is None:
+        raise ValueError(f"Unknown aggregation `{aggregate}`, expected one of: {', '.join(aggregators)}")
+    return aggregator
+
+
+def aggregate_samples(samples: list, instruct, aggregate=DEFAULT_AGGREGATOR):
+    """
+    Aggregates the successful samples of a run.
+
+    Args:
+        samples (list): The samples, None for the failed ones.
+        instruct (Instruct): The Instruct that generated them.
+        aggregate (str | Callable): A strategy name (see `aggregators`) or function.
+
+    Returns:
+        The aggregated result, or None if every sample failed.
+    """
+    aggregator = get_aggregator(aggregate)
+    samples = [sample for sample in samples if sample]
+    if not samples:
+        return None
+    result = aggregator(samples, instruct)
+    if result is None:
+        logging.warning(f"{instruct} > no sample passed the `{getattr(aggregator, '__name__', aggregate)}` aggregation")
+    return result
@@ -0,0 +1,72 @@
+import statistics
+from pathlib import Path
+
+from instruct.dataset import query_records
+
+GROUP_FIELDS = ("instruct", "version", "model")
+SORT_FIELDS = ("cost", "tokens", "latency", "runs")
+
+
+def collect_stats(dataset_path: Path = None, name: str = None, by: tuple = GROUP_FIELDS, sort: str = "cost") -> list:
+    """
+    Aggregates the tokens, cost and latency of the saved runs, to find the prompts worth optimizing.
+
+    Args:
+        dataset_path (Path): The datasets directory. Defaults to `~/.instruct/dataset`.
+        name (str): Only aggregate the runs of this Instruct file.
+        by (tuple): The grouping, among `instruct`, `version` and `model`.
+        sort (str): The order of the rows, most first: `cost`, `tokens`, `latency` or `runs`.
+
+    Returns:
+        list: One dict per group: the group fields, runs, tracked (runs with a usage),
+            prompt_tokens, completion_tokens, total_tokens, cost (None if no run was priced),
+            latency (median, seconds) and cached runs.
+    """
+    unknown = [field for field in by if field not in GROUP_FIELDS]
+    if unknown or sort not in SORT_FIELDS:
+        raise ValueError(f"Group by {', '.join(GROUP_FIELDS)} and sort by {', '.join(SORT_FIELDS)}")
+
+    groups = {}
+    for record in query_records(dataset_path, instruct=name):
+        values = {"instruct": record["instruct"], "version": record["version"], "model": record.get("model")}
+        key = tuple(values[field] for field in by)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                **{field: values[field] for field in by},
+                "runs": 0,
+                "tracked": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_tokens": 0,
+                "cost": None,
+                "cached": 0,
+                "latencies": [],
+            }
+        group["runs"] += 1
+        usage = record.get("usage")
+        if not usage:
+            continue  # saved before usage tracking
+        group["tracked"] += 1
+        for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            group[field] += usage.get(field) or 0
+        if usage.get("cost") is not None:
+            group["cost"] = (group["cost"] or 0.0) + usage["cost"]
+        if usage.get("cached"):
+            group["cached"] += 1
+        if usage.get("latency") is not None:
+            group["latencies"].append(usage["latency"])
+
+    rows = []
+    for group in groups.values():
+        latencies = group.pop("latencies")
+        group["latency"] = statistics.median(latencies) if latencies else None
+        rows.append(group)
+
+    sort_keys = {
+        "cost": lambda row: (row["cost"] or 0.0, row["total_tokens"]),
+        "tokens": lambda row: row["total_tokens"],
+        "latency": lambda row: row["latency"] or 0.0,
+        "runs": lambda row: row["runs"],
+    }
+    return sorted(rows, key=sort_keys[sort], reverse=True)
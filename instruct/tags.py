@@ -0,0 +1,233 @@
+import logging
+import re
+
+OPENING_TAG_PATTERN = re.compile(r"<([A-Za-z_][\w.\-]*)(?:\s[^<>]*)?>")
+
+
+def tag_names(tags: list) -> list:
+    """
+    Returns the names of the opening tags, e.g. `meeting_recap` for `<meeting_recap>`.
+
+    Args:
+        tags (list): Tags as found in a template (see `Instruct.tags`).
+
+    Returns:
+        list: The unique tag names, in order of first appearance.
+    """
+    names = []
+    for tag in tags:
+        match = OPENING_TAG_PATTERN.fullmatch(tag)
+        if match and match.group(1) not in names:
+            names.append(match.group(1))
+    return names
+
+
+def extract_sections(text: str, names: list = None) -> dict:
+    """
+    Extracts the content of the `<name>...</name>` sections of a model output.
+    Only the first occurrence of each tag is kept; unclosed tags are ignored.
+
+    Args:
+        text (str): The model output.
+        names (list): The tag names to extract. Defaults to every tag found in the text.
+
+    Returns:
+        dict: The content of each section found, by tag name.
+    """
+    if text is None:
+        return {}
+    if names is None:
+        names = tag_names([match.group(0) for match in OPENING_TAG_PATTERN.finditer(text)])
+    sections = {}
+    for name in names:
+        match = re.search(
+            rf"<{re.escape(name)}(?:\s[^<>]*)?>(.*?)</{re.escape(name)}\s*>", text, re.DOTALL
+        )
+        if match:
+            sections[name] = match.group(1)
+    return sections
+
+
+# Most providers accept a few stop sequences only (4 for OpenAI).
+MAX_STOP_SEQUENCES = 4
+
+
+def stop_sequences(declared, tags: list) -> list:
+    """
+    Builds the stop sequences of an Instruct from its `stop` header.
+
+    A tag name of the template (e.g. `answer`, listed in `Instruct.tags`) stops the generation
+    right after its closing tag `</answer>`. Any other string is used as is.
+
+    Args:
+        declared (str | list): The `stop` header value.
+        tags (list): The tags of the template.
+
+    Returns:
+        list: The stop sequences, at most MAX_STOP_SEQUENCES.
+    """
+    if not declared:
+        return []
+    if isinstance(declared, str):
+        declared = [declared]
+    names = tag_names(tags)
+    sequences = []
+    for value in declared:
+        value = str(value)
+        if value in names:
+            sequences.append(f"</{value}>")
+        else:
+            if re.fullmatch(r"[A-Za-z_][\w.\-]*", value):
+                logging.warning(f"`stop: {value}` is not a tag of the template, it is used as a plain string")
+            sequences.append(value)
+    if len(sequences) > MAX_STOP_SEQUENCES:
+        logging.warning(f"Only the first {MAX_STOP_SEQUENCES} stop sequences are used: {sequences}")
+    return sequences[:MAX_STOP_SEQUENCES]
+
+
+TAG_PATTERN = re.compile(r"<(/?)([A-Za-z_][\w.\-]*)(?:\s[^<>]*)?(/?)>")
+
+# What a tag can look like before its `>` has arrived.
+PARTIAL_TAG_PATTERN = re.compile(r"</?(?:[A-Za-z_][\w.\-]*(?:\s[^<>]*)?/?)?")
+MAX_TAG_LENGTH = 256
+
+
+class SectionEvent:
+    """
+    A `<tag>...</tag>` section of a model output.
+
+    Attributes:
+        name (str): The tag name.
+        content (str): The text between the opening and the closing tags.
+        path (tuple): The names of the enclosing sections, outermost first.
+        complete (bool): False for a section left open at the end of the output.
+    """
+
+    __slots__ = ("name", "content", "path", "complete")
+
+    def __init__(self, name: str, content: str, path: tuple = (), complete: bool = True):
+        self.name = name
+        self.content = content
+        self.path = path
+        self.complete = complete
+
+    def __repr__(self):
+        return f"SectionEvent(name={self.name!r}, path={self.path!r}, complete={self.complete!r}, content={self.content!r})"
+
+
+class TagStreamParser:
+    """
+    Incremental parser of the `<tag>` sections of a streamed model output.
+
+    Each section is emitted as soon as its closing tag arrives, so that downstream work can
+    start on the first sections while the next ones are generated. Sections can be nested.
+    Malformed output is tolerated: a stray closing tag is ignored, a closing tag also closes
+    the sections opened inside it and left open, and the sections still open at the end are
+    emitted as incomplete by `close`.
+
+    Attributes:
+        names (list): The tag names to parse, every tag if None.
+        sections (dict): The content of the complete sections, by tag name (first occurrence).
+    """
+
+    def __init__(self, names: list = None):
+        self.names = names
+        self.sections = {}
+        self._text = []
+        self._length = 0
+        self._pending = ""
+        self._stack = []  # (name, content start)
+
+    def feed(self, delta: str) -> list:
+        """
+        Parses the next delta of the output.
+
+        Args:
+            delta (str): The text generated since the previous delta.
+
+        Returns:
+            list: The SectionEvents of the sections closed by this delta.
+        """
+        events = []
+        text = self._pending + delta
+        self._pending = ""
+        position = 0
+        while True:
+            start = text.find("<", position)
+            if start == -1:
+                break
+            match = TAG_PATTERN.match(text, start)
+            if match is None:
+                if len(text) - start <= MAX_TAG_LENGTH and PARTIAL_TAG_PATTERN.fullmatch(text, start):
+                    # the tag may be completed by the next delta
+                    self._pending = text[start:]
+                    text = text[:start]
+                    break
+                position = start + 1
+                continue
+            closing, name, self_closing = match.groups()
+            position = match.end()
+            if self_closing or (self.names is not None and name not in self.names):
+                continue
+            offset = self._length + len(text[:start])
+            if not closing:
+                self._stack.append((name, self._length + position))
+            elif any(open_name == name for open_name, _ in self._stack):
+                while self._stack:
+                    open_name, content_start = self._stack.pop()
+                    if open_name == name:
+                        events.append(self._event(name, content_start, offset, text[:start]))
+                        break
+        self._text.append(text)
+        self._length += len(text)
+        return events
+
+    @property
+    def received(self) -> int:
+        """
+        The length of the output received so far.
+        """
+        return self._length + len(self._pending)
+
+    @property
+    def text(self) -> str:
+        """
+        The output received so far.
+        """
+        return "".join(self._text) + self._pending
+
+    def feed_text(self, text: str) -> list:
+        """
+        Same as `feed`, with the whole text received so far (e.g. from a `stream_callback`).
+        """
+        return self.feed(text[self.received:])
+
+    def _event(self, name, content_start, content_end, text_so_far) -> SectionEvent:
+        full_text = "".join(self._text) + text_so_far
+        event = SectionEvent(
+            name,
+            full_text[content_start:content_end],
+            tuple(open_name for open_name, _ in self._stack),
+        )
+        self.sections.setdefault(name, event.content)
+        return event
+
+    def close(self) -> list:
+        """
+        Ends the output: the sections still open are emitted as incomplete,
+        with the text generated after their opening tag.
+
+        Returns:
+            list: The SectionEvents of the incomplete sections, innermost first.
+        """
+        self._text.append(self._pending)
+        self._length += len(self._pending)
+        self._pending = ""
+        full_text = "".join(self._text)
+        events = []
+        while self._stack:
+            name, content_start = self._stack.pop()
+            events.append(
+                SectionEvent(name, full_text[content_start:], tuple(n for n, _ in self._stack), complete=False)
+            )
+        return events
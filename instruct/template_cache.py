@@ -0,0 +1,254 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import jinja2
+import jinja2.meta
+import yaml
+
+DEFAULT_CACHE_SIZE = 256
+
+# Template values injected by Instruct itself, not expected from the caller.
+RESERVED_TEMPLATE_VALUES = {"model", "_instruct_compact_json"}
+
+TAG_PATTERN = re.compile(r"(<[^>]*>)")
+
+# Template value set by Instruct to render `tojson` without indentation nor spaces.
+COMPACT_JSON = "_instruct_compact_json"
+
+
+@jinja2.pass_context
+def tojson(context, value, indent=None):
+    """
+    The `tojson` filter, compacted when the Instruct enables `minify.compact_json`.
+    """
+    if not context.get(COMPACT_JSON):
+        return jinja2.filters.do_tojson(context.eval_ctx, value, indent)
+    policies = context.environment.policies
+    return jinja2.utils.htmlsafe_json_dumps(
+        value,
+        dumps=policies["json.dumps_function"],
+        **{**policies["json.dumps_kwargs"], "separators": (",", ":")},
+    )
+
+
+# Shared Jinja2 environment used to compile every Instruct template.
+environment = jinja2.Environment()
+environment.filters["tojson"] = tojson
+
+
+class ParsedInstruct:
+    """
+    The parsed content of an Instruct file: its YAML header and its compiled template.
+
+    Attributes:
+        header (dict): The parsed YAML header.
+        raw_template (str): The template source, without the header.
+        template (jinja2.Template): The compiled Jinja2 template.
+        digest (str): The sha256 digest of the whole file content.
+        template_values (list): The undeclared variables of the template, from its AST.
+        tags (list): The tags found in the template, in the format: <tag_name>
+    """
+
+    def __init__(
+        self,
+        header: dict,
+        raw_template: str,
+        template: jinja2.Template,
+        digest: str,
+        template_values: list,
+        tags: list,
+    ):
+        self.header = header
+        self.raw_template = raw_template
+        self.template = template
+        self.digest = digest
+        self.template_values = template_values
+        self.tags = tags
+
+
+def split_content(content: str):
+    """
+    Splits the content of an Instruct file into its parsed header and its raw template.
+
+    Args:
+        content (str): The content of the Instruct file.
+
+    Returns:
+        tuple: The header (dict) and the raw template (str).
+    """
+    parts = content.split("\n---\n", 1)
+    if len(parts) != 2:
+        raise ValueError(
+            "File content is not properly formatted. Expected a header and a template separated by '\\n---\\n'"
+        )
+
+    header_content, raw_template = parts
+
+    header = yaml.safe_load(header_content)
+    if header is None:
+        raise ValueError("Header content is empty or not valid YAML")
+
+    return header, raw_template
+
+
+def compile_content(content: str) -> dict:
+    """
+    Parses the content of an Instruct file and compiles its template to a Python code object.
+
+    Args:
+        content (str): The content of the Instruct file.
+
+    Returns:
+        dict: header, raw_template, code, template_values and tags of the Instruct file.
+    """
+    header, raw_template = split_content(content)
+    ast = environment.parse(raw_template)
+    template_values = sorted(
+        jinja2.meta.find_undeclared_variables(ast) - RESERVED_TEMPLATE_VALUES
+    )
+    return {
+        "header": header,
+        "raw_template": raw_template,
+        "code": environment.compile(ast),
+        "template_values": template_values,
+        "tags": TAG_PATTERN.findall(raw_template),
+    }
+
+
+def template_from_code(code) -> jinja2.Template:
+    """
+    Builds a Jinja2 template from a code object produced by `compile_content`.
+    """
+    return environment.template_class.from_code(
+        environment, code, environment.make_globals(None)
+    )
+
+
+def parse_content(content: str) -> ParsedInstruct:
+    """
+    Parses the content of an Instruct file and compiles its template.
+
+    Args:
+        content (str): The content of the Instruct file.
+
+    Returns:
+        ParsedInstruct: The parsed Instruct file.
+    """
+    compiled = compile_content(content)
+    return ParsedInstruct(
+        compiled["header"],
+        compiled["raw_template"],
+        template_from_code(compiled["code"]),
+        content_digest(content),
+        compiled["template_values"],
+        compiled["tags"],
+    )
+
+
+def content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class TemplateCache:
+    """
+    Process-wide LRU cache of parsed Instruct files.
+
+    Entries are keyed by the real path of the file and validated against its
+    modification time and size. When those change, the content hash decides whether
+    the cached template can be kept or the file must be parsed again.
+
+    Attributes:
+        maxsize (int): The maximum number of files kept in the cache.
+        hits (int): The number of lookups served from the cache.
+        misses (int): The number of lookups that required a parse.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filepath: str) -> ParsedInstruct:
+        """
+        Returns the parsed Instruct file, parsing it only if it is not cached or has changed.
+
+        Args:
+            filepath (str): The filepath of the Instruct file.
+
+        Returns:
+            ParsedInstruct: The parsed Instruct file.
+        """
+        path = os.path.realpath(filepath)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+
+        with open(path, "r") as file:
+            content = file.read()
+
+        with self._lock:
+            if entry is not None and entry[1].digest == content_digest(content):
+                # touched but unchanged: keep the compiled template
+                parsed = entry[1]
+                self.hits += 1
+            else:
+                parsed = parse_content(content)
+                self.misses += 1
+            self._store(path, signature, parsed)
+            return parsed
+
+    def preload(self, filepath: str, signature: tuple, parsed: ParsedInstruct):
+        """
+        Stores an already parsed Instruct file, e.g. loaded from a precompiled bundle.
+
+        Args:
+            filepath (str): The filepath of the Instruct file.
+            signature (tuple): The (mtime_ns, size) of the file the entry was parsed from.
+            parsed (ParsedInstruct): The parsed Instruct file.
+        """
+        with self._lock:
+            self._store(os.path.realpath(filepath), signature, parsed)
+
+    def _store(self, path, signature, parsed: ParsedInstruct):
+        self._entries[path] = (signature, parsed)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all the entries and resets the hit/miss counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self) -> dict:
+        """
+        Returns the cache statistics.
+
+        Returns:
+            dict: hits, misses, current size and maximum size of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+template_cache = TemplateCache(int(os.environ.get("INSTRUCT_TEMPLATE_CACHE_SIZE", DEFAULT_CACHE_SIZE)))
@@ -0,0 +1,92 @@
+import logging
+
+# Tokens added by the chat format around the content of a message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Maximum number of re-renderings when trimming a template value.
+MAX_TRIM_ATTEMPTS = 5
+
+
+class TokenBudgetExceeded(Exception):
+    """
+    Raised when a prompt does not fit in the model's context window, before any request is sent.
+    """
+
+
+def prompt_budget(model, max_tokens: int):
+    """
+    Returns the number of tokens available for the prompt, or None if the model's
+    context window is unknown.
+    """
+    if not model.context_window:
+        return None
+    return model.context_window - (max_tokens or 0) - MESSAGE_OVERHEAD_TOKENS
+
+
+def fit_prompt(instruct, model, max_tokens: int, prompt: str = None) -> str:
+    """
+    Fits the prompt of an Instruct in the token budget of a model.
+
+    The rendered prompt is counted with the model's offline tokenizer against its
+    context window minus `max_tokens`. When it overflows, the template values listed in
+    the `token_budget.trim` header of the Instruct file are truncated, in order, until
+    the prompt fits:
+
+        token_budget:
+          trim:
+            - notes      # trimmed first
+            - context
+
+    Args:
+        instruct (Instruct): The Instruct to fit.
+        model (Model): The model the prompt is sent to.
+        max_tokens (int): The maximum number of tokens of the completion.
+        prompt (str): The prompt to fit. Defaults to the Instruct's prompt.
+
+    Returns:
+        str: The prompt, trimmed if needed.
+
+    Raises:
+        TokenBudgetExceeded: If the prompt still overflows once all trimmable values are trimmed.
+    """
+    if prompt is None:
+        prompt = instruct.prompt
+    budget = prompt_budget(model, max_tokens)
+    if budget is None or prompt is None:
+        return prompt
+
+    prompt_tokens = model.count_tokens(prompt)
+    if prompt_tokens <= budget:
+        return prompt
+
+    overrides = {}
+    if not instruct.no_templating:
+        # the values as rendered: a composed Instruct is trimmed through its prompt
+        values = instruct._resolve_kwargs(instruct.kwargs)
+        for name in instruct.token_budget.get("trim", []):
+            if name not in instruct.kwargs:
+                continue
+            text = str(values[name])
+            for _ in range(MAX_TRIM_ATTEMPTS):
+                overflow = prompt_tokens - budget
+                value_tokens = model.count_tokens(text)
+                if value_tokens <= overflow:
+                    text = ""
+                else:
+                    # keep the head of the value, proportionally to the tokens to remove
+                    text = text[: int(len(text) * (value_tokens - overflow) / value_tokens)]
+                overrides[name] = text
+                prompt = instruct.compact(instruct.render_with(**overrides))
+                prompt_tokens = model.count_tokens(prompt)
+                if prompt_tokens <= budget or not text:
+                    break
+
+            logging.info(f"{instruct} > `{name}` trimmed to fit {model.name} context window")
+            if prompt_tokens <= budget:
+                return prompt
+
+    raise TokenBudgetExceeded(
+        f"{instruct} > prompt is {prompt_tokens} tokens, {model.name} allows {budget} "
+        f"({model.context_window} context window - {max_tokens} max_tokens). "
+        f"Declare the values that can be trimmed in the `token_budget.trim` header."
+    )
@@ -0,0 +1,302 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Hooks receiving every span of the process, see `register_hook`.
+hooks = []
+
+_current_span = ContextVar("instruct_current_span", default=None)
+
+
+def register_hook(hook):
+    """
+    Registers a hook receiving every span of the process.
+
+    A hook is a callable taking the finished `Span`. It can also define `on_start(span)`,
+    called when the span starts. Hooks can also be added to a single Instruct or Model
+    (`instruct.hooks.append(hook)`): they then receive the spans of its runs, model calls included.
+
+    Args:
+        hook (Callable): The hook.
+    """
+    hooks.append(hook)
+
+
+def unregister_hook(hook):
+    if hook in hooks:
+        hooks.remove(hook)
+
+
+def _new_id(bits: int) -> str:
+    return f"{int.from_bytes(os.urandom(bits // 8), 'big'):0{bits // 4}x}"
+
+
+class Span:
+    """
+    A timed step of a run: model config load, file parse, render, model request,
+    time to first token, stream, post-processing.
+
+    Attributes:
+        name (str): The step, e.g. `instruct.parse` or `model.ttft`.
+        attributes (dict): The details of the step (file, model...).
+        start (int): The start time, in nanoseconds since the epoch.
+        end (int): The end time, in nanoseconds since the epoch.
+        trace_id (str): The id shared by all the spans of a run (OpenTelemetry format).
+        span_id (str): The id of the span.
+        parent_id (str): The id of the enclosing span, if any.
+        error (str): The error that ended the step, if any.
+    """
+
+    __slots__ = ("name", "attributes", "start", "end", "trace_id", "span_id", "parent_id", "error", "hooks", "_previous")
+
+    recording = True
+
+    def __init__(self, name: str, hooks: list, parent: "Span" = None, start: int = None, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = start or time.time_ns()
+        self.end = None
+        self.trace_id = parent.trace_id if parent is not None else _new_id(128)
+        self.span_id = _new_id(64)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.error = None
+        self.hooks = hooks
+        self._previous = None
+        for hook in hooks:
+            on_start = getattr(hook, "on_start", None)
+            if on_start is not None:
+                _call_hook(on_start, self)
+
+    @property
+    def duration(self) -> float:
+        """
+        The duration of the span, in seconds.
+        """
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, end: int = None, error: str = None):
+        """
+        Ends the span and sends it to its hooks.
+        """
+        self.end = end or time.time_ns()
+        self.error = error
+        for hook in self.hooks:
+            _call_hook(hook, self)
+
+    def child(self, name: str, start: int, end: int, **attributes) -> "Span":
+        """
+        Records a finished child span, measured by the caller.
+        """
+        span = Span(name, self.hooks, self, start, **attributes)
+        span.finish(end)
+        return span
+
+    def __enter__(self):
+        # spans started meanwhile are children of this one
+        self._previous = _current_span.get()
+        _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_span.set(self._previous)
+        self.finish(error=str(exc_value) if exc_value is not None else None)
+        return False
+
+    def __repr__(self):
+        return f"Span(name={self.name!r}, duration={self.duration:.6f}, attributes={self.attributes!r})"
+
+
+class NoopSpan:
+    """
+    The span returned when no hook is registered: recording costs nothing.
+    """
+
+    recording = False
+
+    def set(self, **attributes):
+        pass
+
+    def finish(self, end: int = None, error: str = None):
+        pass
+
+    def child(self, name: str, start: int, end: int, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def _call_hook(hook, span):
+    try:
+        hook(span)
+    except Exception as e:
+        logging.error(f"🔴 Error in tracing hook {hook}: {e}")
+
+
+def start_span(name: str, owner_hooks: list = (), **attributes):
+    """
+    Starts a span, child of the current span if any. Use it as a context manager to make it
+    the current span, or call `finish()`.
+
+    The span goes to the process hooks, the hooks of its owner (Instruct or Model) and the
+    hooks of its parent spans. Without any, the shared NOOP_SPAN is returned.
+
+    Args:
+        name (str): The step name.
+        owner_hooks (list): The hooks of the Instruct or Model recording the span.
+        **attributes: The details of the step.
+
+    Returns:
+        Span | NoopSpan: The started span.
+    """
+    parent = _current_span.get()
+    if not hooks and not owner_hooks and parent is None:
+        return NOOP_SPAN
+    span_hooks = list(hooks)
+    for hook in (parent.hooks if parent is not None else []) + list(owner_hooks):
+        if hook not in span_hooks:
+            span_hooks.append(hook)
+    return Span(name, span_hooks, parent, **attributes)
+
+
+@contextmanager
+def activate(span):
+    """
+    Makes a span the current one within a block, without finishing it. Generators use it
+    around each step instead of `with span`: a span current across a `yield` would leak
+    into the caller, and stay current if the generator is abandoned.
+    """
+    if not span.recording:
+        yield span
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+class SpanCollector:
+    """
+    A hook keeping the spans it receives, e.g. to report the steps of a run.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def durations(self) -> dict:
+        """
+        Returns the total duration of each step, in seconds, in order of completion.
+        """
+        durations = {}
+        for span in self.spans:
+            durations[span.name] = durations.get(span.name, 0.0) + span.duration
+        return durations
+
+    def summary(self) -> str:
+        """
+        Returns the durations of the steps on one line, e.g. `instruct.parse 1.2ms · model.ttft 0.45s`.
+        """
+        return " · ".join(
+            f"{name} {duration * 1000:.1f}ms" if duration < 1 else f"{name} {duration:.2f}s"
+            for name, duration in self.durations().items()
+        )
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+def otlp_span(span: Span) -> dict:
+    """
+    Converts a span to the OpenTelemetry protocol (OTLP) JSON representation.
+    """
+    def value(attribute):
+        if isinstance(attribute, bool):
+            return {"boolValue": attribute}
+        if isinstance(attribute, int):
+            return {"intValue": str(attribute)}
+        if isinstance(attribute, float):
+            return {"doubleValue": attribute}
+        return {"stringValue": str(attribute)}
+
+    return {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id or "",
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span.start),
+        "endTimeUnixNano": str(span.end),
+        "attributes": [{"key": key, "value": value(v)} for key, v in span.attributes.items() if v is not None],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+
+
+class JsonLinesExporter:
+    """
+    A hook appending each span to a file, one OTLP JSON span per line.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span):
+        line = json.dumps(otlp_span(span))
+        with self._lock:
+            with open(self.filepath, "a") as f:
+                f.write(line + "\n")
+
+
+class OpenTelemetryExporter:
+    """
+    A hook re-emitting the spans through OpenTelemetry (`pip install opentelemetry-sdk`),
+    with their timings and parent relations, to any configured OpenTelemetry exporter.
+
+    Args:
+        tracer: The OpenTelemetry tracer. Defaults to the global tracer provider's `instruct` tracer.
+    """
+
+    def __init__(self, tracer=None):
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError("OpenTelemetryExporter requires opentelemetry: pip install opentelemetry-sdk") from e
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("instruct")
+        self._spans = {}
+
+    def on_start(self, span: Span):
+        parent = self._spans.get(span.parent_id)
+        context = self._trace.set_span_in_context(parent) if parent is not None else None
+        self._spans[span.span_id] = self.tracer.start_span(
+            span.name, context=context, start_time=span.start, attributes=span.attributes
+        )
+
+    def __call__(self, span: Span):
+        otel_span = self._spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        otel_span.set_attributes({key: value for key, value in span.attributes.items() if value is not None})
+        if span.error:
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=span.end)